@@ -9,6 +9,10 @@ def create_app():
     """创建Flask应用"""
     app = Flask(__name__)
     
+    # 日志（级别和格式由LOG_LEVEL、LOG_LEVELS、LOG_FORMAT配置）
+    from .services.log_config import setup_logging
+    setup_logging()
+    
     # 配置
     app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'dev-secret-key-change-in-production')
     app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
@@ -18,4 +22,10 @@ def create_app():
     from .routes import main
     app.register_blueprint(main)
     
+    # 预热Qwen API连接（配置了API Key时默认开启）
+    if os.getenv('HTTP_PREWARM', 'true' if os.getenv('QWEN_API_KEY') else 'false').lower() == 'true':
+        from .services.http_client import http_client
+        from .services.qwen_service import qwen_service
+        http_client.warmup([qwen_service.api_url])
+    
     return app
@@ -1,4 +1,6 @@
+import os
 import sqlite3
+import threading
 import json
 import uuid
 from datetime import datetime
@@ -10,6 +12,7 @@ class SimpleDB:
     
     def __init__(self, db_path: str = "shelf_scan.db"):
         self.db_path = Path(db_path)
+        self._queue_local = threading.local()
         self.init_database()
     
     def init_database(self):
@@ -17,6 +20,9 @@ class SimpleDB:
         conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
         
+        # WAL模式：读写互不阻塞，多个工作进程可共享缓存表
+        cursor.execute('PRAGMA journal_mode=WAL')
+        
         # 创建扫描记录表
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS scan_records (
@@ -48,6 +54,69 @@ class SimpleDB:
             )
         ''')
         
+        # 创建识别结果缓存表（按图片感知哈希索引）
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS recognition_cache (
+                phash TEXT PRIMARY KEY,
+                books_json TEXT,
+                model_used TEXT,
+                created_at TEXT,
+                last_hit_at TEXT,
+                hit_count INTEGER DEFAULT 0
+            )
+        ''')
+        
+        # 创建书籍信息缓存表（时间字段为Unix时间戳，便于按TTL过期）
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS enrichment_cache (
+                cache_key TEXT PRIMARY KEY,
+                data_json TEXT,
+                size_bytes INTEGER,
+                fetched_at REAL,
+                expires_at REAL,
+                last_hit_at REAL
+            )
+        ''')
+        # 各字段的过期时间（JSON：字段 -> 过期时间），旧版本创建的表没有这一列
+        columns = {row[1] for row in cursor.execute('PRAGMA table_info(enrichment_cache)')}
+        if 'field_expires_json' not in columns:
+            cursor.execute('ALTER TABLE enrichment_cache ADD COLUMN field_expires_json TEXT')
+        
+        # 创建封面缓存表：按内容SHA-256存放的缩略图，以及原始链接到内容摘要的映射（digest为空表示下载失败）
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS cover_blobs (
+                digest TEXT PRIMARY KEY,
+                size_bytes INTEGER,
+                created_at REAL,
+                last_hit_at REAL
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS cover_urls (
+                url TEXT PRIMARY KEY,
+                digest TEXT,
+                fetched_at REAL
+            )
+        ''')
+        
+        # 创建任务队列表：处理中的任务持有租约（lease_owner、lease_expires_at），租约过期后可被重新领取
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS task_queue (
+                task_id TEXT PRIMARY KEY,
+                session_id TEXT,
+                payload_json TEXT,
+                status TEXT,
+                attempts INTEGER DEFAULT 0,
+                max_attempts INTEGER,
+                lease_owner TEXT,
+                lease_expires_at REAL,
+                available_at REAL,
+                created_at TEXT,
+                updated_at REAL,
+                error TEXT
+            )
+        ''')
+        
         # 创建配置表
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS configs (
@@ -61,6 +130,12 @@ class SimpleDB:
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_scan_records_session_id ON scan_records(session_id)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_scan_records_created_at ON scan_records(created_at)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_book_records_scan_id ON book_records(scan_record_id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_recognition_cache_last_hit ON recognition_cache(last_hit_at)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_enrichment_cache_last_hit ON enrichment_cache(last_hit_at)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_enrichment_cache_expires ON enrichment_cache(expires_at)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_cover_blobs_last_hit ON cover_blobs(last_hit_at)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_cover_urls_digest ON cover_urls(digest)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_task_queue_status ON task_queue(status, available_at)')
         
         conn.commit()
         conn.close()
@@ -218,6 +293,440 @@ class SimpleDB:
         conn.close()
         return dict(results)
     
+    def get_recognition_cache_entries(self) -> List[Dict]:
+        """获取所有识别缓存条目（按最近命中时间升序）"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            SELECT phash, model_used, last_hit_at FROM recognition_cache
+            ORDER BY last_hit_at
+        ''')
+        results = cursor.fetchall()
+        
+        conn.close()
+        columns = ['phash', 'model_used', 'last_hit_at']
+        return [dict(zip(columns, row)) for row in results]
+    
+    def get_recognition_cache(self, phash: str) -> Optional[List[Dict]]:
+        """获取缓存的识别结果，并更新命中时间"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute('SELECT books_json FROM recognition_cache WHERE phash = ?', (phash,))
+            result = cursor.fetchone()
+            if not result:
+                return None
+            
+            cursor.execute('''
+                UPDATE recognition_cache SET last_hit_at = ?, hit_count = hit_count + 1
+                WHERE phash = ?
+            ''', (datetime.now().isoformat(), phash))
+            conn.commit()
+            return json.loads(result[0])
+        finally:
+            conn.close()
+    
+    def save_recognition_cache(self, phash: str, books: List[Dict], model_used: str) -> bool:
+        """保存识别结果缓存"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        
+        try:
+            now = datetime.now().isoformat()
+            cursor.execute('''
+                INSERT OR REPLACE INTO recognition_cache
+                (phash, books_json, model_used, created_at, last_hit_at, hit_count)
+                VALUES (?, ?, ?, ?, ?, 0)
+            ''', (phash, json.dumps(books, ensure_ascii=False), model_used, now, now))
+            
+            conn.commit()
+            return True
+        except Exception as e:
+            conn.rollback()
+            raise e
+        finally:
+            conn.close()
+    
+    def delete_recognition_cache(self, phashes: List[str]) -> int:
+        """删除识别缓存条目"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        
+        try:
+            cursor.executemany('DELETE FROM recognition_cache WHERE phash = ?', [(h,) for h in phashes])
+            conn.commit()
+            return cursor.rowcount
+        except Exception as e:
+            conn.rollback()
+            raise e
+        finally:
+            conn.close()
+    
+    def get_enrichment_cache(self, cache_key: str, now: float) -> Optional[Dict]:
+        """获取未过期的书籍信息缓存，并更新命中时间"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute('''
+                SELECT data_json, size_bytes, expires_at, field_expires_json FROM enrichment_cache
+                WHERE cache_key = ? AND expires_at > ?
+            ''', (cache_key, now))
+            result = cursor.fetchone()
+            if not result:
+                return None
+            
+            cursor.execute('UPDATE enrichment_cache SET last_hit_at = ? WHERE cache_key = ?', (now, cache_key))
+            conn.commit()
+            return {
+                'data': json.loads(result[0]),
+                'size_bytes': result[1],
+                'expires_at': result[2],
+                'field_expires': json.loads(result[3] or '{}')
+            }
+        finally:
+            conn.close()
+    
+    def get_enrichment_cache_entries(self, now: float, limit: int) -> List[Dict]:
+        """获取最近命中的未过期缓存条目（按最近命中时间升序），用于启动时预热"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            SELECT cache_key, data_json, size_bytes, expires_at, field_expires_json FROM (
+                SELECT * FROM enrichment_cache WHERE expires_at > ?
+                ORDER BY last_hit_at DESC LIMIT ?
+            ) ORDER BY last_hit_at
+        ''', (now, limit))
+        results = cursor.fetchall()
+        
+        conn.close()
+        return [
+            {
+                'cache_key': key,
+                'data': json.loads(data_json),
+                'size_bytes': size_bytes,
+                'expires_at': expires_at,
+                'field_expires': json.loads(field_expires_json or '{}')
+            }
+            for key, data_json, size_bytes, expires_at, field_expires_json in results
+        ]
+    
+    def get_enrichment_cache_keys(self, now: float) -> List[str]:
+        """获取所有未过期的缓存键"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        
+        cursor.execute('SELECT cache_key FROM enrichment_cache WHERE expires_at > ?', (now,))
+        results = cursor.fetchall()
+        
+        conn.close()
+        return [row[0] for row in results]
+    
+    def save_enrichment_cache(self, cache_key: str, data_json: str, size_bytes: int,
+                              fetched_at: float, expires_at: float, field_expires_json: str = '{}') -> bool:
+        """保存书籍信息缓存（expires_at为整个条目的过期时间，field_expires_json为各字段的过期时间）"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute('''
+                INSERT OR REPLACE INTO enrichment_cache
+                (cache_key, data_json, size_bytes, fetched_at, expires_at, last_hit_at, field_expires_json)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (cache_key, data_json, size_bytes, fetched_at, expires_at, fetched_at, field_expires_json))
+            
+            conn.commit()
+            return True
+        except Exception as e:
+            conn.rollback()
+            raise e
+        finally:
+            conn.close()
+    
+    def prune_enrichment_cache(self, now: float, max_entries: int, max_bytes: int) -> Dict[str, int]:
+        """删除过期条目，再按最近命中时间淘汰超出条目数或字节预算的条目"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute('DELETE FROM enrichment_cache WHERE expires_at <= ?', (now,))
+            expired = cursor.rowcount
+            
+            cursor.execute('''
+                DELETE FROM enrichment_cache WHERE cache_key IN (
+                    SELECT cache_key FROM (
+                        SELECT cache_key,
+                               ROW_NUMBER() OVER (ORDER BY last_hit_at DESC) AS position,
+                               SUM(size_bytes) OVER (ORDER BY last_hit_at DESC) AS total_bytes
+                        FROM enrichment_cache
+                    ) WHERE position > ? OR total_bytes > ?
+                )
+            ''', (max_entries, max_bytes))
+            evicted = cursor.rowcount
+            
+            conn.commit()
+            return {'expired': expired, 'evicted': evicted}
+        except Exception as e:
+            conn.rollback()
+            raise e
+        finally:
+            conn.close()
+    
+    def get_enrichment_cache_stats(self) -> Dict[str, int]:
+        """获取书籍信息缓存表的条目数和总字节数"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        
+        cursor.execute('SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM enrichment_cache')
+        entries, size_bytes = cursor.fetchone()
+        
+        conn.close()
+        return {'entries': entries, 'bytes': size_bytes}
+    
+    def clear_enrichment_cache(self):
+        """清空书籍信息缓存表"""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            conn.execute('DELETE FROM enrichment_cache')
+            conn.commit()
+        finally:
+            conn.close()
+    
+    def get_cover(self, url: str) -> Optional[Dict]:
+        """获取封面链接对应的内容摘要（digest为None表示上次下载失败）"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        
+        cursor.execute('SELECT digest, fetched_at FROM cover_urls WHERE url = ?', (url,))
+        result = cursor.fetchone()
+        
+        conn.close()
+        return {'digest': result[0], 'fetched_at': result[1]} if result else None
+    
+    def save_cover(self, url: str, digest: Optional[str], size_bytes: int, now: float) -> bool:
+        """保存封面链接的下载结果；digest为None时只记录下载失败"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        
+        try:
+            if digest is not None:
+                cursor.execute('''
+                    INSERT INTO cover_blobs (digest, size_bytes, created_at, last_hit_at)
+                    VALUES (?, ?, ?, ?)
+                    ON CONFLICT(digest) DO UPDATE SET size_bytes = excluded.size_bytes, last_hit_at = excluded.last_hit_at
+                ''', (digest, size_bytes, now, now))
+            cursor.execute('''
+                INSERT OR REPLACE INTO cover_urls (url, digest, fetched_at)
+                VALUES (?, ?, ?)
+            ''', (url, digest, now))
+            
+            conn.commit()
+            return True
+        except Exception as e:
+            conn.rollback()
+            raise e
+        finally:
+            conn.close()
+    
+    def touch_cover(self, digest: str, now: float):
+        """更新封面的最近访问时间"""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            conn.execute('UPDATE cover_blobs SET last_hit_at = ? WHERE digest = ?', (now, digest))
+            conn.commit()
+        finally:
+            conn.close()
+    
+    def prune_cover_cache(self, max_bytes: int) -> List[str]:
+        """按最近访问时间淘汰超出字节预算的封面，返回被淘汰的内容摘要（对应文件由调用方删除）"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute('''
+                SELECT digest FROM (
+                    SELECT digest, SUM(size_bytes) OVER (ORDER BY last_hit_at DESC, digest) AS total_bytes
+                    FROM cover_blobs
+                ) WHERE total_bytes > ?
+            ''', (max_bytes,))
+            digests = [row[0] for row in cursor.fetchall()]
+            
+            for digest in digests:
+                cursor.execute('DELETE FROM cover_blobs WHERE digest = ?', (digest,))
+                cursor.execute('DELETE FROM cover_urls WHERE digest = ?', (digest,))
+            
+            conn.commit()
+            return digests
+        except Exception as e:
+            conn.rollback()
+            raise e
+        finally:
+            conn.close()
+    
+    def get_cover_cache_stats(self) -> Dict[str, int]:
+        """获取封面缓存的封面数、链接数和总字节数"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        
+        cursor.execute('SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM cover_blobs')
+        covers, size_bytes = cursor.fetchone()
+        cursor.execute('SELECT COUNT(*) FROM cover_urls WHERE digest IS NOT NULL')
+        urls = cursor.fetchone()[0]
+        
+        conn.close()
+        return {'covers': covers, 'urls': urls, 'bytes': size_bytes}
+    
+    def _queue_connection(self) -> sqlite3.Connection:
+        """任务队列的连接（每个线程复用一个，自动提交模式）
+        
+        领取和续租在工作线程中高频调用，复用连接省去每次打开数据库的开销；
+        WAL模式下synchronous=NORMAL提交时不等待fsync，进程崩溃不会丢失已提交的任务。
+        """
+        local = self._queue_local
+        # fork出的子进程不能沿用父进程的连接
+        if getattr(local, 'pid', None) != os.getpid():
+            local.conn = sqlite3.connect(self.db_path, isolation_level=None, timeout=30)
+            local.conn.execute('PRAGMA synchronous=NORMAL')
+            local.pid = os.getpid()
+        return local.conn
+    
+    def enqueue_task(self, task_id: str, session_id: str, payload: Dict, created_at: str,
+                     max_attempts: int, now: float):
+        """任务入队"""
+        self._queue_connection().execute('''
+            INSERT INTO task_queue
+            (task_id, session_id, payload_json, status, attempts, max_attempts, available_at, created_at, updated_at)
+            VALUES (?, ?, ?, 'pending', 0, ?, ?, ?, ?)
+        ''', (task_id, session_id, json.dumps(payload, ensure_ascii=False), max_attempts, now, created_at, now))
+    
+    def claim_task(self, owner: str, lease_seconds: float, now: float) -> Optional[Dict]:
+        """原子地领取最早的可执行任务（等待中的，或租约已过期的处理中任务），领取后持有租约
+        
+        租约过期且尝试次数已用完的任务标记为失败，不再领取。
+        BEGIN IMMEDIATE保证多个线程或进程不会领取到同一个任务。
+        """
+        conn = self._queue_connection()
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute('BEGIN IMMEDIATE')
+            cursor.execute('''
+                UPDATE task_queue SET status = 'failed', error = ?, lease_owner = NULL, updated_at = ?
+                WHERE status = 'processing' AND lease_expires_at <= ? AND attempts >= max_attempts
+            ''', ('任务处理多次中断，已放弃', now, now))
+            cursor.execute('''
+                SELECT task_id, session_id, payload_json, attempts, created_at FROM task_queue
+                WHERE (status = 'pending' AND available_at <= ?) OR (status = 'processing' AND lease_expires_at <= ?)
+                ORDER BY created_at LIMIT 1
+            ''', (now, now))
+            result = cursor.fetchone()
+            if result:
+                cursor.execute('''
+                    UPDATE task_queue SET status = 'processing', attempts = attempts + 1,
+                        lease_owner = ?, lease_expires_at = ?, updated_at = ?
+                    WHERE task_id = ?
+                ''', (owner, now + lease_seconds, now, result[0]))
+            cursor.execute('COMMIT')
+        except Exception as e:
+            if conn.in_transaction:
+                cursor.execute('ROLLBACK')
+            raise e
+        
+        if not result:
+            return None
+        task_id, session_id, payload_json, attempts, created_at = result
+        return {
+            'task_id': task_id,
+            'session_id': session_id,
+            'payload': json.loads(payload_json),
+            'attempts': attempts + 1,
+            'created_at': created_at
+        }
+    
+    def renew_task_leases(self, task_ids: List[str], owner: str, lease_seconds: float, now: float) -> List[str]:
+        """为仍由owner持有的处理中任务续租，返回续租成功的任务"""
+        conn = self._queue_connection()
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute('BEGIN IMMEDIATE')
+            renewed = []
+            for task_id in task_ids:
+                cursor.execute('''
+                    UPDATE task_queue SET lease_expires_at = ?, updated_at = ?
+                    WHERE task_id = ? AND lease_owner = ? AND status = 'processing'
+                ''', (now + lease_seconds, now, task_id, owner))
+                if cursor.rowcount:
+                    renewed.append(task_id)
+            cursor.execute('COMMIT')
+            return renewed
+        except Exception as e:
+            if conn.in_transaction:
+                cursor.execute('ROLLBACK')
+            raise e
+    
+    def finish_task(self, task_id: str, owner: str, status: str, error: Optional[str], now: float) -> bool:
+        """结束owner持有的处理中任务（已被取消或被其他进程重新领取的任务不受影响）"""
+        cursor = self._queue_connection().execute('''
+            UPDATE task_queue SET status = ?, error = ?, lease_owner = NULL, lease_expires_at = NULL, updated_at = ?
+            WHERE task_id = ? AND lease_owner = ? AND status = 'processing'
+        ''', (status, error, now, task_id, owner))
+        return cursor.rowcount > 0
+    
+    def cancel_queued_task(self, task_id: str, now: float) -> bool:
+        """取消等待中或处理中的任务"""
+        cursor = self._queue_connection().execute('''
+            UPDATE task_queue SET status = 'cancelled', lease_owner = NULL, lease_expires_at = NULL, updated_at = ?
+            WHERE task_id = ? AND status IN ('pending', 'processing')
+        ''', (now, task_id))
+        return cursor.rowcount > 0
+    
+    def get_queued_task(self, task_id: str) -> Optional[Dict]:
+        """获取队列中的任务"""
+        result = self._queue_connection().execute('''
+            SELECT task_id, session_id, payload_json, status, attempts, created_at, updated_at, error
+            FROM task_queue WHERE task_id = ?
+        ''', (task_id,)).fetchone()
+        
+        if not result:
+            return None
+        columns = ['task_id', 'session_id', 'payload', 'status', 'attempts', 'created_at', 'updated_at', 'error']
+        task = dict(zip(columns, result))
+        task['payload'] = json.loads(task['payload'])
+        return task
+    
+    def get_leased_tasks(self) -> List[Dict]:
+        """获取所有处理中的任务及其租约持有者"""
+        results = self._queue_connection().execute(
+            "SELECT task_id, lease_owner FROM task_queue WHERE status = 'processing'"
+        ).fetchall()
+        return [{'task_id': task_id, 'lease_owner': owner} for task_id, owner in results]
+    
+    def expire_task_lease(self, task_id: str, owner: str) -> bool:
+        """让owner持有的租约立即过期，任务可被重新领取"""
+        cursor = self._queue_connection().execute('''
+            UPDATE task_queue SET lease_expires_at = 0
+            WHERE task_id = ? AND lease_owner = ? AND status = 'processing'
+        ''', (task_id, owner))
+        return cursor.rowcount > 0
+    
+    def prune_task_queue(self, before: float) -> int:
+        """删除在before之前结束的任务"""
+        cursor = self._queue_connection().execute('''
+            DELETE FROM task_queue WHERE status IN ('completed', 'failed', 'cancelled') AND updated_at < ?
+        ''', (before,))
+        return cursor.rowcount
+    
+    def get_task_queue_stats(self) -> Dict[str, int]:
+        """按状态统计队列中的任务数"""
+        results = self._queue_connection().execute(
+            'SELECT status, COUNT(*) FROM task_queue GROUP BY status'
+        ).fetchall()
+        return dict(results)
+    
     def delete_scan_record(self, scan_id: str) -> bool:
         """删除扫描记录"""
         conn = sqlite3.connect(self.db_path)
@@ -1,4 +1,4 @@
-from flask import Blueprint, request, jsonify, render_template, send_file, session
+from flask import Blueprint, request, jsonify, render_template, send_file, session, redirect
 import uuid
 import os
 import json
@@ -8,14 +8,30 @@ from .models.database import db
 from .services.file_manager import file_manager
 from .services.task_manager import task_manager
 from .services.export_service import ExportService
-from .services.qwen_service import QwenService
+from .services.qwen_service import qwen_service
+from .services.http_client import http_client
+from .services.recognition_cache import recognition_cache
+from .services.enrichment_cache import enrichment_cache
+from .services.cover_cache import cover_cache
+from .services.single_flight import enrichment_flight
+from .services.enrichment_pool import enrichment_pool
+from .services.resilience import resilience_registry
+from .services.async_engine import async_engine
+from .services.log_config import get_logger
+from .services.enrichment_providers import PROVIDER_CONFIG_KEYS, validate_provider_config
+from .services.model_cascade import CASCADE_CONFIG_KEYS, validate_cascade_config
 
 # 创建蓝图
 main = Blueprint('main', __name__)
+logger = get_logger(__name__)
 
 # 初始化服务
 export_service = ExportService()
-qwen_service = QwenService()
+
+@main.before_app_request
+def start_task_workers():
+    """处理首个请求前启动任务工作线程，继续执行重启前未完成的任务"""
+    task_manager.start()
 
 @main.route('/')
 def index():
@@ -69,7 +85,7 @@ def upload_image():
     except ValueError as e:
         return jsonify({'error': str(e)}), 400
     except Exception as e:
-        print(f"上传图片失败: {e}")
+        logger.error("上传图片失败: %s", e)
         return jsonify({'error': '上传失败'}), 500
 
 @main.route('/api/recognize', methods=['POST'])
@@ -101,7 +117,46 @@ def start_recognition():
         })
         
     except Exception as e:
-        print(f"创建识别任务失败: {e}")
+        logger.error("创建识别任务失败: %s", e)
+        return jsonify({'error': '创建任务失败'}), 500
+
+@main.route('/api/recognize/batch', methods=['POST'])
+def start_batch_recognition():
+    """开始多图识别任务"""
+    try:
+        data = request.get_json()
+        file_ids = data.get('file_ids') or []
+        session_id = data.get('session_id')
+        
+        if not file_ids:
+            return jsonify({'error': '缺少file_ids'}), 400
+        
+        if not isinstance(file_ids, list):
+            return jsonify({'error': 'file_ids必须是数组'}), 400
+        
+        if len(file_ids) > qwen_service.batch_max_files:
+            return jsonify({'error': f'一次最多识别{qwen_service.batch_max_files}张图片'}), 400
+        
+        if not session_id:
+            return jsonify({'error': '缺少session_id'}), 400
+        
+        # 检查文件是否存在
+        missing = [file_id for file_id in file_ids if not file_manager.get_file_path(file_id)]
+        if missing:
+            return jsonify({'error': f'文件不存在: {", ".join(missing)}'}), 404
+        
+        # 创建识别任务
+        task_id = task_manager.create_batch_task(file_ids, session_id)
+        
+        return jsonify({
+            'success': True,
+            'task_id': task_id,
+            'status': 'pending',
+            'message': '识别任务已开始'
+        })
+        
+    except Exception as e:
+        logger.error("创建批量识别任务失败: %s", e)
         return jsonify({'error': '创建任务失败'}), 500
 
 @main.route('/api/task/<task_id>', methods=['GET'])
@@ -119,13 +174,15 @@ def get_task_status(task_id):
             'progress': task['progress'],
             'current_stage': task['current_stage'],
             'result': task.get('result'),
+            'partial_books': task.get('partial_books', []),
+            'enriched_count': task.get('enriched_count', 0),
             'error': task.get('error'),
             'created_at': task['created_at'],
             'completed_at': task.get('completed_at')
         })
         
     except Exception as e:
-        print(f"获取任务状态失败: {e}")
+        logger.error("获取任务状态失败: %s", e)
         return jsonify({'error': '获取任务状态失败'}), 500
 
 @main.route('/api/task/<task_id>/cancel', methods=['POST'])
@@ -142,7 +199,7 @@ def cancel_task(task_id):
             return jsonify({'error': '任务不存在或无法取消'}), 404
             
     except Exception as e:
-        print(f"取消任务失败: {e}")
+        logger.error("取消任务失败: %s", e)
         return jsonify({'error': '取消任务失败'}), 500
 
 @main.route('/api/cleanup', methods=['POST'])
@@ -168,7 +225,7 @@ def cleanup_files():
         })
         
     except Exception as e:
-        print(f"清理文件失败: {e}")
+        logger.error("清理文件失败: %s", e)
         return jsonify({'error': f'清理文件失败: {str(e)}'}), 500
 
 @main.route('/api/history', methods=['GET'])
@@ -190,7 +247,7 @@ def get_scan_history():
         })
         
     except Exception as e:
-        print(f"获取历史记录失败: {e}")
+        logger.error("获取历史记录失败: %s", e)
         return jsonify({'error': '获取历史记录失败'}), 500
 
 @main.route('/api/history/<scan_id>', methods=['GET'])
@@ -207,7 +264,7 @@ def get_scan_detail(scan_id):
         })
         
     except Exception as e:
-        print(f"获取扫描详情失败: {e}")
+        logger.error("获取扫描详情失败: %s", e)
         return jsonify({'error': '获取扫描详情失败'}), 500
 
 @main.route('/api/config', methods=['GET'])
@@ -224,7 +281,7 @@ def get_config():
         })
         
     except Exception as e:
-        print(f"获取配置失败: {e}")
+        logger.error("获取配置失败: %s", e)
         return jsonify({'error': '获取配置失败'}), 500
 
 @main.route('/api/config', methods=['POST'])
@@ -233,6 +290,13 @@ def save_config():
     try:
         data = request.get_json()
         
+        # 先校验模型级联阈值和搜索源链，任一配置项无效时不保存任何配置
+        try:
+            updates = {key: validate_cascade_config(key, data[key]) for key in CASCADE_CONFIG_KEYS if key in data}
+            updates.update((key, validate_provider_config(key, data[key])) for key in PROVIDER_CONFIG_KEYS if key in data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
         # 保存API Key
         if 'api_key' in data:
             db.save_config('api_key', data['api_key'])
@@ -243,13 +307,17 @@ def save_config():
         if 'prompt' in data:
             db.save_config('prompt', data['prompt'])
         
+        # 保存模型级联阈值和搜索源链
+        for key, value in updates.items():
+            db.save_config(key, value)
+        
         return jsonify({
             'success': True,
             'message': '配置保存成功'
         })
         
     except Exception as e:
-        print(f"保存配置失败: {e}")
+        logger.error("保存配置失败: %s", e)
         return jsonify({'error': '保存配置失败'}), 500
 
 @main.route('/api/config/validate', methods=['POST'])
@@ -272,7 +340,7 @@ def validate_api_key():
         })
         
     except Exception as e:
-        print(f"验证API Key失败: {e}")
+        logger.error("验证API Key失败: %s", e)
         return jsonify({
             'success': False,
             'error': f'验证API Key失败: {str(e)}',
@@ -300,7 +368,7 @@ def export_excel():
         )
         
     except Exception as e:
-        print(f"导出Excel失败: {e}")
+        logger.error("导出Excel失败: %s", e)
         return jsonify({'error': '导出Excel失败'}), 500
 
 @main.route('/api/export/image', methods=['POST'])
@@ -323,7 +391,7 @@ def export_image():
         })
         
     except Exception as e:
-        print(f"导出图片失败: {e}")
+        logger.error("导出图片失败: %s", e)
         return jsonify({'error': '导出图片失败'}), 500
 
 @main.route('/api/stats', methods=['GET'])
@@ -346,6 +414,14 @@ def get_stats():
             'stats': {
                 'tasks': task_stats,
                 'storage': storage_info,
+                'http': http_client.get_stats(),
+                'recognition_cache': recognition_cache.get_stats(),
+                'enrichment_cache': enrichment_cache.get_stats(),
+                'enrichment_flight': enrichment_flight.get_stats(),
+                'search': task_manager.search_service.get_search_stats(),
+                'enrichment_pool': enrichment_pool.get_stats(),
+                'async_engine': async_engine.get_stats(),
+                'covers': cover_cache.get_stats(),
                 'scans': {
                     'total_scans': total_scans,
                     'total_books': total_books
@@ -354,7 +430,7 @@ def get_stats():
         })
         
     except Exception as e:
-        print(f"获取统计信息失败: {e}")
+        logger.error("获取统计信息失败: %s", e)
         return jsonify({'error': '获取统计信息失败'}), 500
 
 @main.route('/api/stats', methods=['GET'])
@@ -376,9 +452,51 @@ def get_system_stats():
         })
         
     except Exception as e:
-        print(f"获取系统统计失败: {e}")
+        logger.error("获取系统统计失败: %s", e)
         return jsonify({'error': '获取系统统计失败'}), 500
 
+@main.route('/covers/<digest>.webp', methods=['GET'])
+def get_cover(digest):
+    """本地封面缩略图（文件名为内容摘要，浏览器可长期缓存）"""
+    path = cover_cache.thumbnail_path(digest)
+    if path is None:
+        return jsonify({'error': '封面不存在'}), 404
+    
+    response = send_file(path, mimetype='image/webp', max_age=cover_cache.max_age, conditional=True)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+@main.route('/api/cover', methods=['GET'])
+def get_cover_by_url():
+    """按原始封面链接获取封面：已缓存时跳转到本地缩略图，否则在后台下载并先跳转到原始链接"""
+    url = request.args.get('url', '')
+    # 只跳转到允许的封面域名，避免成为任意网址的跳转入口
+    if not cover_cache.allowed(url):
+        return jsonify({'error': '无效的封面链接'}), 400
+    
+    try:
+        local_url = cover_cache.local_url(url)
+        if local_url:
+            return redirect(local_url)
+        cover_cache.schedule([url])
+    except Exception as e:
+        logger.warning("读取封面缓存失败 %s: %s", url, e)
+    return redirect(url)
+
+@main.route('/api/resilience', methods=['GET'])
+def get_resilience_stats():
+    """获取上游接口的熔断、重试和限流状态"""
+    try:
+        return jsonify({
+            'success': True,
+            'endpoints': resilience_registry.get_stats()
+        })
+        
+    except Exception as e:
+        logger.error("获取熔断状态失败: %s", e)
+        return jsonify({'error': '获取熔断状态失败'}), 500
+
 # 错误处理
 @main.errorhandler(413)
 def too_large(e):
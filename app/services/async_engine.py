@@ -0,0 +1,376 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from typing import AsyncIterator, Coroutine, Dict, List, Optional, Tuple
+
+try:
+    import aiohttp
+except ImportError:  # 未安装aiohttp时只能使用线程池模式
+    aiohttp = None
+
+from .log_config import get_logger
+from .model_cascade import CascadePolicy, TierStats
+from .qwen_service import qwen_service, qwen_endpoint
+from .recognition_cache import recognition_cache, dhash
+from .request_body import ImageRequestBody
+from .resilience import RetryableError, parse_retry_after
+from .enrichment_pool import enrichment_pool
+from .enrichment_providers import ProviderStats
+from .isbn import normalize_isbn
+from .search_service import ProviderSchedule, SearchService, is_overload_status
+
+logger = get_logger(__name__)
+
+
+class AsyncEngine:
+    """异步识别与丰富化引擎 - 在单个事件循环线程上以协程执行Qwen调用和书籍搜索
+
+    Qwen调用有独立的并发上限，豆瓣/Google与线程池模式共用enrichment_pool的自适应并发上限，
+    任务数量不再受线程数限制。
+    图片预处理、感知哈希、请求体构造和SQLite缓存读写等阻塞操作交给一个小的线程池，不在事件循环线程上执行。
+    """
+
+    def __init__(self):
+        self.limits = {
+            'qwen': int(os.getenv('ASYNC_QWEN_CONCURRENCY', 8))
+        }
+        self.max_connections = int(os.getenv('ASYNC_MAX_CONNECTIONS', 100))
+        self.blocking_executor = ThreadPoolExecutor(max_workers=int(os.getenv('ASYNC_BLOCKING_WORKERS', 4)))
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.session = None
+        self.semaphores: Dict[str, asyncio.Semaphore] = {}
+        # 各上游进行中的请求数（只在事件循环线程上修改）
+        self.in_flight: Dict[str, int] = {name: 0 for name in self.limits}
+        self.lock = threading.Lock()
+
+    @property
+    def available(self) -> bool:
+        """是否可以使用异步引擎（需要安装aiohttp）"""
+        return aiohttp is not None
+
+    def _ensure_started(self):
+        """按需启动事件循环线程"""
+        with self.lock:
+            if self.loop is not None:
+                return
+
+            self.loop = asyncio.new_event_loop()
+            ready = threading.Event()
+
+            def run_loop():
+                asyncio.set_event_loop(self.loop)
+                self.loop.call_soon(ready.set)
+                self.loop.run_forever()
+
+            thread = threading.Thread(target=run_loop, name='async-engine', daemon=True)
+            thread.start()
+            ready.wait()
+
+    def submit(self, coro: Coroutine) -> Future:
+        """在事件循环线程上执行协程，返回concurrent.futures.Future"""
+        self._ensure_started()
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    async def _get_session(self):
+        """获取共享的aiohttp会话（在事件循环线程内创建）"""
+        if self.session is None:
+            self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.max_connections))
+            self.semaphores = {name: asyncio.Semaphore(limit) for name, limit in self.limits.items()}
+        return self.session
+
+    async def run_blocking(self, func, *args, **kwargs):
+        """在阻塞线程池中执行同步函数"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.blocking_executor, partial(func, *args, **kwargs))
+
+    # ============ 识别 ============
+
+    async def recognize_books(self, image_path: str, stats: Optional[Dict] = None) -> List[Dict]:
+        """识别图片中的书籍（协程版本）"""
+        if stats is None:
+            stats = {}
+        stats['cache_hit'] = False
+
+        # 分块识别需要多次预处理和合并，直接复用同步实现
+        if await self.run_blocking(qwen_service._plan_tiles, image_path, None):
+            return await self.run_blocking(qwen_service.recognize_books, image_path, stats)
+
+        processed_image = await self.run_blocking(qwen_service._process_image, image_path, stats)
+        image_hash = await self.run_blocking(dhash, processed_image)
+        cached = await self.run_blocking(recognition_cache.lookup, image_hash)
+        if cached is not None:
+            stats['cache_hit'] = True
+            stats['cache_distance'] = cached['distance']
+            return cached['books']
+
+        if not qwen_service.api_key:
+            raise ValueError("未配置Qwen API Key")
+
+        tier_stats = TierStats(await self.run_blocking(CascadePolicy.load, qwen_service.model))
+        if tier_stats.policy.enabled:
+            # 级联需要按第一层结果决定是否升级，交给同步实现
+            books = await self.run_blocking(qwen_service._recognize_cascade, processed_image, tier_stats)
+        else:
+            start = time.perf_counter()
+            payload = await self.run_blocking(qwen_service._build_request_payload, processed_image)
+            response = await self._call_qwen_api(payload)
+            tier_stats.record(qwen_service.model, (time.perf_counter() - start) * 1000, response.get('usage'))
+            books = qwen_service._parse_response(response)
+        model_used = qwen_service._record_cascade_stats(stats, tier_stats)
+
+        if books:
+            await self.run_blocking(recognition_cache.store, image_hash, books, model_used)
+        return books
+
+    async def _call_qwen_api(self, payload: ImageRequestBody) -> Dict:
+        """调用Qwen API（经过与同步路径共享的限流、重试和熔断）"""
+        session = await self._get_session()
+        headers = {
+            "Authorization": f"Bearer {qwen_service.api_key}",
+            "Content-Type": "application/json"
+        }
+        deadline = time.monotonic() + qwen_service.total_timeout
+
+        async def send():
+            timeout = aiohttp.ClientTimeout(sock_connect=qwen_service.connect_timeout,
+                                            sock_read=qwen_service.remaining_read_timeout(deadline))
+            async with self.semaphores['qwen']:
+                self.in_flight['qwen'] += 1
+                try:
+                    async with session.post(qwen_service.api_url, data=payload.buffer, headers=headers,
+                                            timeout=timeout) as response:
+                        if response.status == 429 or response.status >= 500:
+                            raise RetryableError(f"{response.status} - {await response.text()}",
+                                                 parse_retry_after(response.headers.get('Retry-After')))
+                        if response.status != 200:
+                            raise ValueError(f"API调用失败: {response.status} - {await response.text()}")
+                        return await response.json(content_type=None)
+                finally:
+                    self.in_flight['qwen'] -= 1
+
+        try:
+            # 与同步实现相同：只重试429/5xx和连接失败，读超时只计入熔断
+            return await qwen_endpoint.call_async(
+                send, retry_on=(RetryableError, aiohttp.ClientConnectorError, aiohttp.ConnectionTimeoutError,
+                                aiohttp.ServerDisconnectedError),
+                fail_on=(asyncio.TimeoutError,), deadline=deadline
+            )
+        except asyncio.TimeoutError:
+            raise ValueError("API调用超时，请稍后重试")
+        except (RetryableError, aiohttp.ClientError) as e:
+            raise ValueError(f"API调用失败: {e}")
+
+    # ============ 信息丰富化 ============
+
+    async def enrich_books(self, search_service: SearchService, books: List[Dict]) -> List[Dict]:
+        """并发丰富所有书籍信息，保持原有顺序"""
+        enriched_books = list(books)
+        async for index, book in self.iter_enriched(search_service, books):
+            enriched_books[index] = book
+        return enriched_books
+
+    async def iter_enriched(self, search_service: SearchService, books: List[Dict],
+                            provider_stats: Optional[ProviderStats] = None) -> AsyncIterator[Tuple[int, Dict]]:
+        """并发丰富所有书籍信息，按完成顺序逐本产出(原始位置, 丰富后的书籍)"""
+        if provider_stats is None:
+            provider_stats = await self.run_blocking(search_service.new_provider_stats)
+
+        async def enrich(index: int, book: Dict) -> Tuple[int, Dict]:
+            try:
+                return index, await self._enrich_single_book(search_service, book, provider_stats)
+            except Exception as e:
+                logger.warning("搜索书籍信息失败 %s: %s", book.get('title', 'Unknown'), e)
+                # 如果搜索失败，返回原始信息
+                return index, book
+
+        await self.prefetch_isbns(search_service, books)
+        tasks = [asyncio.ensure_future(enrich(index, book)) for index, book in enumerate(books)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _enrich_single_book(self, search_service: SearchService, book: Dict,
+                                  provider_stats: ProviderStats) -> Dict:
+        """丰富单本书的信息（协程版本，先按ISBN查询，字段不足时按搜索源链请求）"""
+        title = book.get('title', '')
+        author = book.get('author') or ''
+
+        isbn_info = None
+        isbn_trusted = False
+        isbn = normalize_isbn(book.get('isbn'))
+        if isbn:
+            isbn_info = await self._lookup_isbn(search_service, isbn)
+            isbn_trusted = search_service._isbn_matches_title(isbn_info, title)
+            if isbn_trusted and search_service._is_sufficient(isbn_info, provider_stats.chain.required_fields):
+                search_service._count('isbn_hits')
+                provider_stats.record_source('isbn')
+                return {**book, **search_service._isbn_fields(isbn_info)}
+
+        if not title:
+            return {**book, **search_service._isbn_fields(isbn_info)} if isbn_info else book
+
+        # 检查缓存：有字段已过期时只重新查询这些字段
+        cached = await self.run_blocking(search_service._get_cached, title, author)
+        info = cached['data'] if cached is not None and not cached['stale_fields'] else None
+        looked_up = False
+        if info is None:
+            def lookup():
+                nonlocal looked_up
+                looked_up = True
+                return self._lookup_book_info(search_service, title, author, provider_stats, cached)
+
+            info = await search_service.flight.do_async(search_service._cache_key(title, author), lookup)
+        provider_stats.record_source('lookup' if looked_up else 'cache')
+        return {**book, **search_service._merge_isbn_info(isbn_info, info, isbn_trusted)}
+
+    async def prefetch_isbns(self, search_service: SearchService, books: List[Dict]) -> int:
+        """批量查询整个书架的ISBN并写入缓存（协程版本）"""
+        missing = await self.run_blocking(search_service._missing_isbns, books)
+        if missing:
+            await self._fetch_isbns(search_service, missing)
+        return len(missing)
+
+    async def _lookup_isbn(self, search_service: SearchService, isbn: str) -> Optional[Dict]:
+        """按ISBN-13查询：缓存、本地书目库、Open Library依次尝试"""
+        known = await self.run_blocking(search_service._known_isbn, isbn)
+        if known is not None:
+            return known
+
+        async def fetch():
+            return (await self._fetch_isbns(search_service, [isbn])).get(isbn)
+
+        return await search_service.flight.do_async(search_service._isbn_cache_key(isbn), fetch)
+
+    async def _fetch_isbns(self, search_service: SearchService, isbns: List[str]) -> Dict[str, Dict]:
+        """通过Open Library bibkeys接口批量查询ISBN（各批并发），结果写入缓存"""
+        health = search_service.health['openlibrary']
+
+        async def fetch_chunk(chunk: List[str]) -> Optional[Dict[str, Dict]]:
+            """返回None表示该批查询失败或被跳过（不写入负缓存）"""
+            if not health.allow():
+                return None
+            search_service._count('isbn_requests')
+            started = time.perf_counter()
+            try:
+                data = await self._fetch_json('openlibrary', search_service._openlibrary_isbn_request(chunk))
+            except asyncio.CancelledError:
+                health.release()
+                raise
+            except Exception as e:
+                logger.warning("Open Library ISBN查询失败 %s: %s", chunk, e)
+                search_service._record_outcome('openlibrary', (time.perf_counter() - started) * 1000, True)
+                return None
+            search_service._record_outcome('openlibrary', (time.perf_counter() - started) * 1000, False)
+            return search_service._parse_openlibrary_isbns(data)
+
+        chunks = search_service._isbn_chunks(isbns)
+        results = {}
+        not_found = []
+        for chunk, found in zip(chunks, await asyncio.gather(*(fetch_chunk(chunk) for chunk in chunks))):
+            if found is None:
+                continue
+            results.update(found)
+            not_found.extend(isbn for isbn in chunk if isbn not in found)
+        await self.run_blocking(search_service._store_isbn_results, results, not_found)
+        return results
+
+    async def _lookup_book_info(self, search_service: SearchService, title: str, author: str,
+                                provider_stats: ProviderStats, cached: Optional[Dict] = None) -> Dict:
+        """按搜索源链查询并写入缓存（协程版本，与同步实现共用ProviderSchedule的调度策略）"""
+        search_service._count('lookups')
+        local = await self.run_blocking(search_service._lookup_local, title, author)
+        if search_service._local_answer(local, provider_stats):
+            return search_service._info(local)
+
+        def start(name: str) -> asyncio.Future:
+            return asyncio.ensure_future(self._timed_lookup(search_service, name, title, author, provider_stats))
+
+        loop = asyncio.get_running_loop()
+        schedule = ProviderSchedule(search_service, title, local, provider_stats.chain, start, loop.time(), cached)
+        try:
+            while not schedule.step(loop.time()):
+                done, _ = await asyncio.wait(list(schedule.pending), timeout=schedule.wait_timeout(loop.time()),
+                                             return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    schedule.completed(task)
+        finally:
+            schedule.cancel()
+
+        return await self.run_blocking(search_service._store_search_results, title, author,
+                                       *schedule.finish(provider_stats))
+
+    async def _timed_lookup(self, search_service: SearchService, name: str, title: str, author: str,
+                            provider_stats: ProviderStats) -> Optional[Dict]:
+        """请求一个搜索源，记录耗时和是否出错（被取消的请求不计入，只释放探测名额）"""
+        started = time.perf_counter()
+        try:
+            info = await self._search_provider(search_service, name, title, author)
+        except asyncio.CancelledError:
+            search_service.health[name].release()
+            raise
+        except Exception:
+            search_service._record_outcome(name, (time.perf_counter() - started) * 1000, True, provider_stats)
+            raise
+        search_service._record_outcome(name, (time.perf_counter() - started) * 1000, False, provider_stats)
+        return info
+
+    async def _search_provider(self, search_service: SearchService, name: str, title: str,
+                               author: str) -> Optional[Dict]:
+        """请求一个搜索源并解析结果（与SearchService._search_<name>对应）"""
+        if name == 'openlibrary':
+            request = search_service._openlibrary_request(title, author)
+            book = search_service._first_openlibrary_doc(await self._fetch_json(name, request))
+            if not book:
+                return None
+            work_data = None
+            if book.get('key'):
+                work_data = await self._fetch_json(name, search_service._openlibrary_work_request(book['key']))
+            return search_service._parse_openlibrary(book, work_data)
+
+        data = await self._fetch_json(name, getattr(search_service, f'_{name}_request')(title, author))
+        return getattr(search_service, f'_parse_{name}')(data) if data else None
+
+    async def _fetch_json(self, upstream: str, request: Tuple[str, Dict]) -> Optional[Dict]:
+        """GET请求并解析JSON，非200返回None，限流和5xx抛出异常"""
+        session = await self._get_session()
+        url, params = request
+        limiter = enrichment_pool.limiter(upstream)
+        await limiter.acquire_async()
+        started = time.perf_counter()
+        error = False
+        feedback = True
+        try:
+            async with session.get(url, params=params, timeout=aiohttp.ClientTimeout(total=10)) as response:
+                if is_overload_status(response.status):
+                    response.raise_for_status()
+                if response.status != 200:
+                    return None
+                return await response.json(content_type=None)
+        except asyncio.CancelledError:
+            # 被取消的请求（对冲落败、超过截止时间）不反映搜索源的状态
+            feedback = False
+            raise
+        except Exception:
+            error = True
+            raise
+        finally:
+            limiter.release((time.perf_counter() - started) * 1000 if feedback else None, error)
+
+    def get_stats(self) -> Dict:
+        """获取引擎状态"""
+        return {
+            'available': self.available,
+            'running': self.loop is not None,
+            'limits': self.limits,
+            'in_flight': dict(self.in_flight)
+        }
+
+
+# 全局异步引擎实例
+async_engine = AsyncEngine()
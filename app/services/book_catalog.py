@@ -0,0 +1,388 @@
+import gzip
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .isbn import normalize_isbn
+from .text_match import normalize_text, similarity
+from .log_config import get_logger
+
+logger = get_logger(__name__)
+
+COVER_URL = 'https://covers.openlibrary.org/b/id/{}-L.jpg'
+
+# FTS5查询中有特殊含义的字符
+_FTS_SPECIAL = re.compile(r'["*^:(){}\[\]+\-]')
+
+
+def _text(value) -> str:
+    """Open Library的文本字段可能是字符串或 {"type": "/type/text", "value": ...}"""
+    if isinstance(value, dict):
+        value = value.get('value', '')
+    return value if isinstance(value, str) else ''
+
+
+def _open_dump(path: str):
+    """按文本逐行读取转储文件，.gz自动解压"""
+    if str(path).endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', errors='replace')
+    return open(path, 'r', encoding='utf-8', errors='replace')
+
+
+def parse_dump_line(line: str) -> Optional[Dict]:
+    """解析转储中的一行
+
+    支持Open Library官方转储的TSV格式（type、key、revision、last_modified、JSON五列）
+    和每行一个JSON对象的JSONL格式。
+    """
+    line = line.strip()
+    if not line:
+        return None
+    if not line.startswith('{'):
+        line = line.rsplit('\t', 1)[-1]
+    try:
+        record = json.loads(line)
+    except ValueError:
+        return None
+    return record if isinstance(record, dict) else None
+
+
+def record_to_row(record: Dict) -> Optional[Tuple[Tuple, List[str]]]:
+    """把editions/works记录转换为(catalog_books行, ISBN列表)，无法使用的记录返回None"""
+    key = record.get('key')
+    title = _text(record.get('title'))
+    if not key or not title:
+        return None
+
+    record_type = record.get('type')
+    if isinstance(record_type, dict):
+        record_type = record_type.get('key')
+    kind = 'work' if record_type == '/type/work' or key.startswith('/works/') else 'edition'
+
+    authors = [author.get('name') for author in record.get('authors') or []
+               if isinstance(author, dict) and author.get('name')]
+    if not authors:
+        authors = [name for name in record.get('author_name') or [] if isinstance(name, str)]
+    author_text = ', '.join(authors) or _text(record.get('by_statement'))
+
+    works = record.get('works') or []
+    work_key = works[0].get('key') if works and isinstance(works[0], dict) else None
+    covers = [cover for cover in record.get('covers') or [] if isinstance(cover, int) and cover > 0]
+    pages = record.get('number_of_pages')
+
+    row = (
+        key,
+        kind,
+        work_key,
+        title,
+        normalize_text(title),
+        _text(record.get('subtitle')),
+        author_text,
+        ', '.join(p for p in record.get('publishers') or [] if isinstance(p, str)),
+        _text(record.get('publish_date')),
+        pages if isinstance(pages, int) else None,
+        _text(record.get('description')),
+        covers[0] if covers else None
+    )
+    # ISBN-10和ISBN-13统一规范化为ISBN-13，同一本书的两种写法只占一行
+    isbns = {normalize_isbn(isbn) for isbn in (record.get('isbn_13') or []) + (record.get('isbn_10') or [])}
+    isbns.discard(None)
+    return row, sorted(isbns)
+
+
+class BookCatalog:
+    """本地离线书目库 - 导入Open Library转储到SQLite，按ISBN和书名（FTS5）本地查询
+
+    作为第一个搜索源使用：书名精确命中且字段足够时不再请求网络搜索源。
+    每个线程持有一个只读查询连接，单次查询通常在1毫秒以内。
+    """
+
+    def __init__(self, db_path: Optional[str] = None):
+        self.db_path = Path(db_path or os.getenv('CATALOG_DB_PATH', 'book_catalog.db'))
+        self.enabled = os.getenv('CATALOG_ENABLED', 'true').lower() == 'true'
+        # 全文索引候选与查询书名的最低三元组相似度
+        self.min_similarity = float(os.getenv('CATALOG_MIN_SIMILARITY', 0.6))
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self._book_count: Optional[int] = None
+        self.counters = {
+            'lookups': 0,
+            'hits': 0,
+            'similar_hits': 0,
+            'isbn_hits': 0
+        }
+
+    @property
+    def available(self) -> bool:
+        """书目库已启用且已导入数据"""
+        if not self.enabled or not self.db_path.exists():
+            return False
+        if self._book_count is None:
+            try:
+                self._book_count = self._connection().execute('SELECT COUNT(*) FROM catalog_books').fetchone()[0]
+            except sqlite3.Error:
+                self._book_count = 0
+        return self._book_count > 0
+
+    def _connection(self) -> sqlite3.Connection:
+        """当前线程的查询连接"""
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            self.local.conn = conn
+        return conn
+
+    def close(self):
+        """关闭当前线程的查询连接"""
+        conn = getattr(self.local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self.local.conn = None
+
+    def init_schema(self, conn: sqlite3.Connection):
+        """创建书目表、ISBN索引和FTS5全文索引"""
+        conn.executescript('''
+            PRAGMA journal_mode=WAL;
+
+            CREATE TABLE IF NOT EXISTS catalog_books (
+                id INTEGER PRIMARY KEY,
+                ol_key TEXT UNIQUE,
+                kind TEXT,
+                work_key TEXT,
+                title TEXT,
+                title_norm TEXT,
+                subtitle TEXT,
+                authors TEXT,
+                publishers TEXT,
+                publish_date TEXT,
+                pages INTEGER,
+                description TEXT,
+                cover_id INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS idx_catalog_books_title_norm ON catalog_books (title_norm);
+
+            CREATE TABLE IF NOT EXISTS catalog_isbn (
+                isbn TEXT PRIMARY KEY,
+                book_id INTEGER
+            ) WITHOUT ROWID;
+
+            CREATE VIRTUAL TABLE IF NOT EXISTS catalog_fts USING fts5(
+                title, authors,
+                content='catalog_books', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2'
+            );
+        ''')
+
+    def import_dump(self, path: str, batch_size: int = 5000,
+                    on_progress: Optional[Callable[[int], None]] = None) -> Dict:
+        """流式导入转储文件（可为.gz），内存占用与文件大小无关
+
+        每batch_size条记录提交一次；同一key重复导入时更新原有行。
+        导入完成后重建全文索引。
+        """
+        started = time.perf_counter()
+        conn = sqlite3.connect(self.db_path)
+        self.init_schema(conn)
+        conn.execute('PRAGMA synchronous=OFF')
+
+        stats = {'lines': 0, 'imported': 0, 'skipped': 0, 'isbns': 0}
+        rows: List[Tuple] = []
+        isbn_rows: List[Tuple[str, str]] = []
+
+        def flush():
+            conn.executemany('''
+                INSERT INTO catalog_books
+                (ol_key, kind, work_key, title, title_norm, subtitle, authors, publishers,
+                 publish_date, pages, description, cover_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(ol_key) DO UPDATE SET
+                    kind = excluded.kind, work_key = excluded.work_key, title = excluded.title,
+                    title_norm = excluded.title_norm, subtitle = excluded.subtitle, authors = excluded.authors,
+                    publishers = excluded.publishers, publish_date = excluded.publish_date,
+                    pages = excluded.pages, description = excluded.description, cover_id = excluded.cover_id
+            ''', rows)
+            conn.executemany('''
+                INSERT OR REPLACE INTO catalog_isbn (isbn, book_id)
+                SELECT ?, id FROM catalog_books WHERE ol_key = ?
+            ''', isbn_rows)
+            conn.commit()
+            rows.clear()
+            isbn_rows.clear()
+            if on_progress:
+                on_progress(stats['imported'])
+
+        try:
+            with _open_dump(path) as dump:
+                for line in dump:
+                    stats['lines'] += 1
+                    record = parse_dump_line(line)
+                    converted = record_to_row(record) if record else None
+                    if converted is None:
+                        stats['skipped'] += 1
+                        continue
+
+                    row, isbns = converted
+                    rows.append(row)
+                    isbn_rows.extend((isbn, row[0]) for isbn in isbns)
+                    stats['imported'] += 1
+                    stats['isbns'] += len(isbns)
+                    if len(rows) >= batch_size:
+                        flush()
+            flush()
+
+            # 外部内容表在批量写入后一次性重建，比逐行触发器快得多
+            conn.execute("INSERT INTO catalog_fts(catalog_fts) VALUES('rebuild')")
+            conn.commit()
+        finally:
+            conn.close()
+
+        self._book_count = None
+        stats['seconds'] = round(time.perf_counter() - started, 2)
+        logger.info("书目库导入完成 %s: %s", path, stats)
+        return stats
+
+    def lookup(self, title: str, author: str = '') -> Optional[Dict]:
+        """按书名（和作者）查询，返回搜索结果格式的书籍信息
+
+        规范化书名完全相同（且作者不冲突）时为精确命中，match为'exact'；
+        否则在全文索引中查找书名相近的候选：书名相似度需达到min_similarity，给出作者时作者也须一致，
+        命中时match为'similar'，只能用于补充其他搜索源缺少的字段。
+        """
+        if not title or not self.available:
+            return None
+        self._count('lookups')
+
+        conn = self._connection()
+        title_norm = normalize_text(title)
+        author_norm = normalize_text(author)
+        match = 'exact'
+        candidates = [
+            row for row in conn.execute('SELECT * FROM catalog_books WHERE title_norm = ? LIMIT 20', (title_norm,))
+            if not author_norm or not row['authors'] or self._author_matches(row, author_norm)
+        ]
+        if not candidates:
+            match = 'similar'
+            query = self._fts_query(title)
+            rows = conn.execute('''
+                SELECT catalog_books.* FROM catalog_fts
+                JOIN catalog_books ON catalog_books.id = catalog_fts.rowid
+                WHERE catalog_fts MATCH ? ORDER BY rank LIMIT 20
+            ''', (query,)).fetchall() if query else []
+            candidates = [
+                row for row in rows
+                if similarity(title_norm, row['title_norm']) >= self.min_similarity
+                and (not author_norm or self._author_matches(row, author_norm))
+            ]
+
+        best = self._best_candidate(candidates, author_norm)
+        if best is None:
+            return None
+        self._count('hits' if match == 'exact' else 'similar_hits')
+        return {**self._to_info(conn, best), 'match': match}
+
+    def lookup_isbn(self, isbn: str) -> Optional[Dict]:
+        """按ISBN精确查询（ISBN-10/13均可），结果包含该ISBN对应的书名"""
+        isbn = normalize_isbn(isbn)
+        if not isbn or not self.available:
+            return None
+        self._count('lookups')
+
+        conn = self._connection()
+        row = conn.execute('''
+            SELECT catalog_books.* FROM catalog_isbn
+            JOIN catalog_books ON catalog_books.id = catalog_isbn.book_id
+            WHERE catalog_isbn.isbn = ?
+        ''', (isbn,)).fetchone()
+        if row is None:
+            return None
+        self._count('isbn_hits')
+        # 附带书名，调用方据此核对识别出的ISBN是否属于这本书
+        return {**self._to_info(conn, row), 'title': row['title'] or ''}
+
+    def _fts_query(self, title: str) -> str:
+        """书名中的各个词都需出现在title列"""
+        terms = _FTS_SPECIAL.sub(' ', title).split()
+        return ' AND '.join(f'title:"{term}"' for term in terms)
+
+    @staticmethod
+    def _author_matches(row: sqlite3.Row, author_norm: str) -> bool:
+        """候选的作者与查询作者（已规范化）互相包含"""
+        authors = normalize_text(row['authors'])
+        return bool(author_norm) and bool(authors) and (author_norm in authors or authors in author_norm)
+
+    def _best_candidate(self, candidates: List[sqlite3.Row], author_norm: str) -> Optional[sqlite3.Row]:
+        """优先作者匹配的候选，其次信息更完整的版本"""
+        if not candidates:
+            return None
+
+        def score(row: sqlite3.Row) -> Tuple:
+            return (self._author_matches(row, author_norm), row['kind'] == 'edition',
+                    bool(row['cover_id']), bool(row['description']))
+
+        return max(candidates, key=score)
+
+    def _to_info(self, conn: sqlite3.Connection, row: sqlite3.Row) -> Dict:
+        """转换为与其他搜索源一致的字段，版本缺少简介/封面时使用所属作品的"""
+        description = row['description']
+        cover_id = row['cover_id']
+        if row['work_key'] and not (description and cover_id):
+            work = conn.execute('SELECT description, cover_id FROM catalog_books WHERE ol_key = ?',
+                                (row['work_key'],)).fetchone()
+            if work is not None:
+                description = description or work['description']
+                cover_id = cover_id or work['cover_id']
+
+        return {
+            'summary': description[:500] if description else '',
+            'cover_url': COVER_URL.format(cover_id) if cover_id else '',
+            'pages': row['pages'] or '',
+            'rating': '',
+            'pubdate': row['publish_date'] or '',
+            'price': '',
+            'publisher': row['publishers'] or ''
+        }
+
+    def _count(self, key: str):
+        with self.lock:
+            self.counters[key] += 1
+
+    def get_stats(self) -> Dict:
+        with self.lock:
+            counters = dict(self.counters)
+        return {
+            'enabled': self.enabled,
+            'available': self.available,
+            'db_path': str(self.db_path),
+            'books': self._book_count or 0,
+            'hit_rate': round(counters['hits'] / max(counters['lookups'], 1) * 100, 2),
+            **counters
+        }
+
+
+# 全局书目库实例
+book_catalog = BookCatalog()
+
+
+if __name__ == '__main__':
+    # python -m app.services.book_catalog ol_dump_editions.txt.gz [ol_dump_works.txt.gz ...]
+    import argparse
+
+    from .log_config import setup_logging
+
+    parser = argparse.ArgumentParser(description='导入Open Library转储到本地书目库')
+    parser.add_argument('dumps', nargs='+', help='转储文件（TSV或JSONL，可为.gz）')
+    parser.add_argument('--db', default=None, help='书目库路径（默认CATALOG_DB_PATH或book_catalog.db）')
+    parser.add_argument('--batch-size', type=int, default=5000)
+    args = parser.parse_args()
+
+    setup_logging()
+    catalog = BookCatalog(args.db)
+    for dump_path in args.dumps:
+        catalog.import_dump(dump_path, args.batch_size,
+                            on_progress=lambda count: logger.info("已导入 %d 条", count))
@@ -0,0 +1,260 @@
+import base64
+import hashlib
+import io
+import os
+import re
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urljoin, urlparse
+
+from PIL import Image, ImageOps
+
+from .http_client import http_client
+from .log_config import get_logger
+from ..models.database import SimpleDB, db
+
+logger = get_logger(__name__)
+
+_DIGEST = re.compile(r'^[0-9a-f]{64}$')
+
+
+def _parse_size(value: str) -> Tuple[int, int]:
+    """解析COVER_THUMB_SIZE，如 "160x240" """
+    width, _, height = value.lower().partition('x')
+    return int(width), int(height)
+
+
+def make_thumbnail(data: bytes, size: Tuple[int, int], quality: int = 80) -> bytes:
+    """生成固定尺寸的WebP缩略图（按比例缩放后居中裁剪）"""
+    with Image.open(io.BytesIO(data)) as img:
+        # JPEG按DCT缩放比例解码，封面原图通常远大于缩略图
+        img.draft('RGB', (size[0] * 2, size[1] * 2))
+        img = ImageOps.exif_transpose(img)
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        thumbnail = ImageOps.fit(img, size, Image.Resampling.LANCZOS)
+
+    output = io.BytesIO()
+    thumbnail.save(output, format='WEBP', quality=quality, method=4)
+    return output.getvalue()
+
+
+class CoverCache:
+    """封面图片缓存 - 后台下载封面，缩略图按原图内容的SHA-256存放在磁盘上
+
+    多个链接指向同一张图片时只存一份；总字节数超出预算时按最近访问时间淘汰。
+    链接到内容摘要的映射和访问时间保存在数据库中，多个工作进程共享。
+    """
+
+    # 缩略图文件名就是内容摘要，内容不会变化
+    max_age = 365 * 24 * 3600
+
+    def __init__(self, store_dir: Optional[str] = None, max_bytes: Optional[int] = None,
+                 thumb_size: Optional[Tuple[int, int]] = None, workers: Optional[int] = None,
+                 database: Optional[SimpleDB] = None):
+        self.db = database or db
+        self.store_dir = Path(store_dir or os.getenv('COVER_CACHE_DIR', 'cover_cache'))
+        self.max_bytes = max_bytes or int(os.getenv('COVER_CACHE_MAX_BYTES', 100 * 1024 * 1024))
+        self.thumb_size = thumb_size or _parse_size(os.getenv('COVER_THUMB_SIZE', '160x240'))
+        self.max_download_bytes = int(os.getenv('COVER_MAX_DOWNLOAD_BYTES', 5 * 1024 * 1024))
+        self.retry_after = int(os.getenv('COVER_RETRY_SECONDS', 3600))
+        # 只下载这些域名（及其子域名）下的图片，重定向的每一跳也需在其中（Open Library的封面重定向到archive.org）
+        self.allowed_hosts = tuple(
+            host.strip().lower() for host in
+            os.getenv('COVER_ALLOWED_HOSTS', 'doubanio.com,douban.com,openlibrary.org,archive.org').split(',')
+            if host.strip()
+        )
+        self.max_redirects = int(os.getenv('COVER_MAX_REDIRECTS', 3))
+        self.prune_interval = int(os.getenv('COVER_CACHE_PRUNE_INTERVAL', 20))
+        self.workers = workers or int(os.getenv('COVER_FETCH_WORKERS', 2))
+        self.executor: Optional[ThreadPoolExecutor] = None
+
+        self.lock = threading.Lock()
+        self.in_flight: Dict[str, Future] = {}
+        # digest -> 上次写入数据库的访问时间（访问时间每分钟最多写一次）
+        self.touched: Dict[str, float] = {}
+        self.stores_since_prune = 0
+        self.counters = {
+            'scheduled': 0,
+            'downloaded': 0,
+            'deduplicated': 0,
+            'failed': 0,
+            'evicted': 0
+        }
+
+    def allowed(self, url: str) -> bool:
+        """是否为允许下载的封面链接"""
+        try:
+            parsed = urlparse(url or '')
+        except ValueError:
+            return False
+        host = (parsed.hostname or '').lower()
+        return parsed.scheme in ('http', 'https') and \
+            any(host == allowed or host.endswith('.' + allowed) for allowed in self.allowed_hosts)
+
+    def _path(self, digest: str) -> Path:
+        return self.store_dir / digest[:2] / f'{digest}.webp'
+
+    def _count(self, key: str, amount: int = 1):
+        with self.lock:
+            self.counters[key] += amount
+
+    def schedule(self, urls: Iterable[str]) -> int:
+        """在后台下载尚未缓存的封面，返回新提交的数量"""
+        submitted = 0
+        for url in urls:
+            if not self.allowed(url):
+                continue
+            with self.lock:
+                if url in self.in_flight:
+                    continue
+                if self.executor is None:
+                    self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='cover-fetch')
+                future = self.executor.submit(self.fetch, url)
+                self.in_flight[url] = future
+                self.counters['scheduled'] += 1
+            future.add_done_callback(lambda _, url=url: self._done(url))
+            submitted += 1
+        return submitted
+
+    def _done(self, url: str):
+        with self.lock:
+            self.in_flight.pop(url, None)
+
+    def fetch(self, url: str) -> Optional[str]:
+        """下载封面并生成缩略图，返回内容摘要；已缓存时直接返回，最近失败过时返回None"""
+        entry = self.db.get_cover(url)
+        if entry is not None:
+            if entry['digest'] and self._path(entry['digest']).exists():
+                return entry['digest']
+            if entry['digest'] is None and time.time() - entry['fetched_at'] < self.retry_after:
+                return None
+
+        try:
+            data = self._download(url)
+            digest = hashlib.sha256(data).hexdigest()
+            path = self._path(digest)
+            if path.exists():
+                self._count('deduplicated')
+            else:
+                self._write(path, make_thumbnail(data, self.thumb_size))
+                self._count('downloaded')
+        except Exception as e:
+            logger.warning("下载封面失败 %s: %s", url, e)
+            self._count('failed')
+            self.db.save_cover(url, None, 0, time.time())
+            return None
+
+        self.db.save_cover(url, digest, path.stat().st_size, time.time())
+        with self.lock:
+            self.stores_since_prune += 1
+            should_prune = self.stores_since_prune >= self.prune_interval
+            if should_prune:
+                self.stores_since_prune = 0
+        if should_prune:
+            self.prune()
+        return digest
+
+    def _download(self, url: str) -> bytes:
+        """下载原图，超过大小上限时放弃
+
+        不自动跟随重定向：每一跳的目标都要在允许的域名内，否则允许的主机可以把服务器重定向到内网地址。
+        """
+        for _ in range(self.max_redirects + 1):
+            with http_client.get(url, timeout=10, stream=True, allow_redirects=False) as response:
+                if response.is_redirect:
+                    url = urljoin(url, response.headers['Location'])
+                    if not self.allowed(url):
+                        raise ValueError(f"封面重定向到不允许的地址: {url}")
+                    continue
+                response.raise_for_status()
+                data = bytearray()
+                for chunk in response.iter_content(64 * 1024):
+                    data.extend(chunk)
+                    if len(data) > self.max_download_bytes:
+                        raise ValueError(f"封面图片超过 {self.max_download_bytes} 字节")
+                return bytes(data)
+        raise ValueError(f"封面重定向超过 {self.max_redirects} 次")
+
+    def _write(self, path: Path, data: bytes):
+        """先写临时文件再原子替换，并发下载同一张封面时不会读到半个文件"""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = path.with_name(f'{path.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+        temp_path.write_bytes(data)
+        os.replace(temp_path, path)
+
+    def prune(self) -> List[str]:
+        """淘汰超出字节预算的最久未访问封面，返回被淘汰的内容摘要"""
+        digests = self.db.prune_cover_cache(self.max_bytes)
+        for digest in digests:
+            try:
+                self._path(digest).unlink()
+            except FileNotFoundError:
+                pass
+        if digests:
+            self._count('evicted', len(digests))
+            logger.info("封面缓存淘汰 %d 张", len(digests))
+        return digests
+
+    def thumbnail_path(self, digest: str) -> Optional[Path]:
+        """缩略图文件路径（同时记录访问时间），不存在时返回None"""
+        if not _DIGEST.match(digest or ''):
+            return None
+        path = self._path(digest)
+        if not path.exists():
+            return None
+
+        now = time.time()
+        with self.lock:
+            touch = now - self.touched.get(digest, 0) >= 60
+            if touch:
+                self.touched[digest] = now
+        if touch:
+            self.db.touch_cover(digest, now)
+        return path
+
+    def lookup(self, url: str) -> Optional[str]:
+        """已缓存封面的内容摘要，未缓存时返回None"""
+        if not url:
+            return None
+        entry = self.db.get_cover(url)
+        if entry is None or not entry['digest'] or not self._path(entry['digest']).exists():
+            return None
+        return entry['digest']
+
+    def local_url(self, url: str) -> Optional[str]:
+        """已缓存封面的本地地址"""
+        digest = self.lookup(url)
+        return f'/covers/{digest}.webp' if digest else None
+
+    def data_uri(self, url: str) -> Optional[str]:
+        """已缓存封面的data URI（用于离线打开的HTML导出和长图渲染）"""
+        path = self.thumbnail_path(self.lookup(url) or '')
+        if path is None:
+            return None
+        return 'data:image/webp;base64,' + base64.b64encode(path.read_bytes()).decode('ascii')
+
+    def get_stats(self) -> Dict:
+        with self.lock:
+            counters = dict(self.counters)
+            in_flight = len(self.in_flight)
+        try:
+            stored = self.db.get_cover_cache_stats()
+        except Exception as e:
+            logger.warning("获取封面缓存统计失败: %s", e)
+            stored = {}
+        return {
+            'store_dir': str(self.store_dir),
+            'max_bytes': self.max_bytes,
+            'thumb_size': list(self.thumb_size),
+            'in_flight': in_flight,
+            **stored,
+            **counters
+        }
+
+
+# 全局封面缓存实例
+cover_cache = CoverCache()
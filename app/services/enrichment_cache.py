@@ -0,0 +1,239 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from .log_config import get_logger
+from ..models.database import SimpleDB, db
+
+logger = get_logger(__name__)
+
+# 各字段的默认TTL（秒）：评分、价格变化快，简介、封面基本不变
+DEFAULT_FIELD_TTLS = {
+    'rating': 24 * 3600,
+    'price': 7 * 24 * 3600,
+    'summary': 30 * 24 * 3600,
+    'cover_url': 30 * 24 * 3600,
+    'pages': 30 * 24 * 3600,
+    'pubdate': 30 * 24 * 3600
+}
+
+
+def _parse_ttls(value: str) -> Dict[str, int]:
+    """解析ENRICH_CACHE_TTLS，如 "rating=3600,price=86400" """
+    ttls = {}
+    for item in value.split(','):
+        field, _, seconds = item.partition('=')
+        if field.strip() and seconds.strip():
+            ttls[field.strip()] = int(seconds)
+    return ttls
+
+
+class EnrichmentCache:
+    """书籍信息缓存 - 内存LRU在前，SQLite表在后
+
+    每个非空字段按自己的TTL过期：评分过期后读到的条目中评分为空，并在stale_fields中列出，
+    调用方只需重新查询这些字段；所有字段都过期后整个条目失效。
+    内存和数据库都有条目数/字节数上限，超出时淘汰最久未命中的条目。
+    重启后按最近命中时间把数据库中的条目预热到内存。
+    """
+
+    def __init__(self, memory_entries: Optional[int] = None, max_entries: Optional[int] = None,
+                 max_bytes: Optional[int] = None, field_ttls: Optional[Dict[str, int]] = None,
+                 database: Optional[SimpleDB] = None):
+        self.db = database or db
+        self.memory_entries = memory_entries or int(os.getenv('ENRICH_CACHE_MEMORY_ENTRIES', 1000))
+        self.memory_max_bytes = int(os.getenv('ENRICH_CACHE_MEMORY_BYTES', 8 * 1024 * 1024))
+        self.max_entries = max_entries or int(os.getenv('ENRICH_CACHE_MAX_ENTRIES', 20000))
+        self.max_bytes = max_bytes or int(os.getenv('ENRICH_CACHE_MAX_BYTES', 50 * 1024 * 1024))
+        self.field_ttls = {**DEFAULT_FIELD_TTLS, **_parse_ttls(os.getenv('ENRICH_CACHE_TTLS', ''))}
+        if field_ttls:
+            self.field_ttls.update(field_ttls)
+        self.default_ttl = max(self.field_ttls.values())
+        self.prune_interval = int(os.getenv('ENRICH_CACHE_PRUNE_INTERVAL', 100))
+
+        self.lock = threading.Lock()
+        # key -> (data, 各字段过期时间, 条目过期时间, size_bytes)
+        self.lru: 'OrderedDict[str, Tuple[Dict, Dict[str, float], float, int]]' = OrderedDict()
+        self.memory_bytes = 0
+        self.writes_since_prune = 0
+        self.counters = {
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'expired': 0,
+            'stale_fields': 0,
+            'memory_evictions': 0,
+            'disk_evictions': 0
+        }
+        self._loaded = False
+
+    def _ensure_loaded(self):
+        """启动后首次访问时从数据库预热最近命中的条目"""
+        if self._loaded:
+            return
+        self._loaded = True
+        try:
+            entries = self.db.get_enrichment_cache_entries(time.time(), self.memory_entries)
+        except Exception as e:
+            logger.warning("预热书籍信息缓存失败: %s", e)
+            return
+        with self.lock:
+            for entry in entries:
+                self._put_memory(entry['cache_key'], entry['data'], entry['field_expires'], entry['expires_at'],
+                                 entry['size_bytes'])
+        logger.info("书籍信息缓存预热 %d 条", len(entries))
+
+    def field_expiries(self, data: Dict, now: float) -> Dict[str, float]:
+        """各非空字段按自己的TTL计算的过期时间（没有配置TTL的字段使用最长的TTL）"""
+        return {field: now + self.field_ttls.get(field, self.default_ttl) for field, value in data.items() if value}
+
+    def expires_at(self, field_expires: Dict[str, float], now: float) -> float:
+        """整个条目的过期时间：最晚过期的字段过期时（没有非空字段时使用最长的TTL）"""
+        return max(field_expires.values(), default=now + self.default_ttl)
+
+    def get(self, key: str) -> Optional[Dict]:
+        """读取缓存中未过期的字段（已过期的字段为空），整个条目过期或不存在时返回None"""
+        entry = self.get_entry(key)
+        return entry['data'] if entry is not None else None
+
+    def get_entry(self, key: str) -> Optional[Dict]:
+        """读取缓存条目，内存未命中时查询数据库（可读到其他进程写入的条目）
+
+        返回 {'data': 未过期的字段（已过期的为空）, 'field_expires': 未过期字段的过期时间,
+        'stale_fields': 已过期需要重新查询的字段}
+        """
+        self._ensure_loaded()
+        now = time.time()
+        expired = False
+
+        with self.lock:
+            entry = self.lru.get(key)
+            if entry is not None:
+                data, field_expires, expires_at, _ = entry
+                if expires_at > now:
+                    self.lru.move_to_end(key)
+                    self.counters['memory_hits'] += 1
+                    fresh = self._fresh(data, field_expires, expires_at, now)
+                    self.counters['stale_fields'] += len(fresh['stale_fields'])
+                    return fresh
+                self._remove_memory(key)
+                expired = True
+
+        entry = self.db.get_enrichment_cache(key, now)
+        with self.lock:
+            if entry is None:
+                self.counters['expired' if expired else 'misses'] += 1
+                return None
+            self.counters['disk_hits'] += 1
+            self._put_memory(key, entry['data'], entry['field_expires'], entry['expires_at'], entry['size_bytes'])
+            fresh = self._fresh(entry['data'], entry['field_expires'], entry['expires_at'], now)
+            self.counters['stale_fields'] += len(fresh['stale_fields'])
+        return fresh
+
+    def _fresh(self, data: Dict, field_expires: Dict[str, float], expires_at: float, now: float) -> Dict:
+        """拆分出未过期和已过期的字段（旧版本写入的条目没有各字段的过期时间，按条目的过期时间计算）"""
+        fresh = dict(data)
+        kept = {}
+        stale = []
+        for field, value in data.items():
+            if not value:
+                continue
+            field_expires_at = field_expires.get(field, expires_at)
+            if field_expires_at > now:
+                kept[field] = field_expires_at
+            else:
+                fresh[field] = ''
+                stale.append(field)
+        return {'data': fresh, 'field_expires': kept, 'stale_fields': stale}
+
+    def set(self, key: str, data: Dict, ttl: Optional[float] = None,
+            field_expires: Optional[Dict[str, float]] = None):
+        """写入缓存（同时写入内存和数据库）
+
+        ttl不为空时整个条目按ttl过期（用于负缓存）；否则各字段按自己的TTL过期，
+        field_expires中的字段（如沿用缓存中未过期的值）保留原来的过期时间。
+        """
+        self._ensure_loaded()
+        now = time.time()
+        data_json = json.dumps(data, ensure_ascii=False)
+        size_bytes = len(data_json.encode('utf-8'))
+        if ttl is not None:
+            expiries = {}
+            expires_at = now + ttl
+        else:
+            expiries = self.field_expiries(data, now)
+            expiries.update((field, at) for field, at in (field_expires or {}).items() if field in expiries)
+            expires_at = self.expires_at(expiries, now)
+
+        with self.lock:
+            self._put_memory(key, data, expiries, expires_at, size_bytes)
+            self.writes_since_prune += 1
+            prune = self.writes_since_prune >= self.prune_interval
+            if prune:
+                self.writes_since_prune = 0
+
+        self.db.save_enrichment_cache(key, data_json, size_bytes, now, expires_at, json.dumps(expiries))
+        if prune:
+            self.prune()
+
+    def prune(self):
+        """清理数据库中过期和超出预算的条目"""
+        result = self.db.prune_enrichment_cache(time.time(), self.max_entries, self.max_bytes)
+        with self.lock:
+            self.counters['disk_evictions'] += result['evicted']
+        return result
+
+    def _put_memory(self, key: str, data: Dict, field_expires: Dict[str, float], expires_at: float,
+                    size_bytes: int):
+        """写入内存LRU，超出条目数或字节预算时淘汰（需持有锁）"""
+        self._remove_memory(key)
+        self.lru[key] = (data, field_expires, expires_at, size_bytes)
+        self.memory_bytes += size_bytes
+
+        while len(self.lru) > 1 and (len(self.lru) > self.memory_entries or self.memory_bytes > self.memory_max_bytes):
+            _, (_, _, _, evicted_size) = self.lru.popitem(last=False)
+            self.memory_bytes -= evicted_size
+            self.counters['memory_evictions'] += 1
+
+    def _remove_memory(self, key: str):
+        entry = self.lru.pop(key, None)
+        if entry is not None:
+            self.memory_bytes -= entry[3]
+
+    def keys(self) -> List[str]:
+        """内存中的缓存键"""
+        with self.lock:
+            return list(self.lru)
+
+    def clear(self):
+        """清空内存和数据库中的缓存"""
+        with self.lock:
+            self.lru.clear()
+            self.memory_bytes = 0
+        self.db.clear_enrichment_cache()
+
+    def get_stats(self) -> Dict:
+        """获取缓存统计信息"""
+        disk = self.db.get_enrichment_cache_stats()
+        with self.lock:
+            hits = self.counters['memory_hits'] + self.counters['disk_hits']
+            lookups = hits + self.counters['misses'] + self.counters['expired']
+            return {
+                'memory_entries': len(self.lru),
+                'memory_bytes': self.memory_bytes,
+                'memory_max_bytes': self.memory_max_bytes,
+                'disk_entries': disk['entries'],
+                'disk_bytes': disk['bytes'],
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'field_ttls': self.field_ttls,
+                'hit_rate': round(hits / max(lookups, 1) * 100, 2),
+                **self.counters
+            }
+
+
+# 全局书籍信息缓存实例（各SearchService共享）
+enrichment_cache = EnrichmentCache()
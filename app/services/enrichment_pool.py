@@ -0,0 +1,231 @@
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Deque, Dict, Optional
+
+from .log_config import get_logger
+
+logger = get_logger(__name__)
+
+# 各搜索源默认的并发上限（进程内所有任务、线程池和异步引擎共享）
+DEFAULT_PROVIDER_LIMITS = {
+    'douban': 4,
+    'google': 4
+}
+
+
+def _parse_limits(value: str) -> Dict[str, int]:
+    """解析ENRICH_PROVIDER_LIMITS，如 "douban=4,google=8" """
+    limits = {}
+    for item in value.split(','):
+        name, _, limit = item.partition('=')
+        if name.strip() and limit.strip():
+            limits[name.strip()] = int(limit)
+    return limits
+
+
+class AdaptiveLimit:
+    """AIMD自适应并发上限
+
+    请求成功且耗时低于目标延迟时上限加性增长（每轮约+1），出错或超过目标延迟时乘性减半；
+    两次减半之间至少间隔cooldown秒，避免同一批在途请求的失败把上限压到底。
+    等待中的调用方按先来先得的顺序获得名额，同步和协程调用方共用同一个队列。
+    """
+
+    def __init__(self, name: str, max_limit: int, min_limit: int = 1, target_latency_ms: float = 2000,
+                 backoff: float = 0.5, cooldown: float = 1.0):
+        self.name = name
+        self.max_limit = max(max_limit, 1)
+        self.min_limit = max(min(min_limit, self.max_limit), 1)
+        self.target_latency_ms = target_latency_ms
+        self.backoff = backoff
+        self.cooldown = cooldown
+        self.limit = float(self.max_limit)
+
+        self.lock = threading.Lock()
+        self.active = 0
+        self.waiters: Deque[Future] = deque()
+        self.last_decrease = 0.0
+        self.counters = {
+            'completed': 0,
+            'errors': 0,
+            'slow': 0,
+            'increases': 0,
+            'decreases': 0
+        }
+
+    def _enqueue(self) -> Optional[Future]:
+        """有空闲名额时直接占用并返回None，否则返回排队的Future"""
+        with self.lock:
+            if not self.waiters and self.active < int(self.limit):
+                self.active += 1
+                return None
+            waiter = Future()
+            self.waiters.append(waiter)
+            return waiter
+
+    def acquire(self):
+        """占用一个名额，没有空闲名额时阻塞等待"""
+        waiter = self._enqueue()
+        if waiter is not None:
+            waiter.result()
+
+    async def acquire_async(self):
+        """协程版本的acquire"""
+        waiter = self._enqueue()
+        if waiter is None:
+            return
+        try:
+            await asyncio.wrap_future(waiter)
+        except asyncio.CancelledError:
+            # 取消时名额可能已经分配给了当前调用方，需要归还
+            if not waiter.cancel():
+                self.release()
+            raise
+
+    def release(self, latency_ms: Optional[float] = None, error: bool = False):
+        """归还名额，传入耗时时根据结果调整上限"""
+        with self.lock:
+            self.active -= 1
+            if latency_ms is not None:
+                self._adjust(latency_ms, error)
+            while self.waiters and self.active < int(self.limit):
+                waiter = self.waiters.popleft()
+                if waiter.set_running_or_notify_cancel():
+                    self.active += 1
+                    waiter.set_result(None)
+
+    def _adjust(self, latency_ms: float, error: bool):
+        """AIMD调整上限（需持有锁）"""
+        self.counters['completed'] += 1
+        slow = latency_ms > self.target_latency_ms
+        if error:
+            self.counters['errors'] += 1
+        elif slow:
+            self.counters['slow'] += 1
+
+        if error or slow:
+            now = time.monotonic()
+            if now - self.last_decrease >= self.cooldown and self.limit > self.min_limit:
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+                self.last_decrease = now
+                self.counters['decreases'] += 1
+                logger.info("%s并发上限降至 %d（%s）", self.name, int(self.limit), '出错' if error else '延迟过高')
+        elif self.limit < self.max_limit:
+            before = int(self.limit)
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            if int(self.limit) > before:
+                self.counters['increases'] += 1
+
+    def get_stats(self) -> Dict:
+        with self.lock:
+            limit = int(self.limit)
+            return {
+                'limit': limit,
+                'max_limit': self.max_limit,
+                'active': self.active,
+                'queued': len(self.waiters),
+                'utilization': round(self.active / max(limit, 1) * 100, 2),
+                **self.counters
+            }
+
+
+class EnrichmentPool:
+    """进程内共享的书籍信息丰富化线程池
+
+    书籍级任务（缓存检查、合并查询、多源搜索调度）在一个长期存在的线程池中执行，
+    各搜索源的请求在各自的线程池中执行并受AdaptiveLimit限制，
+    因此无论同时有多少扫描任务，对豆瓣等搜索源的总并发都不会超过上限。
+    """
+
+    def __init__(self):
+        self.book_workers = int(os.getenv('ENRICH_WORKERS', 6))
+        self.book_executor = ThreadPoolExecutor(max_workers=self.book_workers, thread_name_prefix='enrich-book')
+        self.provider_limits = {**DEFAULT_PROVIDER_LIMITS, **_parse_limits(os.getenv('ENRICH_PROVIDER_LIMITS', ''))}
+        self.target_latency_ms = float(os.getenv('ENRICH_TARGET_LATENCY_MS', 2000))
+
+        self.lock = threading.Lock()
+        self.limiters: Dict[str, AdaptiveLimit] = {}
+        self.provider_executors: Dict[str, ThreadPoolExecutor] = {}
+        self.book_queued = 0
+        self.book_active = 0
+        self.book_completed = 0
+
+    def limiter(self, name: str) -> AdaptiveLimit:
+        """获取搜索源的并发限制器（按需创建）"""
+        with self.lock:
+            limiter = self.limiters.get(name)
+            if limiter is None:
+                limiter = AdaptiveLimit(name, self.provider_limits.get(name, 4),
+                                        target_latency_ms=self.target_latency_ms)
+                self.limiters[name] = limiter
+            return limiter
+
+    def _provider_executor(self, name: str) -> ThreadPoolExecutor:
+        limiter = self.limiter(name)
+        with self.lock:
+            executor = self.provider_executors.get(name)
+            if executor is None:
+                # 线程数等于并发上限的最大值，排队的请求不会占用其他搜索源的线程
+                executor = ThreadPoolExecutor(max_workers=limiter.max_limit, thread_name_prefix=f'enrich-{name}')
+                self.provider_executors[name] = executor
+            return executor
+
+    def submit_book(self, func: Callable, *args) -> Future:
+        """提交书籍级任务"""
+        with self.lock:
+            self.book_queued += 1
+        return self.book_executor.submit(self._run_book, func, *args)
+
+    def _run_book(self, func: Callable, *args):
+        with self.lock:
+            self.book_queued -= 1
+            self.book_active += 1
+        try:
+            return func(*args)
+        finally:
+            with self.lock:
+                self.book_active -= 1
+                self.book_completed += 1
+
+    def submit_provider(self, name: str, func: Callable, *args) -> Future:
+        """提交搜索源请求，执行前占用该搜索源的并发名额"""
+        return self._provider_executor(name).submit(self.call_provider, name, func, *args)
+
+    def call_provider(self, name: str, func: Callable, *args):
+        """在并发名额内执行搜索源请求，并把耗时和是否出错反馈给限制器"""
+        limiter = self.limiter(name)
+        limiter.acquire()
+        started = time.perf_counter()
+        error = False
+        try:
+            return func(*args)
+        except Exception:
+            error = True
+            raise
+        finally:
+            limiter.release((time.perf_counter() - started) * 1000, error)
+
+    def get_stats(self) -> Dict:
+        """获取队列深度和利用率"""
+        with self.lock:
+            books = {
+                'workers': self.book_workers,
+                'active': self.book_active,
+                'queued': self.book_queued,
+                'completed': self.book_completed,
+                'utilization': round(self.book_active / max(self.book_workers, 1) * 100, 2)
+            }
+            limiters = list(self.limiters.values())
+        return {
+            'books': books,
+            'target_latency_ms': self.target_latency_ms,
+            'providers': {limiter.name: limiter.get_stats() for limiter in limiters}
+        }
+
+
+# 全局丰富化线程池（各任务、SearchService和异步引擎共享）
+enrichment_pool = EnrichmentPool()
@@ -0,0 +1,168 @@
+import os
+import threading
+from typing import Dict, Iterable, List, Tuple
+
+from .log_config import get_logger
+from ..models.database import db
+
+logger = get_logger(__name__)
+
+
+class ProviderSpec:
+    """搜索源声明：能提供的字段、预期延迟（没有实测数据时使用）和每次调用消耗的配额"""
+
+    def __init__(self, name: str, fields: Tuple[str, ...], expected_latency_ms: float, cost: float = 0.0):
+        self.name = name
+        self.fields = fields
+        self.expected_latency_ms = expected_latency_ms
+        self.cost = cost
+
+    def to_dict(self) -> Dict:
+        return {
+            'name': self.name,
+            'fields': list(self.fields),
+            'expected_latency_ms': self.expected_latency_ms,
+            'cost': self.cost
+        }
+
+
+# 缓存和返回的书籍信息字段
+INFO_FIELDS = ('summary', 'cover_url', 'pages', 'rating', 'pubdate', 'price')
+
+# 已注册的网络搜索源（实现为SearchService._search_<name>）
+PROVIDERS: Dict[str, ProviderSpec] = {
+    'douban': ProviderSpec('douban', INFO_FIELDS, 800),
+    # Google Custom Search每天只有100次免费查询，且只能提供摘要
+    'google': ProviderSpec('google', ('summary',), 600, cost=1.0),
+    # 搜索接口加作品详情接口，共两次请求
+    'openlibrary': ProviderSpec('openlibrary', ('summary', 'cover_url', 'pages', 'pubdate'), 1500)
+}
+
+# 可通过 /api/config 保存的搜索源配置项
+PROVIDER_CONFIG_KEYS = ('enrich_providers', 'enrich_required_fields')
+
+
+def _split(value: str) -> List[str]:
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
+def validate_provider_config(key: str, value) -> str:
+    """校验并规范化通过 /api/config 保存的搜索源配置项（列表或逗号分隔的字符串），
+    返回保存到configs表的字符串；包含未知的搜索源或字段时抛出ValueError。空值表示清除配置。
+    """
+    if isinstance(value, list):
+        items = [str(item).strip() for item in value if str(item).strip()]
+    elif isinstance(value, str):
+        items = _split(value)
+    else:
+        raise ValueError(f"{key} 必须是列表或逗号分隔的字符串")
+
+    known = PROVIDERS if key == 'enrich_providers' else INFO_FIELDS
+    unknown = [item for item in items if item not in known]
+    if unknown:
+        label = '搜索源' if key == 'enrich_providers' else '字段'
+        raise ValueError(f"{key} 包含未知的{label}: {', '.join(unknown)}（可选: {', '.join(known)}）")
+    return ','.join(dict.fromkeys(items))
+
+
+class ProviderChain:
+    """搜索源链 - 启用哪些搜索源、合并优先级，以及任务需要的字段
+
+    顺序和启用状态保存在configs表中（enrich_providers，逗号分隔，未列出的不启用），
+    未配置时读取ENRICH_PROVIDERS环境变量；需要的字段为enrich_required_fields。
+    """
+
+    def __init__(self, providers: List[ProviderSpec], required_fields: Tuple[str, ...]):
+        self.providers = providers
+        self.required_fields = required_fields
+
+    @classmethod
+    def load(cls, default_fields: Iterable[str]) -> 'ProviderChain':
+        """从configs表加载当前搜索源链"""
+        configs = db.get_all_configs()
+
+        names = configs.get('enrich_providers') or os.getenv('ENRICH_PROVIDERS', 'douban,google,openlibrary')
+        providers = []
+        for name in _split(names):
+            if name not in PROVIDERS:
+                logger.warning("未知的搜索源: %s", name)
+            elif PROVIDERS[name] not in providers:
+                providers.append(PROVIDERS[name])
+
+        fields = []
+        for field in _split(configs.get('enrich_required_fields') or ''):
+            if field in INFO_FIELDS:
+                fields.append(field)
+            else:
+                # 没有搜索源能提供的字段永远补不上，每本书都会请求完整条搜索源链
+                logger.warning("未知的字段: %s", field)
+        return cls(providers, tuple(fields or default_fields))
+
+    @property
+    def order(self) -> List[str]:
+        """字段冲突时的合并优先级"""
+        return [spec.name for spec in self.providers]
+
+    def launch_order(self, available: Iterable[str]) -> List[ProviderSpec]:
+        """发起请求的顺序：免费的搜索源在前，消耗配额的在后，同等消耗时按配置顺序"""
+        available = set(available)
+        return sorted((spec for spec in self.providers if spec.name in available), key=lambda spec: spec.cost)
+
+    def missing_fields(self, search_results: Dict) -> List[str]:
+        return [field for field in self.required_fields if not search_results.get(field)]
+
+
+class ProviderStats:
+    """单次扫描中各搜索源的调用次数、延迟、配额消耗和提供的字段数（多个线程共用）"""
+
+    def __init__(self, chain: ProviderChain):
+        self.chain = chain
+        self.providers: Dict[str, Dict] = {}
+        # 书籍信息来源：isbn（ISBN查询已足够）、cache（缓存或合并的相同查询）、lookup（按书名搜索）
+        self.sources = {'isbn': 0, 'cache': 0, 'lookup': 0}
+        self.lock = threading.Lock()
+
+    def _provider(self, name: str) -> Dict:
+        return self.providers.setdefault(name, {
+            'name': name,
+            'calls': 0,
+            'errors': 0,
+            'latency_ms': 0.0,
+            'cost': 0.0,
+            'books': 0,
+            'fields': 0
+        })
+
+    def record_call(self, name: str, latency_ms: float, error: bool):
+        spec = PROVIDERS.get(name)
+        with self.lock:
+            provider = self._provider(name)
+            provider['calls'] += 1
+            provider['errors'] += int(error)
+            provider['latency_ms'] = round(provider['latency_ms'] + latency_ms, 2)
+            provider['cost'] = round(provider['cost'] + (spec.cost if spec else 0.0), 4)
+
+    def record_source(self, source: str):
+        with self.lock:
+            self.sources[source] += 1
+
+    def record_contribution(self, field_sources: Dict[str, str]):
+        """记录一本书最终采用的字段分别来自哪个搜索源"""
+        counts: Dict[str, int] = {}
+        for name in field_sources.values():
+            counts[name] = counts.get(name, 0) + 1
+        with self.lock:
+            for name, count in counts.items():
+                provider = self._provider(name)
+                provider['books'] += 1
+                provider['fields'] += count
+
+    def to_dict(self) -> Dict:
+        with self.lock:
+            return {
+                'order': self.chain.order,
+                'required_fields': list(self.chain.required_fields),
+                'sources': dict(self.sources),
+                'providers': [dict(provider) for provider in self.providers.values()],
+                'total_cost': round(sum(provider['cost'] for provider in self.providers.values()), 4)
+            }
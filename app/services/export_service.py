@@ -5,6 +5,11 @@ from typing import List, Dict
 from flask import send_file
 import json
 
+from .cover_cache import cover_cache
+from .log_config import get_logger
+
+logger = get_logger(__name__)
+
 class ExportService:
     """导出服务 - 处理Excel和图片导出"""
     
@@ -78,7 +83,7 @@ class ExportService:
             return output
             
         except Exception as e:
-            print(f"Excel导出失败: {e}")
+            logger.error("Excel导出失败: %s", e)
             raise e
     
     def export_to_image(self, books: List[Dict]) -> str:
@@ -93,7 +98,7 @@ class ExportService:
             }, ensure_ascii=False)
             
         except Exception as e:
-            print(f"图片导出失败: {e}")
+            logger.error("图片导出失败: %s", e)
             raise e
     
     def generate_books_html(self, books: List[Dict]) -> str:
@@ -241,7 +246,9 @@ class ExportService:
             if len(summary) > 150:
                 summary = summary[:150] + '...'
             
-            cover_html = f'<img src="{cover_url}" style="width: 100%; height: 100%; object-fit: cover; border-radius: 8px;">' if cover_url else '📖'
+            # 已缓存的封面内嵌为data URI，导出文件离线可看，渲染长图时也不再请求豆瓣/Open Library
+            cover_src = self._cover_src(cover_url)
+            cover_html = f'<img src="{cover_src}" style="width: 100%; height: 100%; object-fit: cover; border-radius: 8px;">' if cover_url else '📖'
             
             html_content += f"""
                     <div class="book-item">
@@ -275,6 +282,19 @@ class ExportService:
         
         return html_content
     
+    def _cover_src(self, cover_url: str) -> str:
+        """封面图片地址：已缓存时为缩略图的data URI，否则为原始链接（并在后台下载）"""
+        if not cover_url:
+            return cover_url
+        try:
+            data_uri = cover_cache.data_uri(cover_url)
+            if data_uri:
+                return data_uri
+            cover_cache.schedule([cover_url])
+        except Exception as e:
+            logger.warning("读取封面缓存失败 %s: %s", cover_url, e)
+        return cover_url
+    
     def export_to_json(self, books: List[Dict]) -> str:
         """导出为JSON格式"""
         export_data = {
@@ -315,5 +335,5 @@ class ExportService:
             return csv_content
             
         except Exception as e:
-            print(f"CSV导出失败: {e}")
+            logger.error("CSV导出失败: %s", e)
             raise e
@@ -6,6 +6,10 @@ from datetime import datetime, timedelta
 from typing import List, Dict, Optional
 from werkzeug.utils import secure_filename
 
+from .log_config import get_logger
+
+logger = get_logger(__name__)
+
 class FileManager:
     """文件管理器 - 处理图片上传、存储和清理"""
     
@@ -96,7 +100,7 @@ class FileManager:
                     file_path.unlink()
                     deleted_files.append(file_info['filename'])
                 except Exception as e:
-                    print(f"删除文件失败 {file_info['filename']}: {e}")
+                    logger.warning("删除文件失败 %s: %s", file_info['filename'], e)
         
         # 清除会话记录
         del self.session_files[session_id]
@@ -116,9 +120,9 @@ class FileManager:
                             file_path.unlink()
                             deleted_files.append(file_path.name)
                         except Exception as e:
-                            print(f"删除过期文件失败 {file_path.name}: {e}")
+                            logger.warning("删除过期文件失败 %s: %s", file_path.name, e)
         except Exception as e:
-            print(f"清理过期文件时出错: {e}")
+            logger.error("清理过期文件时出错: %s", e)
         
         return deleted_files
     
@@ -141,13 +145,13 @@ class FileManager:
                         file_path.unlink()
                         deleted_count += 1
                     except Exception as e:
-                        print(f"删除文件失败 {file_path.name}: {e}")
+                        logger.warning("删除文件失败 %s: %s", file_path.name, e)
             
             # 清空会话记录
             self.session_files.clear()
             
         except Exception as e:
-            print(f"清理所有临时文件时出错: {e}")
+            logger.error("清理所有临时文件时出错: %s", e)
         
         return deleted_count
     
@@ -174,7 +178,7 @@ class FileManager:
             }
             
         except Exception as e:
-            print(f"获取存储统计失败: {e}")
+            logger.error("获取存储统计失败: %s", e)
             return {
                 'total_files': 0,
                 'total_size_mb': 0,
@@ -192,7 +196,7 @@ class FileManager:
                     total_files += 1
                     total_size += file_path.stat().st_size
         except Exception as e:
-            print(f"获取存储信息时出错: {e}")
+            logger.error("获取存储信息时出错: %s", e)
         
         return {
             'total_files': total_files,
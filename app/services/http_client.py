@@ -0,0 +1,134 @@
+import os
+import threading
+from typing import Dict, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from .log_config import get_logger
+
+logger = get_logger(__name__)
+
+
+class PoolStats:
+    """连接池统计 - 记录连接复用(hit)与新建连接(miss)次数"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.new_connections = 0
+
+    def record_request(self):
+        with self.lock:
+            self.requests += 1
+
+    def record_new_connection(self):
+        with self.lock:
+            self.new_connections += 1
+
+    def snapshot(self) -> Dict:
+        with self.lock:
+            hits = max(self.requests - self.new_connections, 0)
+            return {
+                'requests': self.requests,
+                'pool_hits': hits,
+                'pool_misses': self.new_connections,
+                'hit_rate': round(hits / max(self.requests, 1) * 100, 2)
+            }
+
+
+def _counting_pool_class(base, stats: PoolStats):
+    """生成带统计功能的连接池类"""
+
+    class CountingPool(base):
+        def _get_conn(self, timeout=None):
+            stats.record_request()
+            return super()._get_conn(timeout=timeout)
+
+        def _new_conn(self):
+            stats.record_new_connection()
+            return super()._new_conn()
+
+    return CountingPool
+
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """带连接池统计的HTTPAdapter"""
+
+    def __init__(self, stats: PoolStats, **kwargs):
+        self.stats = stats
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _counting_pool_class(HTTPConnectionPool, self.stats),
+            'https': _counting_pool_class(HTTPSConnectionPool, self.stats)
+        }
+
+
+def default_pool_maxsize() -> int:
+    """每个主机保留的连接数：取各上游的最大并发请求数
+
+    Qwen: 每个任务工作线程分块识别时并发请求QWEN_TILE_PARALLELISM个图块；
+    封面: 后台下载线程数COVER_FETCH_WORKERS。连接池小于并发数时多出的连接用完即被丢弃，无法复用。
+    """
+    task_workers = int(os.getenv('TASK_MAX_WORKERS', 3))
+    tile_parallelism = int(os.getenv('QWEN_TILE_PARALLELISM', 3))
+    cover_workers = int(os.getenv('COVER_FETCH_WORKERS', 2))
+    return max(task_workers * max(tile_parallelism, 1), cover_workers, 1)
+
+
+class HttpClient:
+    """共享HTTP客户端 - 进程级连接池，复用TCP/TLS连接"""
+
+    def __init__(self, pool_connections: Optional[int] = None, pool_maxsize: Optional[int] = None):
+        # 每个主机的连接池大小默认按实际并发计算（见default_pool_maxsize）；
+        # 主机连接池的个数需覆盖Qwen和各封面主机（豆瓣封面分布在多个子域名）
+        self.pool_maxsize = pool_maxsize or int(os.getenv('HTTP_POOL_MAXSIZE', 0)) or default_pool_maxsize()
+        self.pool_connections = pool_connections or int(os.getenv('HTTP_POOL_CONNECTIONS', 20))
+        self.stats = PoolStats()
+        self.session = requests.Session()
+
+        adapter = PooledHTTPAdapter(
+            self.stats,
+            pool_connections=self.pool_connections,
+            pool_maxsize=self.pool_maxsize
+        )
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """发送请求（复用连接池）"""
+        return self.session.request(method, url, **kwargs)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request('POST', url, **kwargs)
+
+    def warmup(self, urls: List[str], timeout: int = 5):
+        """后台预热连接 - 提前完成TCP/TLS握手"""
+        def _warmup():
+            for url in urls:
+                try:
+                    self.session.head(url, timeout=timeout)
+                except Exception as e:
+                    logger.warning("连接预热失败 %s: %s", url, e)
+
+        thread = threading.Thread(target=_warmup, daemon=True)
+        thread.start()
+        return thread
+
+    def get_stats(self) -> Dict:
+        """获取连接池统计信息"""
+        stats = self.stats.snapshot()
+        stats['pool_maxsize'] = self.pool_maxsize
+        stats['pool_connections'] = self.pool_connections
+        return stats
+
+
+# 全局HTTP客户端实例
+http_client = HttpClient()
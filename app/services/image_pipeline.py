@@ -0,0 +1,183 @@
+import io
+import math
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from PIL import Image
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Qwen-VL每个视觉token对应28x28像素
+PATCH_SIZE = 28
+# DashScope默认单图最多1280个视觉token，超出部分会被服务端缩小
+DEFAULT_TOKEN_BUDGET = 1280
+# 未设置token预算时的上传宽度上限（与早期版本相同）
+DEFAULT_MAX_WIDTH = 1920
+
+
+def get_max_pixels(token_budget: Optional[int] = None) -> Optional[int]:
+    """根据视觉token预算计算图片像素上限，未设置QWEN_IMAGE_TOKEN_BUDGET时返回None（按宽度上限缩放）"""
+    token_budget = token_budget or int(os.getenv('QWEN_IMAGE_TOKEN_BUDGET', 0))
+    return token_budget * PATCH_SIZE * PATCH_SIZE if token_budget > 0 else None
+
+
+def fit_to_budget(width: int, height: int, max_pixels: Optional[int]) -> Tuple[int, int]:
+    """计算目标尺寸（保持宽高比）
+
+    max_pixels为None时只把宽度限制在DEFAULT_MAX_WIDTH以内；否则缩小到像素预算以内并对齐到28像素。
+    """
+    if max_pixels is None:
+        if width <= DEFAULT_MAX_WIDTH:
+            return width, height
+        return DEFAULT_MAX_WIDTH, max(int(height * DEFAULT_MAX_WIDTH / width), 1)
+
+    if width * height > max_pixels:
+        scale = math.sqrt(max_pixels / (width * height))
+        width, height = width * scale, height * scale
+
+    # 模型按28x28切分视觉token，提前对齐可避免服务端再次缩放
+    width = max(int(width) // PATCH_SIZE * PATCH_SIZE, PATCH_SIZE)
+    height = max(int(height) // PATCH_SIZE * PATCH_SIZE, PATCH_SIZE)
+    return width, height
+
+
+def _process_peak_rss_kb() -> Optional[int]:
+    """当前进程启动以来的内存峰值（KB，进程池中的子进程会处理多张图片，不是单张图片的峰值）"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS返回字节，Linux返回KB
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def plan_tiles(width: int, height: int, tile_count: int, overlap: float) -> List[Tuple[int, int, int, int]]:
+    """沿长边把图片切分为相互重叠的图块，返回(left, top, right, bottom)列表"""
+    horizontal = width >= height
+    length = width if horizontal else height
+    # 每块长度满足: n * tile - (n - 1) * overlap * tile = length
+    tile_length = length / (tile_count - (tile_count - 1) * overlap)
+    step = tile_length * (1 - overlap)
+
+    boxes = []
+    for i in range(tile_count):
+        start = int(round(i * step))
+        end = length if i == tile_count - 1 else int(round(i * step + tile_length))
+        boxes.append((start, 0, end, height) if horizontal else (0, start, width, end))
+    return boxes
+
+
+def preprocess_image(image_path: str, max_pixels: Optional[int] = None, quality: int = 85,
+                     box: Optional[Tuple[int, int, int, int]] = None) -> Tuple[bytes, Dict]:
+    """处理图片 - 压缩和格式转换（在子进程中执行）
+
+    box: 可选的裁剪区域（原图坐标），用于分块识别
+    返回压缩后的JPEG字节和处理统计（解码耗时、所在进程的内存峰值等）
+    """
+    max_pixels = max_pixels or get_max_pixels()
+    start = time.perf_counter()
+
+    with Image.open(image_path) as img:
+        original_size = img.size
+        box = box or (0, 0, img.width, img.height)
+        crop_width, crop_height = box[2] - box[0], box[3] - box[1]
+        target = fit_to_budget(crop_width, crop_height, max_pixels)
+
+        # JPEG按最接近的DCT缩放比例解码（1/2、1/4、1/8），避免全尺寸解码
+        img.draft('RGB', (
+            math.ceil(target[0] * img.width / crop_width),
+            math.ceil(target[1] * img.height / crop_height)
+        ))
+        img.load()
+        decode_ms = (time.perf_counter() - start) * 1000
+        decoded_size = img.size
+
+        # 转换为RGB模式
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+
+        # 按解码比例换算裁剪区域
+        if crop_width != original_size[0] or crop_height != original_size[1]:
+            scale_x = img.width / original_size[0]
+            scale_y = img.height / original_size[1]
+            img = img.crop((
+                int(box[0] * scale_x), int(box[1] * scale_y),
+                int(box[2] * scale_x), int(box[3] * scale_y)
+            ))
+
+        # 先做整数倍快速缩小，再用LANCZOS缩放到目标尺寸
+        factor = min(img.width // target[0], img.height // target[1])
+        if factor >= 2:
+            img = img.reduce(factor)
+        if img.size != target:
+            img = img.resize(target, Image.Resampling.LANCZOS)
+
+        # 转换为字节
+        img_byte_arr = io.BytesIO()
+        img.save(img_byte_arr, format='JPEG', quality=quality, optimize=True)
+
+    stats = {
+        'original_size': list(original_size),
+        'decoded_size': list(decoded_size),
+        'output_size': list(target),
+        'output_bytes': img_byte_arr.tell(),
+        'decode_ms': round(decode_ms, 2),
+        'total_ms': round((time.perf_counter() - start) * 1000, 2),
+        'process_peak_rss_kb': _process_peak_rss_kb()
+    }
+    return img_byte_arr.getvalue(), stats
+
+
+class ImagePreprocessor:
+    """图片预处理阶段 - 在进程池中执行CPU密集的解码/缩放/编码，绕开GIL"""
+
+    def __init__(self, max_workers: Optional[int] = None, max_pending: Optional[int] = None):
+        # PREPROCESS_WORKERS=0 表示在调用线程内直接处理
+        self.max_workers = max_workers if max_workers is not None else int(os.getenv('PREPROCESS_WORKERS', os.cpu_count() or 1))
+        self.max_pending = max_pending or int(os.getenv('PREPROCESS_QUEUE_SIZE', max(self.max_workers, 1) * 2))
+        self.slots = threading.BoundedSemaphore(self.max_pending)
+        self.executor: Optional[ProcessPoolExecutor] = None
+        self.lock = threading.Lock()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        """按需创建进程池（使用spawn，避免在多线程进程中fork）"""
+        with self.lock:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+            return self.executor
+
+    @property
+    def parallelism(self) -> int:
+        """可同时处理的图片数（在调用线程内处理时为1）"""
+        return max(self.max_workers, 1)
+
+    def process(self, image_path: str, **kwargs) -> Tuple[bytes, Dict]:
+        """预处理图片，只返回压缩后的JPEG字节和处理统计"""
+        if self.max_workers <= 0:
+            return preprocess_image(image_path, **kwargs)
+
+        # 有界输入队列：排队任务过多时阻塞调用方
+        with self.slots:
+            future = self._get_executor().submit(preprocess_image, image_path, **kwargs)
+            return future.result()
+
+    def shutdown(self):
+        """关闭进程池"""
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown(wait=True)
+                self.executor = None
+
+
+# 全局图片预处理实例
+image_preprocessor = ImagePreprocessor()
@@ -0,0 +1,40 @@
+import re
+from typing import Optional
+
+_NON_ISBN_CHARS = re.compile(r'[^0-9Xx]')
+
+
+def isbn10_check_digit(digits: str) -> str:
+    """ISBN-10校验位（前9位加权和模11，10记为X）"""
+    remainder = (11 - sum((10 - i) * int(d) for i, d in enumerate(digits[:9])) % 11) % 11
+    return 'X' if remainder == 10 else str(remainder)
+
+
+def isbn13_check_digit(digits: str) -> str:
+    """ISBN-13校验位（前12位按1、3交替加权和模10）"""
+    total = sum(int(d) * (3 if i % 2 else 1) for i, d in enumerate(digits[:12]))
+    return str((10 - total % 10) % 10)
+
+
+def normalize_isbn(value) -> Optional[str]:
+    """规范化为ISBN-13，格式或校验位不正确时返回None
+
+    接受带连字符/空格的写法和 "ISBN 7-5366-9293-7" 这类前缀，ISBN-10转换为978前缀的ISBN-13。
+    """
+    if not value or not isinstance(value, (str, int)):
+        return None
+    text = str(value).upper().replace('ISBN', '')
+    digits = _NON_ISBN_CHARS.sub('', text).upper()
+
+    if len(digits) == 10:
+        if not digits[:9].isdigit() or isbn10_check_digit(digits) != digits[9]:
+            return None
+        body = '978' + digits[:9]
+        return body + isbn13_check_digit(body)
+
+    if len(digits) == 13:
+        if not digits.isdigit() or not digits.startswith(('978', '979')) or isbn13_check_digit(digits) != digits[12]:
+            return None
+        return digits
+
+    return None
@@ -0,0 +1,147 @@
+import json
+import re
+from typing import Dict, List, Tuple
+
+# 影响括号/字符串状态的记号：转义序列作为整体匹配，其余字符由正则在C层直接跳过
+_TOKENS = re.compile(r'\\[\s\S]?|["\[\]{}]')
+# 对象数组的开头
+_OBJECT_ARRAY = re.compile(r'\[\s*\{')
+
+
+class IncrementalJsonArrayParser:
+    """增量JSON数组解析器 - 流式输入文本，每个对象的右花括号到达时立即产出该对象
+
+    数组开始之前的内容（如```json代码块标记、说明文字）会被忽略。
+    """
+
+    def __init__(self):
+        self.buffer = ''
+        self.position = 0      # 下一个待扫描字符在buffer中的位置
+        self.depth = 0         # 当前括号嵌套深度（0表示尚未进入数组）
+        self.in_string = False
+        self.object_start = -1  # 当前顶层对象在buffer中的起始位置
+        self.finished = False
+
+    def feed(self, chunk: str) -> List[Dict]:
+        """输入一段文本，返回本次新完成的对象列表"""
+        if self.finished or not chunk:
+            return []
+
+        self.buffer += chunk
+        completed = []
+        buffer = self.buffer
+        stop = len(buffer)
+
+        for match in _TOKENS.finditer(buffer, self.position):
+            token = match.group()
+            i = match.start()
+
+            if token[0] == '\\':
+                if len(token) == 1 and self.in_string:
+                    # 转义符位于末尾，等待下一段输入
+                    stop = i
+                    break
+                continue
+
+            if self.in_string:
+                if token == '"':
+                    self.in_string = False
+            elif self.depth == 0:
+                # 尚未进入数组，跳过前导文字
+                if token == '[':
+                    self.depth = 1
+            elif token == '"':
+                self.in_string = True
+            elif token in '[{':
+                if self.depth == 1 and token == '{':
+                    self.object_start = i
+                self.depth += 1
+            else:
+                self.depth -= 1
+                if self.depth == 1 and token == '}' and self.object_start >= 0:
+                    try:
+                        value = json.loads(buffer[self.object_start:i + 1])
+                        if isinstance(value, dict):
+                            completed.append(value)
+                    except json.JSONDecodeError:
+                        pass
+                    self.object_start = -1
+                elif self.depth == 0:
+                    # 顶层数组结束，忽略后续内容
+                    self.finished = True
+                    stop = i + 1
+                    break
+
+        # 丢弃已处理且不再需要的内容，避免缓冲区无限增长
+        keep_from = self.object_start if self.object_start >= 0 else stop
+        self.buffer = buffer[keep_from:]
+        self.position = stop - keep_from
+        if self.object_start >= 0:
+            self.object_start = 0
+
+        return completed
+
+
+def _array_candidates(text: str) -> List[Tuple[int, int]]:
+    """单次扫描，返回字符串之外每个'['的(起始位置, 匹配的']'位置)，未闭合的结束位置为-1
+
+    括号栈贯穿整段文本：说明文字中未配对的'['留在栈底，不影响后面数组的配对，
+    因此不需要从每个候选重新扫描到文本末尾。不在任何括号内时引号不开始字符串（说明文字中的引号）。
+    """
+    candidates: List[Tuple[int, int]] = []
+    index_of: Dict[int, int] = {}
+    stack: List[Tuple[str, int]] = []
+    in_string = False
+
+    for match in _TOKENS.finditer(text):
+        token = match.group()
+        if token[0] == '\\':
+            continue
+        if in_string:
+            if token == '"':
+                in_string = False
+        elif token == '"':
+            in_string = bool(stack)
+        elif token in '[{':
+            if token == '[':
+                index_of[match.start()] = len(candidates)
+                candidates.append((match.start(), -1))
+            stack.append((token, match.start()))
+        elif stack:
+            opener, start = stack.pop()
+            if opener == '[':
+                candidates[index_of[start]] = (start, match.start())
+
+    return candidates
+
+
+def extract_json_array(text: str) -> List:
+    """从模型输出中提取最外层的JSON对象数组
+
+    按位置依次尝试每个'['开始的候选，能识别字符串中的括号和转义，容忍代码块标记、前后说明文字（包括未配对的'['）和嵌套数组；
+    输出被max_tokens截断时，返回其中已完整的对象。括号配对只扫描一遍，解析失败的候选内部不再尝试，
+    截断抢救只对第一个以'[{'开始的未闭合候选做一次，总体线性。
+    """
+    skip_until = -1
+    salvage_tried = False
+    for start, end in _array_candidates(text):
+        if start <= skip_until:
+            continue
+        if end == -1:
+            # 数组未闭合：输出被截断时抢救已完整的对象；说明文字中未配对的'['则跳过，继续尝试其中的候选
+            if not salvage_tried and _OBJECT_ARRAY.match(text, start):
+                salvage_tried = True
+                salvaged = IncrementalJsonArrayParser().feed(text[start:])
+                if salvaged:
+                    return salvaged
+            continue
+
+        try:
+            value = json.loads(text[start:end + 1])
+            if isinstance(value, list) and all(isinstance(item, dict) for item in value):
+                return value
+        except json.JSONDecodeError:
+            pass
+        skip_until = end
+
+    raise ValueError("无法从响应中提取有效的JSON")
@@ -0,0 +1,108 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import re
+import sys
+import threading
+from datetime import datetime
+from typing import Dict, Optional
+
+# LogRecord自带的属性，其余属性视为通过extra传入的结构化字段
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+# 日志中的密钥统一打码
+_SECRET_PATTERNS = [
+    (re.compile(r'(Bearer\s+)[^\s\'",}]+', re.IGNORECASE), r'\1***'),
+    (re.compile(r'\bsk-[A-Za-z0-9]{4,}'), 'sk-***')
+]
+
+_lock = threading.Lock()
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def redact(text: str) -> str:
+    """遮盖文本中的API Key"""
+    for pattern, replacement in _SECRET_PATTERNS:
+        text = pattern.sub(replacement, text)
+    return text
+
+
+def _extra_fields(record: logging.LogRecord) -> Dict:
+    return {key: value for key, value in vars(record).items() if key not in _RECORD_ATTRIBUTES}
+
+
+class TextFormatter(logging.Formatter):
+    """文本格式：时间 级别 模块 消息 key=value..."""
+
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)s %(name)s %(message)s')
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        fields = _extra_fields(record)
+        if fields:
+            text += ' ' + ' '.join(f'{key}={value}' for key, value in fields.items())
+        return redact(text)
+
+
+class JsonFormatter(logging.Formatter):
+    """JSON格式：每条日志一行，extra字段作为顶层键"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            **_extra_fields(record)
+        }
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return redact(json.dumps(entry, ensure_ascii=False, default=str))
+
+
+def _parse_module_levels(value: str) -> Dict[str, str]:
+    """解析LOG_LEVELS，如 "app.services.qwen_service=DEBUG,app.services.search_service=WARNING" """
+    levels = {}
+    for item in value.split(','):
+        name, _, level = item.partition('=')
+        if name.strip() and level.strip():
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def setup_logging():
+    """配置日志（可重复调用）
+
+    业务线程只把日志记录放入队列，由后台线程格式化并写入stdout；
+    未开启的级别在logger.isEnabledFor处即返回，消息参数不会被格式化。
+    """
+    global _listener
+    with _lock:
+        if _listener is not None:
+            return
+
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(JsonFormatter() if os.getenv('LOG_FORMAT', 'text').lower() == 'json' else TextFormatter())
+
+        log_queue = queue.SimpleQueue()
+        root = logging.getLogger('app')
+        root.setLevel(os.getenv('LOG_LEVEL', 'INFO').upper())
+        root.addHandler(logging.handlers.QueueHandler(log_queue))
+        root.propagate = False
+
+        for name, level in _parse_module_levels(os.getenv('LOG_LEVELS', '')).items():
+            logging.getLogger(name).setLevel(level)
+
+        _listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+        _listener.start()
+        atexit.register(_listener.stop)
+
+
+def get_logger(name: str) -> logging.Logger:
+    """获取模块日志器（传入__name__），首次调用时完成日志配置"""
+    setup_logging()
+    return logging.getLogger(name)
@@ -0,0 +1,211 @@
+import json
+import os
+import threading
+from typing import Dict, List, Optional
+
+from .log_config import get_logger
+from ..models.database import db
+
+logger = get_logger(__name__)
+
+# 各模型每千token价格（元），可通过configs表的model_prices（JSON）覆盖
+DEFAULT_MODEL_PRICES = {
+    'qwen-vl-plus': {'input': 0.0015, 'output': 0.0045},
+    'qwen-vl-max': {'input': 0.003, 'output': 0.009}
+}
+
+
+# 可通过 /api/config 保存的级联配置项
+CASCADE_CONFIG_KEYS = (
+    'cascade_enabled', 'cascade_fast_model', 'cascade_strong_model',
+    'cascade_min_confidence', 'cascade_escalate_ratio', 'model_prices'
+)
+
+
+def _config_value(configs: Dict[str, str], key: str, env: str, default: str) -> str:
+    """configs表优先，其次环境变量"""
+    value = configs.get(key)
+    if value is None or value == '':
+        value = os.getenv(env, default)
+    return value
+
+
+def _config_number(configs: Dict[str, str], key: str, env: str, default: str, cast):
+    """数值配置项：configs表中的值无法解析时依次退回环境变量和默认值"""
+    for value in (configs.get(key), os.getenv(env), default):
+        if value is None or value == '':
+            continue
+        try:
+            return cast(value)
+        except (TypeError, ValueError):
+            logger.warning("%s配置无效: %r", key, value)
+    return cast(default)
+
+
+def _parse_number(key: str, value, cast, low: float, high: float):
+    if isinstance(value, bool):
+        raise ValueError(f"{key} 必须是数字")
+    try:
+        number = cast(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{key} 必须是数字")
+    if not low <= number <= high:
+        raise ValueError(f"{key} 必须在 {low} 到 {high} 之间")
+    return number
+
+
+def _parse_prices(value) -> Dict:
+    """解析model_prices：{模型: {"input": 每千token价格, "output": 每千token价格}}"""
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            raise ValueError("model_prices 必须是JSON对象")
+    if not isinstance(value, dict):
+        raise ValueError("model_prices 必须是JSON对象")
+    for model, price in value.items():
+        if not isinstance(price, dict) or not price.keys() <= {'input', 'output'}:
+            raise ValueError(f"model_prices.{model} 只能包含input和output")
+        for field, amount in price.items():
+            _parse_number(f"model_prices.{model}.{field}", amount, float, 0, float('inf'))
+    return value
+
+
+def validate_cascade_config(key: str, value) -> str:
+    """校验并规范化通过 /api/config 保存的级联配置项，返回保存到configs表的字符串；
+    无效时抛出ValueError。空值表示清除配置（退回环境变量）。
+    """
+    if value is None or value == '':
+        return ''
+    if key == 'cascade_enabled':
+        if isinstance(value, bool):
+            return 'true' if value else 'false'
+        if isinstance(value, str) and value.lower() in ('true', 'false'):
+            return value.lower()
+        raise ValueError("cascade_enabled 必须是true或false")
+    if key in ('cascade_fast_model', 'cascade_strong_model'):
+        if not isinstance(value, str) or not value.strip():
+            raise ValueError(f"{key} 必须是模型名称")
+        return value.strip()
+    if key == 'cascade_min_confidence':
+        return str(_parse_number(key, value, int, 0, 100))
+    if key == 'cascade_escalate_ratio':
+        return str(_parse_number(key, value, float, 0, 1))
+    if key == 'model_prices':
+        return json.dumps(_parse_prices(value))
+    raise ValueError(f"未知的配置项: {key}")
+
+
+class CascadePolicy:
+    """模型级联策略 - 先用快速模型识别，低置信度或空结果再交给更强的模型
+
+    阈值保存在configs表中（cascade_enabled、cascade_fast_model、cascade_strong_model、
+    cascade_min_confidence、cascade_escalate_ratio），未配置时读取QWEN_CASCADE_*环境变量。
+    """
+
+    def __init__(self, enabled: bool, fast_model: str, strong_model: str, min_confidence: int,
+                 escalate_ratio: float, prices: Optional[Dict] = None):
+        self.enabled = enabled and bool(strong_model) and strong_model != fast_model
+        self.fast_model = fast_model
+        self.strong_model = strong_model
+        self.min_confidence = min_confidence
+        self.escalate_ratio = escalate_ratio
+        self.prices = prices or DEFAULT_MODEL_PRICES
+
+    @classmethod
+    def load(cls, default_model: str) -> 'CascadePolicy':
+        """从configs表加载当前策略"""
+        configs = db.get_all_configs()
+
+        prices = dict(DEFAULT_MODEL_PRICES)
+        if configs.get('model_prices'):
+            try:
+                prices.update(_parse_prices(configs['model_prices']))
+            except ValueError as e:
+                logger.warning("model_prices配置无效: %s", e)
+
+        enabled = _config_value(configs, 'cascade_enabled', 'QWEN_CASCADE', 'false').lower() == 'true'
+        fast_model = _config_value(configs, 'cascade_fast_model', 'QWEN_CASCADE_FAST_MODEL', default_model)
+        return cls(
+            enabled=enabled,
+            fast_model=fast_model if enabled else default_model,
+            strong_model=_config_value(configs, 'cascade_strong_model', 'QWEN_CASCADE_STRONG_MODEL', 'qwen-vl-max'),
+            min_confidence=_config_number(configs, 'cascade_min_confidence', 'QWEN_CASCADE_MIN_CONFIDENCE', '70', int),
+            escalate_ratio=_config_number(configs, 'cascade_escalate_ratio', 'QWEN_CASCADE_ESCALATE_RATIO', '0.2', float),
+            prices=prices
+        )
+
+    def needs_escalation(self, books: List[Dict]) -> bool:
+        """空结果，或低置信度书籍占比达到阈值时升级到强模型"""
+        if not self.enabled:
+            return False
+        if not books:
+            return True
+        low = sum(1 for book in books if (book.get('confidence') or 0) < self.min_confidence)
+        return low > 0 and low / len(books) >= self.escalate_ratio
+
+    def merge(self, fast_books: List[Dict], strong_books: List[Dict], normalize) -> List[Dict]:
+        """以强模型结果为准，补回强模型遗漏的快速模型高置信度书籍"""
+        merged = list(strong_books)
+        seen = {normalize(book.get('title')) for book in strong_books}
+        for book in fast_books:
+            key = normalize(book.get('title'))
+            if key not in seen and (book.get('confidence') or 0) >= self.min_confidence:
+                merged.append(book)
+                seen.add(key)
+        return merged
+
+    def cost(self, model: str, usage: Dict) -> float:
+        """按token用量估算费用（元）"""
+        price = self.prices.get(model)
+        if not price:
+            return 0.0
+        return (usage.get('input_tokens', 0) * price.get('input', 0) +
+                usage.get('output_tokens', 0) * price.get('output', 0)) / 1000
+
+
+class TierStats:
+    """级联各层的调用次数、延迟、token和费用统计（分块识别时多个线程共用）"""
+
+    def __init__(self, policy: CascadePolicy):
+        self.policy = policy
+        self.tiers: Dict[str, Dict] = {}
+        self.escalations = 0
+        self.lock = threading.Lock()
+
+    def record(self, model: str, latency_ms: float, usage: Optional[Dict]):
+        usage = usage or {}
+        with self.lock:
+            tier = self.tiers.setdefault(model, {
+                'model': model,
+                'calls': 0,
+                'latency_ms': 0.0,
+                'input_tokens': 0,
+                'output_tokens': 0,
+                'cost': 0.0
+            })
+            tier['calls'] += 1
+            tier['latency_ms'] = round(tier['latency_ms'] + latency_ms, 2)
+            tier['input_tokens'] += usage.get('input_tokens', 0)
+            tier['output_tokens'] += usage.get('output_tokens', 0)
+            tier['cost'] = round(tier['cost'] + self.policy.cost(model, usage), 6)
+
+    def record_escalation(self):
+        with self.lock:
+            self.escalations += 1
+
+    @property
+    def models_used(self) -> List[str]:
+        with self.lock:
+            return list(self.tiers)
+
+    def to_dict(self) -> Dict:
+        with self.lock:
+            return {
+                'enabled': self.policy.enabled,
+                'min_confidence': self.policy.min_confidence,
+                'escalate_ratio': self.policy.escalate_ratio,
+                'escalations': self.escalations,
+                'tiers': list(self.tiers.values()),
+                'total_cost': round(sum(tier['cost'] for tier in self.tiers.values()), 6)
+            }
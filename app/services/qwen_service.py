@@ -1,76 +1,26 @@
-import base64
 import json
+import logging
+import math
 import requests
 import os
-from typing import List, Dict, Optional
+import time
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterator, List, Dict, Optional, Tuple
 from PIL import Image
-import io
 
-class QwenService:
-    """Qwen模型服务 - 处理图片识别"""
-    
-    def __init__(self):
-        self.api_key = os.getenv('QWEN_API_KEY')
-        self.api_url = os.getenv('QWEN_API_URL', 'https://dashscope.aliyuncs.com/api/v1/services/aigc/multimodal-generation/generation')
-        self.model = "qwen-vl-plus"
-        
-    def recognize_books(self, image_path: str) -> List[Dict]:
-        """识别图片中的书籍"""
-        if not self.api_key:
-            raise ValueError("未配置Qwen API Key")
-        
-        try:
-            # 1. 处理图片
-            processed_image = self._process_image(image_path)
-            
-            # 2. 编码图片
-            base64_image = self._encode_image_to_base64(processed_image)
-            
-            # 3. 构造请求
-            payload = self._build_request_payload(base64_image)
-            
-            # 4. 调用API
-            response = self._call_qwen_api(payload)
-            
-            # 5. 解析结果
-            books = self._parse_response(response)
-            
-            return books
-            
-        except Exception as e:
-            print(f"Qwen识别失败: {e}")
-            raise e
-    
-    def _process_image(self, image_path: str) -> bytes:
-        """处理图片 - 压缩和格式转换"""
-        try:
-            with Image.open(image_path) as img:
-                # 转换为RGB模式
-                if img.mode != 'RGB':
-                    img = img.convert('RGB')
-                
-                # 压缩图片（保持宽高比，最大宽度1920）
-                max_width = 1920
-                if img.width > max_width:
-                    ratio = max_width / img.width
-                    new_height = int(img.height * ratio)
-                    img = img.resize((max_width, new_height), Image.Resampling.LANCZOS)
-                
-                # 转换为字节
-                img_byte_arr = io.BytesIO()
-                img.save(img_byte_arr, format='JPEG', quality=85, optimize=True)
-                return img_byte_arr.getvalue()
-                
-        except Exception as e:
-            raise ValueError(f"图片处理失败: {e}")
-    
-    def _encode_image_to_base64(self, image_bytes: bytes) -> str:
-        """将图片编码为Base64"""
-        return base64.b64encode(image_bytes).decode('utf-8')
-    
-    def _build_request_payload(self, base64_image: str) -> Dict:
-        """构造请求体"""
-        prompt = """你是专业的图书识别专家。请仔细识别图片中的每一本书，并以JSON数组的格式返回结果。
+from .http_client import http_client
+from .log_config import get_logger
+from .recognition_cache import recognition_cache, dhash
+from .image_pipeline import image_preprocessor, plan_tiles, DEFAULT_TOKEN_BUDGET, PATCH_SIZE
+from .json_stream import IncrementalJsonArrayParser, extract_json_array
+from .model_cascade import CascadePolicy, TierStats
+from .request_body import ImageRequestBody
+from .resilience import CircuitOpenError, RetryableError, endpoint_from_env, parse_retry_after
+
+logger = get_logger(__name__)
+
+RECOGNITION_PROMPT = """你是专业的图书识别专家。请仔细识别图片中的每一本书，并以JSON数组的格式返回结果。
 
 要求：
 1. 识别图片中所有清晰可见的书籍
@@ -95,31 +45,449 @@ class QwenService:
     "confidence": 95
   }
 ]"""
+
+BATCH_PROMPT_SUFFIX = """
+
+补充要求（多图批量识别）：
+以上共有{count}张图片，按上传顺序编号为1到{count}。
+每本书额外包含字段 image_index: 该书所在图片的编号（1到{count}的整数）。
+所有图片中的书籍放在同一个JSON数组中返回。"""
+
+# Qwen API的重试、熔断和限流策略：429/5xx和连接失败重试；
+# 识别请求不是幂等的且按调用计费，读超时时上游可能已在处理，只计入熔断不重试
+qwen_endpoint = endpoint_from_env(
+    'qwen', 'QWEN',
+    retry_on=(RetryableError, requests.exceptions.ConnectTimeout, requests.exceptions.ConnectionError),
+    fail_on=(requests.exceptions.ReadTimeout,)
+)
+
+
+def normalize_book_text(text: Optional[str]) -> str:
+    """归一化书名/作者用于比对：全半角统一、忽略大小写、去除空白和标点"""
+    if not text:
+        return ''
+    text = unicodedata.normalize('NFKC', text).lower()
+    return ''.join(ch for ch in text if not unicodedata.category(ch).startswith(('P', 'Z', 'S', 'C')))
+
+
+def book_confidence(book: Dict) -> float:
+    """书籍的置信度（模型可能返回字符串或null，无法解析时视为0）"""
+    try:
+        return float(book.get('confidence') or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def merge_tile_books(tile_results: List[List[Dict]]) -> List[Dict]:
+    """合并各图块的识别结果，去除相邻图块重叠区域中重复识别的书籍（没有书名的不去重）"""
+    merged: List[Dict] = []
+    # 上一个图块中出现的书: 归一化书名 -> 在merged中的位置
+    previous_tile: Dict[str, int] = {}
+    
+    for books in tile_results:
+        current_tile: Dict[str, int] = {}
+        for book in books:
+            key = normalize_book_text(book.get('title'))
+            if not key:
+                merged.append(book)
+                continue
+            index = previous_tile.get(key)
+            if index is not None:
+                existing = merged[index]
+                existing_author = normalize_book_text(existing.get('author'))
+                author = normalize_book_text(book.get('author'))
+                if not existing_author or not author or existing_author == author:
+                    # 重复识别：保留置信度更高的结果，并补全缺失字段
+                    primary, secondary = (book, existing) if book_confidence(book) > book_confidence(existing) else (existing, book)
+                    merged_book = dict(primary)
+                    for field, value in secondary.items():
+                        if value and not merged_book.get(field):
+                            merged_book[field] = value
+                    merged[index] = merged_book
+                    current_tile[key] = index
+                    continue
+            
+            current_tile[key] = len(merged)
+            merged.append(book)
+        previous_tile = current_tile
+    
+    return merged
+
+class QwenService:
+    """Qwen模型服务 - 处理图片识别"""
+    
+    def __init__(self):
+        self.api_key = os.getenv('QWEN_API_KEY')
+        self.api_url = os.getenv('QWEN_API_URL', 'https://dashscope.aliyuncs.com/api/v1/services/aigc/multimodal-generation/generation')
+        self.model = "qwen-vl-plus"
+        self.connect_timeout = float(os.getenv('QWEN_CONNECT_TIMEOUT', 5))
+        self.read_timeout = float(os.getenv('QWEN_READ_TIMEOUT', 120))
+        # 一次调用（含重试和退避等待）的总时长上限
+        self.total_timeout = float(os.getenv('QWEN_TOTAL_TIMEOUT', 180))
+        # 一个批量识别任务最多包含的图片数（每次请求的图片数见QWEN_BATCH_MAX_IMAGES）
+        self.batch_max_files = int(os.getenv('QWEN_BATCH_MAX_FILES', 20))
         
-        return {
-            "model": self.model,
-            "input": {
-                "messages": [
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "image": f"data:image/jpeg;base64,{base64_image}"
-                            },
-                            {
-                                "text": prompt
-                            }
-                        ]
-                    }
-                ]
-            },
-            "parameters": {
-                "temperature": 0.1,
-                "max_tokens": 2000
+    def recognize_books(self, image_path: str, stats: Optional[Dict] = None, tiled: Optional[bool] = None,
+                        on_book: Optional[Callable[[Dict], None]] = None) -> List[Dict]:
+        """识别图片中的书籍
+
+        stats: 可选的字典，用于回传本次识别的统计信息（如是否命中缓存、分块耗时）
+        tiled: 是否分块识别，None表示按QWEN_TILING配置和图片宽高比自动判断
+        on_book: 可选的回调，流式识别时每解析出一本书立即调用
+        """
+        if stats is None:
+            stats = {}
+        stats['cache_hit'] = False
+        
+        try:
+            tile_boxes = self._plan_tiles(image_path, tiled)
+            
+            # 1. 处理图片（分块模式下每块单独处理，缓存按原图计算哈希）
+            if tile_boxes:
+                processed_image = None
+                image_hash = dhash(image_path)
+            else:
+                processed_image = self._process_image(image_path, stats)
+                image_hash = dhash(processed_image)
+            
+            # 2. 查询识别缓存（相同或近似的图片直接返回）
+            cached = recognition_cache.lookup(image_hash)
+            if cached is not None:
+                stats['cache_hit'] = True
+                stats['cache_distance'] = cached['distance']
+                return cached['books']
+            
+            if not self.api_key:
+                raise ValueError("未配置Qwen API Key")
+            
+            # 3. 调用模型识别（开启级联时低置信度结果交给强模型复核）
+            tier_stats = TierStats(CascadePolicy.load(self.model))
+            if tile_boxes:
+                books = self._recognize_tiles(image_path, tile_boxes, stats, tier_stats)
+            else:
+                books = self._recognize_cascade(processed_image, tier_stats, on_book=on_book, stats=stats)
+            model_used = self._record_cascade_stats(stats, tier_stats)
+            
+            # 4. 写入识别缓存（有图块识别失败时结果不完整，不缓存）
+            if books and not stats.get('tiling', {}).get('failed_tiles'):
+                recognition_cache.store(image_hash, books, model_used)
+            
+            return books
+            
+        except Exception as e:
+            logger.error("Qwen识别失败: %s", e)
+            raise e
+    
+    def _recognize_cascade(self, image_bytes: bytes, tier_stats: TierStats,
+                           on_book: Optional[Callable[[Dict], None]] = None,
+                           stats: Optional[Dict] = None) -> List[Dict]:
+        """按级联策略识别单张已处理的图片：快速模型结果置信度不足时由强模型重新识别"""
+        policy = tier_stats.policy
+        books = self._recognize_image(image_bytes, on_book=on_book, stats=stats,
+                                      model=policy.fast_model, tier_stats=tier_stats)
+        if not policy.needs_escalation(books):
+            return books
+        
+        tier_stats.record_escalation()
+        logger.info("快速模型结果置信度不足（%d 本书），升级到 %s 重新识别", len(books), policy.strong_model)
+        strong_books = self._recognize_image(image_bytes, model=policy.strong_model, tier_stats=tier_stats)
+        return policy.merge(books, strong_books, normalize_book_text)
+    
+    def _record_cascade_stats(self, stats: Dict, tier_stats: TierStats) -> str:
+        """把级联统计写入stats，返回本次使用的模型（如 qwen-vl-plus+qwen-vl-max）"""
+        stats['cascade'] = tier_stats.to_dict()
+        stats['model_used'] = '+'.join(tier_stats.models_used) or tier_stats.policy.fast_model
+        return stats['model_used']
+    
+    def _recognize_image(self, image_bytes: bytes, on_book: Optional[Callable[[Dict], None]] = None,
+                         stats: Optional[Dict] = None, model: Optional[str] = None,
+                         tier_stats: Optional[TierStats] = None) -> List[Dict]:
+        """识别单张已处理的图片，tier_stats用于记录该模型的延迟和token用量"""
+        model = model or self.model
+        start = time.perf_counter()
+        usage = {}
+        
+        # 1. 构造请求（图片直接编码进请求体缓冲区）
+        payload = self._build_request_payload(image_bytes, model=model)
+        
+        # 2. 调用API并解析结果（有回调时使用流式输出，逐本返回）
+        if on_book is not None and os.getenv('QWEN_STREAM', 'true').lower() == 'true':
+            books = self._recognize_streaming(payload, on_book, stats, usage)
+        else:
+            response = self._call_qwen_api(payload)
+            usage = response.get('usage') or {}
+            books = self._parse_response(response)
+        
+        if tier_stats is not None:
+            tier_stats.record(model, (time.perf_counter() - start) * 1000, usage)
+        return books
+    
+    def _recognize_streaming(self, payload: ImageRequestBody, on_book: Callable[[Dict], None],
+                             stats: Optional[Dict] = None, usage: Optional[Dict] = None) -> List[Dict]:
+        """流式识别 - 每本书的JSON对象一完成就回调，无需等待完整响应"""
+        parser = IncrementalJsonArrayParser()
+        text_parts = []
+        books = []
+        start = time.perf_counter()
+        
+        for text in self._call_qwen_api_stream(payload, usage):
+            text_parts.append(text)
+            for raw_book in parser.feed(text):
+                book = self._clean_book(raw_book)
+                if book is None:
+                    continue
+                if not books and stats is not None:
+                    stats['first_book_ms'] = round((time.perf_counter() - start) * 1000, 2)
+                books.append(book)
+                on_book(book)
+        
+        if books:
+            return books
+        
+        # 未能增量解析出书籍时，按完整文本再解析一次
+        content = ''.join(text_parts)
+        books = self._parse_content(content)
+        for book in books:
+            on_book(book)
+        return books
+    
+    def recognize_books_batch(self, image_paths: List[str], stats: Optional[Dict] = None) -> List[List[Dict]]:
+        """批量识别多张图片，多张图片合并为一次多模态请求，返回与image_paths对应的书籍列表"""
+        if stats is None:
+            stats = {}
+        stats['batches'] = []
+        stats['cache_hits'] = 0
+        
+        # 1. 并行预处理所有图片（并发数取预处理进程数，不随图片数增长）
+        with ThreadPoolExecutor(max_workers=max(min(len(image_paths), image_preprocessor.parallelism), 1)) as executor:
+            processed = list(executor.map(image_preprocessor.process, image_paths))
+        
+        # 2. 逐张查询识别缓存
+        results: List[Optional[List[Dict]]] = [None] * len(image_paths)
+        hashes = []
+        pending = []
+        for index, (image_bytes, _) in enumerate(processed):
+            image_hash = dhash(image_bytes)
+            hashes.append(image_hash)
+            cached = recognition_cache.lookup(image_hash)
+            if cached is not None:
+                results[index] = cached['books']
+                stats['cache_hits'] += 1
+            else:
+                pending.append(index)
+        
+        if not pending:
+            return results
+        if not self.api_key:
+            raise ValueError("未配置Qwen API Key")
+        
+        # 3. 按图片大小自适应分批识别，失败的批次退回逐张识别
+        tier_stats = TierStats(CascadePolicy.load(self.model))
+        policy = tier_stats.policy
+        for batch in self._plan_batches([processed[i][1] for i in pending]):
+            indexes = [pending[i] for i in batch]
+            batch_start = time.perf_counter()
+            batch_stats = {'images': len(indexes), 'fallback': False}
+            
+            try:
+                if len(indexes) == 1:
+                    batch_results = [self._recognize_cascade(processed[indexes[0]][0], tier_stats)]
+                else:
+                    batch_results = self._recognize_batch([processed[i][0] for i in indexes],
+                                                          model=policy.fast_model, tier_stats=tier_stats)
+                    # 批量结果中置信度不足的图片单独交给强模型
+                    for position, (index, books) in enumerate(zip(indexes, batch_results)):
+                        if policy.needs_escalation(books):
+                            tier_stats.record_escalation()
+                            strong_books = self._recognize_image(processed[index][0], model=policy.strong_model,
+                                                                 tier_stats=tier_stats)
+                            batch_results[position] = policy.merge(books, strong_books, normalize_book_text)
+            except Exception as e:
+                logger.warning("批量识别失败，改为逐张识别: %s", e)
+                batch_stats['fallback'] = True
+                batch_results = [self._recognize_cascade(processed[i][0], tier_stats) for i in indexes]
+            
+            batch_stats['latency_ms'] = round((time.perf_counter() - batch_start) * 1000, 2)
+            stats['batches'].append(batch_stats)
+            
+            for index, books in zip(indexes, batch_results):
+                results[index] = books
+        
+        model_used = self._record_cascade_stats(stats, tier_stats)
+        for index in pending:
+            if results[index]:
+                recognition_cache.store(hashes[index], results[index], model_used)
+        
+        return results
+    
+    def _plan_batches(self, preprocess_stats: List[Dict]) -> List[List[int]]:
+        """按图片数量和视觉token预算把图片分批，返回每批的下标列表"""
+        max_images = int(os.getenv('QWEN_BATCH_MAX_IMAGES', 4))
+        token_budget = int(os.getenv('QWEN_BATCH_TOKEN_BUDGET', 4 * DEFAULT_TOKEN_BUDGET))
+        
+        batches = []
+        current, current_tokens = [], 0
+        for index, image_stats in enumerate(preprocess_stats):
+            width, height = image_stats['output_size']
+            # 超出单图token上限的部分由服务端缩小，按上限计算
+            tokens = min((width // PATCH_SIZE) * (height // PATCH_SIZE), DEFAULT_TOKEN_BUDGET)
+            if current and (len(current) >= max_images or current_tokens + tokens > token_budget):
+                batches.append(current)
+                current, current_tokens = [], 0
+            current.append(index)
+            current_tokens += tokens
+        if current:
+            batches.append(current)
+        return batches
+    
+    def _recognize_batch(self, images: List[bytes], model: Optional[str] = None,
+                         tier_stats: Optional[TierStats] = None) -> List[List[Dict]]:
+        """一次请求识别多张图片，并按image_index拆分回各图片的书籍列表"""
+        model = model or self.model
+        start = time.perf_counter()
+        payload = self._build_batch_request_payload(images, model=model)
+        response = self._call_qwen_api(payload)
+        if tier_stats is not None:
+            tier_stats.record(model, (time.perf_counter() - start) * 1000, response.get('usage'))
+        raw_books = self._load_json_array(self._extract_content(response))
+        
+        results: List[List[Dict]] = [[] for _ in images]
+        for raw_book in raw_books:
+            book = self._clean_book(raw_book)
+            if book is None:
+                continue
+            try:
+                image_index = int(raw_book.get('image_index'))
+            except (TypeError, ValueError):
+                image_index = 0
+            if not 1 <= image_index <= len(images):
+                raise ValueError(f"批量识别结果的image_index无效: {raw_book.get('image_index')}")
+            results[image_index - 1].append(book)
+        
+        return results
+    
+    def _plan_tiles(self, image_path: str, tiled: Optional[bool]) -> List[Tuple[int, int, int, int]]:
+        """决定是否分块识别，返回图块区域列表（不分块时为空）"""
+        mode = os.getenv('QWEN_TILING', 'auto').lower()
+        if tiled is None:
+            if mode == 'off':
+                return []
+            tiled = mode == 'on'
+        
+        with Image.open(image_path) as img:
+            width, height = img.size
+        
+        aspect_ratio = max(width, height) / max(min(width, height), 1)
+        min_aspect = float(os.getenv('QWEN_TILE_MIN_ASPECT', 2.0))
+        if not tiled and aspect_ratio < min_aspect:
+            return []
+        
+        # 默认每块接近4:3，超长全景图最多切8块
+        tile_count = int(os.getenv('QWEN_TILE_COUNT', 0)) or min(max(math.ceil(aspect_ratio / 1.5), 2), 8)
+        overlap = float(os.getenv('QWEN_TILE_OVERLAP', 0.15))
+        return plan_tiles(width, height, tile_count, overlap)
+    
+    def _recognize_tiles(self, image_path: str, tile_boxes: List[Tuple[int, int, int, int]], stats: Dict,
+                         tier_stats: Optional[TierStats] = None) -> List[Dict]:
+        """并发识别各图块并合并结果（开启级联时只有置信度不足的图块会交给强模型）
+
+        单个图块识别失败时合并其余图块的结果，所有图块都失败时抛出第一个错误。
+        """
+        if tier_stats is None:
+            tier_stats = TierStats(CascadePolicy.load(self.model))
+        
+        def recognize_tile(box):
+            tile_start = time.perf_counter()
+            tile_stats = {}
+            books = None
+            error = None
+            try:
+                image_bytes = self._process_image(image_path, tile_stats, box=box)
+                books = self._recognize_cascade(image_bytes, tier_stats)
+            except Exception as e:
+                logger.warning("图块 %s 识别失败: %s", list(box), e)
+                error = e
+            return books, error, {
+                'box': list(box),
+                'books': len(books or []),
+                'latency_ms': round((time.perf_counter() - tile_start) * 1000, 2),
+                'preprocess': tile_stats.get('preprocess'),
+                'error': str(error) if error else None
             }
+        
+        parallelism = int(os.getenv('QWEN_TILE_PARALLELISM', 3))
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=min(parallelism, len(tile_boxes))) as executor:
+            results = list(executor.map(recognize_tile, tile_boxes))
+        wall_ms = (time.perf_counter() - start) * 1000
+        
+        errors = [error for _, error, _ in results if error is not None]
+        if len(errors) == len(results):
+            raise errors[0]
+        
+        tile_stats = [tile for _, _, tile in results]
+        sequential_ms = sum(tile['latency_ms'] for tile in tile_stats)
+        stats['tiles'] = tile_stats
+        stats['tiling'] = {
+            'tile_count': len(tile_boxes),
+            'parallelism': parallelism,
+            'wall_ms': round(wall_ms, 2),
+            'sequential_ms': round(sequential_ms, 2),
+            'speedup': round(sequential_ms / max(wall_ms, 1), 2),
+            'failed_tiles': len(errors)
         }
+        logger.info("分块识别完成: %d 块, 耗时 %.0fms, 相对串行加速 x%s", len(tile_boxes), wall_ms, stats['tiling']['speedup'])
+        
+        return merge_tile_books([books or [] for books, _, _ in results])
     
-    def _call_qwen_api(self, payload: Dict) -> Dict:
+    def _process_image(self, image_path: str, stats: Optional[Dict] = None,
+                       box: Optional[Tuple[int, int, int, int]] = None) -> bytes:
+        """处理图片 - 压缩和格式转换（交由进程池执行）"""
+        try:
+            image_bytes, preprocess_stats = image_preprocessor.process(image_path, box=box)
+            logger.debug("图片预处理完成", extra=preprocess_stats)
+            if stats is not None:
+                stats['preprocess'] = preprocess_stats
+            return image_bytes
+        except Exception as e:
+            raise ValueError(f"图片处理失败: {e}")
+    
+    def _build_request_payload(self, image_bytes: bytes, model: Optional[str] = None) -> ImageRequestBody:
+        """构造请求体"""
+        return self._build_messages_payload([image_bytes], RECOGNITION_PROMPT, max_tokens=2000, model=model)
+    
+    def _build_batch_request_payload(self, images: List[bytes], model: Optional[str] = None) -> ImageRequestBody:
+        """构造多图批量识别的请求体"""
+        prompt = RECOGNITION_PROMPT + BATCH_PROMPT_SUFFIX.format(count=len(images))
+        # 每张图片预留与单图相同的输出长度，不超过模型输出上限
+        return self._build_messages_payload(images, prompt, max_tokens=min(2000 * len(images), 8000), model=model)
+    
+    def _build_messages_payload(self, images: List[bytes], prompt: str, max_tokens: int,
+                                model: Optional[str] = None) -> ImageRequestBody:
+        """构造包含图片和文本的多模态消息请求体（图片以data URI形式直接写入请求体缓冲区）"""
+        def payload_factory(placeholders: List[str]) -> Dict:
+            content = [{"image": placeholder} for placeholder in placeholders]
+            content.append({"text": prompt})
+            
+            return {
+                "model": model or self.model,
+                "input": {
+                    "messages": [
+                        {
+                            "role": "user",
+                            "content": content
+                        }
+                    ]
+                },
+                "parameters": {
+                    "temperature": 0.1,
+                    "max_tokens": max_tokens
+                }
+            }
+        
+        return ImageRequestBody.build(payload_factory, images)
+    
+    def _call_qwen_api(self, payload: ImageRequestBody) -> Dict:
         """调用Qwen API"""
         headers = {
             "Authorization": f"Bearer {self.api_key}",
@@ -127,26 +495,99 @@ class QwenService:
         }
         
         try:
-            print(f"调用Qwen API: {self.api_url}")
-            print(f"请求头: {headers}")
-            print(f"请求体大小: {len(str(payload))} 字符")
+            logger.debug("调用Qwen API: %s, 请求体大小: %d 字节", self.api_url, len(payload))
             
-            response = requests.post(
-                self.api_url,
-                headers=headers,
-                json=payload,
-                timeout=120  # 增加超时时间
-            )
+            response = self._post(headers, payload)
             
-            print(f"API响应状态: {response.status_code}")
-            print(f"API响应头: {dict(response.headers)}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("API响应状态: %s, 响应头: %s", response.status_code, dict(response.headers))
             
             if response.status_code != 200:
-                print(f"API错误响应: {response.text}")
+                logger.warning("API错误响应: %s - %s", response.status_code, response.text)
                 raise ValueError(f"API调用失败: {response.status_code} - {response.text}")
             
             return response.json()
             
+        except CircuitOpenError as e:
+            raise ValueError(f"Qwen API暂时不可用: {e}")
+        except RetryableError as e:
+            raise ValueError(f"API调用失败: {e}")
+        except requests.exceptions.Timeout:
+            raise ValueError("API调用超时，请稍后重试")
+        except requests.exceptions.RequestException as e:
+            raise ValueError(f"API调用失败: {e}")
+        except Exception as e:
+            raise ValueError(f"请求处理失败: {e}")
+    
+    def _post(self, headers: Dict, payload: ImageRequestBody, stream: bool = False) -> requests.Response:
+        """发送请求（经过限流、重试和熔断），429和5xx按可重试错误处理
+
+        请求体以流的形式从缓冲区分块写入socket，每次重试重新从头读取。
+        总时长不超过total_timeout：每次尝试的读超时不超过剩余时间，剩余时间不够退避等待时不再重试。
+        """
+        deadline = time.monotonic() + self.total_timeout
+        
+        def send():
+            response = http_client.post(
+                self.api_url,
+                headers=headers,
+                data=payload.reader(),
+                stream=stream,
+                timeout=(self.connect_timeout, self.remaining_read_timeout(deadline))
+            )
+            if response.status_code == 429 or response.status_code >= 500:
+                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                message = f"{response.status_code} - {response.text}"
+                response.close()
+                raise RetryableError(message, retry_after)
+            return response
+        
+        return qwen_endpoint.call(send, deadline=deadline)
+    
+    def remaining_read_timeout(self, deadline: float) -> float:
+        """一次尝试的读超时：不超过read_timeout和距截止时间的剩余时间"""
+        return max(min(self.read_timeout, deadline - time.monotonic()), 0.1)
+    
+    def _call_qwen_api_stream(self, payload: ImageRequestBody, usage: Optional[Dict] = None) -> Iterator[str]:
+        """以SSE流式模式调用Qwen API，逐段产出增量文本；usage字典会被更新为最新的token用量"""
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json",
+            "Accept": "text/event-stream",
+            "X-DashScope-SSE": "enable"
+        }
+        payload = payload.with_parameters(incremental_output=True)
+        
+        try:
+            logger.debug("调用Qwen API(流式): %s, 请求体大小: %d 字节", self.api_url, len(payload))
+            
+            with self._post(headers, payload, stream=True) as response:
+                logger.debug("API响应状态: %s", response.status_code)
+                
+                if response.status_code != 200:
+                    logger.warning("API错误响应: %s - %s", response.status_code, response.text)
+                    raise ValueError(f"API调用失败: {response.status_code} - {response.text}")
+                
+                # SSE规范要求UTF-8编码，响应头通常不带charset
+                response.encoding = 'utf-8'
+                for line in response.iter_lines(decode_unicode=True):
+                    if not line or not line.startswith('data:'):
+                        continue
+                    event = json.loads(line[5:])
+                    if 'output' not in event:
+                        raise ValueError(f"API调用失败: {event.get('code')} - {event.get('message')}")
+                    if usage is not None and event.get('usage'):
+                        usage.update(event['usage'])
+                    text = self._extract_content(event)
+                    if text:
+                        yield text
+            
+        except ValueError:
+            raise
+        except CircuitOpenError as e:
+            raise ValueError(f"Qwen API暂时不可用: {e}")
+        except RetryableError as e:
+            raise ValueError(f"API调用失败: {e}")
         except requests.exceptions.Timeout:
             raise ValueError("API调用超时，请稍后重试")
         except requests.exceptions.RequestException as e:
@@ -154,74 +595,81 @@ class QwenService:
         except Exception as e:
             raise ValueError(f"请求处理失败: {e}")
     
+    def _extract_content(self, response: Dict) -> str:
+        """提取响应中的文本内容"""
+        if 'output' in response and 'choices' in response['output']:
+            content = response['output']['choices'][0]['message']['content']
+        else:
+            raise ValueError("响应格式不正确")
+        
+        # 处理content可能是列表的情况
+        if isinstance(content, list):
+            # 如果是列表，拼接其中的text
+            text_content = ""
+            for item in content:
+                if isinstance(item, dict) and 'text' in item:
+                    text_content += item['text']
+            return text_content
+        elif isinstance(content, str):
+            # 如果已经是字符串，直接使用
+            return content
+        
+        raise ValueError("无法解析响应内容")
+    
     def _parse_response(self, response: Dict) -> List[Dict]:
         """解析API响应"""
         try:
             # 提取文本内容
-            if 'output' in response and 'choices' in response['output']:
-                content = response['output']['choices'][0]['message']['content']
-            else:
-                raise ValueError("响应格式不正确")
-            
-            # 处理content可能是列表的情况
-            if isinstance(content, list):
-                # 如果是列表，提取第一个元素的text
-                text_content = ""
-                for item in content:
-                    if isinstance(item, dict) and 'text' in item:
-                        text_content += item['text']
-                content = text_content
-            elif isinstance(content, str):
-                # 如果已经是字符串，直接使用
-                pass
-            else:
-                raise ValueError("无法解析响应内容")
-            
-            # 尝试解析JSON
-            try:
-                books = json.loads(content)
-            except json.JSONDecodeError:
-                # 如果直接解析失败，尝试提取JSON部分
-                books = self._extract_json_from_text(content)
-            
-            # 验证和清理数据
-            if not isinstance(books, list):
-                raise ValueError("返回的不是数组格式")
-            
-            cleaned_books = []
-            for book in books:
-                if isinstance(book, dict) and book.get('title'):
-                    cleaned_book = {
-                        'title': book.get('title', '').strip(),
-                        'author': book.get('author', '').strip() if book.get('author') else None,
-                        'publisher': book.get('publisher', '').strip() if book.get('publisher') else None,
-                        'isbn': book.get('isbn', '').strip() if book.get('isbn') else None,
-                        'confidence': int(book.get('confidence', 0)) if book.get('confidence') else 0
-                    }
-                    cleaned_books.append(cleaned_book)
-            
-            return cleaned_books
+            content = self._extract_content(response)
+            return self._parse_content(content)
             
         except Exception as e:
-            print(f"解析响应失败: {e}")
-            print(f"原始响应: {response}")
+            logger.warning("解析响应失败: %s", e)
+            logger.debug("原始响应: %s", response)
             raise ValueError(f"解析识别结果失败: {e}")
     
-    def _extract_json_from_text(self, text: str) -> List[Dict]:
-        """从文本中提取JSON"""
-        import re
+    def _parse_content(self, content: str) -> List[Dict]:
+        """解析模型返回的文本内容为书籍列表"""
+        books = self._load_json_array(content)
         
-        # 查找JSON数组
-        json_pattern = r'\[[\s\S]*?\]'
-        matches = re.findall(json_pattern, text)
+        # 验证和清理数据
+        cleaned_books = []
+        for book in books:
+            cleaned_book = self._clean_book(book)
+            if cleaned_book:
+                cleaned_books.append(cleaned_book)
         
-        for match in matches:
-            try:
-                return json.loads(match)
-            except json.JSONDecodeError:
-                continue
+        return cleaned_books
+    
+    def _load_json_array(self, content: str) -> List:
+        """从模型返回的文本中加载JSON数组"""
+        # 尝试解析JSON
+        try:
+            books = json.loads(content)
+        except json.JSONDecodeError:
+            # 如果直接解析失败，尝试提取JSON部分
+            books = self._extract_json_from_text(content)
+        
+        if not isinstance(books, list):
+            raise ValueError("返回的不是数组格式")
+        return books
+    
+    def _clean_book(self, book) -> Optional[Dict]:
+        """验证和清理单本书的数据，无效时返回None"""
+        if not isinstance(book, dict) or not book.get('title'):
+            return None
         
-        raise ValueError("无法从响应中提取有效的JSON")
+        return {
+            'title': book.get('title', '').strip(),
+            'author': book.get('author', '').strip() if book.get('author') else None,
+            'publisher': book.get('publisher', '').strip() if book.get('publisher') else None,
+            'isbn': book.get('isbn', '').strip() if book.get('isbn') else None,
+            'confidence': int(book.get('confidence', 0)) if book.get('confidence') else 0
+        }
+    
+    def _extract_json_from_text(self, text: str) -> List[Dict]:
+        """从文本中提取JSON（兼容代码块、说明文字和被截断的输出）"""
+        return extract_json_array(text)
     
     def validate_api_key(self, api_key: str) -> bool:
         """验证API Key是否有效"""
@@ -248,19 +696,22 @@ class QwenService:
                 }
             }
             
-            response = requests.post(
+            response = http_client.post(
                 self.api_url,
                 headers=headers,
                 json=test_payload,
                 timeout=10
             )
             
-            print(f"API Key验证响应: {response.status_code}")
+            logger.debug("API Key验证响应: %s", response.status_code)
             if response.status_code != 200:
-                print(f"API Key验证错误: {response.text}")
+                logger.warning("API Key验证错误: %s", response.text)
             
             return response.status_code == 200
             
         except Exception as e:
-            print(f"API Key验证失败: {e}")
+            logger.warning("API Key验证失败: %s", e)
             return False
+
+# 全局Qwen服务实例
+qwen_service = QwenService()
@@ -0,0 +1,198 @@
+import io
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple, Union
+
+from PIL import Image
+
+from ..models.database import db
+
+
+def dhash(image: Union[bytes, str], hash_size: int = 8) -> int:
+    """计算图片的差异哈希(dHash)，返回64位整数
+
+    image: 图片字节或图片文件路径
+    """
+    source = io.BytesIO(image) if isinstance(image, bytes) else image
+    with Image.open(source) as img:
+        # JPEG按最小DCT尺度解码，计算哈希只需要很小的灰度图
+        img.draft('L', (hash_size * 4, hash_size * 4))
+        small = img.convert('L').resize((hash_size + 1, hash_size), Image.Resampling.BILINEAR)
+        pixels = list(small.getdata())
+
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def hamming_distance(a: int, b: int) -> int:
+    """计算两个哈希的汉明距离"""
+    return bin(a ^ b).count('1')
+
+
+class BKTree:
+    """BK树 - 按汉明距离检索相近哈希"""
+
+    def __init__(self):
+        self.root: Optional[List] = None  # 节点结构: [hash, {distance: child}]
+        self.size = 0
+        self.deleted = set()
+
+    def add(self, value: int):
+        """添加哈希"""
+        if value in self.deleted:
+            self.deleted.discard(value)
+            return
+
+        if self.root is None:
+            self.root = [value, {}]
+            self.size = 1
+            return
+
+        node = self.root
+        while True:
+            distance = hamming_distance(value, node[0])
+            if distance == 0:
+                return
+            child = node[1].get(distance)
+            if child is None:
+                node[1][distance] = [value, {}]
+                self.size += 1
+                return
+            node = child
+
+    def remove(self, value: int):
+        """删除哈希（标记删除，过多时重建）"""
+        self.deleted.add(value)
+        if len(self.deleted) > self.size // 2:
+            self._rebuild()
+
+    def find_nearest(self, value: int, max_distance: int) -> Optional[Tuple[int, int]]:
+        """查找距离不超过max_distance的最近哈希，返回(hash, distance)"""
+        best = None
+        stack = [self.root] if self.root else []
+
+        while stack:
+            node = stack.pop()
+            distance = hamming_distance(value, node[0])
+            if distance <= max_distance and node[0] not in self.deleted:
+                if best is None or distance < best[1]:
+                    best = (node[0], distance)
+                    if distance == 0:
+                        break
+
+            # 三角不等式剪枝
+            low, high = distance - max_distance, distance + max_distance
+            for child_distance, child in node[1].items():
+                if low <= child_distance <= high:
+                    stack.append(child)
+
+        return best
+
+    def _rebuild(self):
+        values = []
+        stack = [self.root] if self.root else []
+        while stack:
+            node = stack.pop()
+            if node[0] not in self.deleted:
+                values.append(node[0])
+            stack.extend(node[1].values())
+
+        self.root = None
+        self.size = 0
+        self.deleted = set()
+        for value in values:
+            self.add(value)
+
+
+class RecognitionCache:
+    """识别结果缓存 - 重复或近似图片直接返回缓存的书籍列表"""
+
+    def __init__(self, max_entries: Optional[int] = None, threshold: Optional[int] = None):
+        self.enabled = os.getenv('RECOGNITION_CACHE_ENABLED', 'true').lower() == 'true'
+        self.max_entries = max_entries or int(os.getenv('RECOGNITION_CACHE_MAX_ENTRIES', 1000))
+        self.threshold = threshold if threshold is not None else int(os.getenv('RECOGNITION_CACHE_THRESHOLD', 5))
+        self.lock = threading.Lock()
+        self.tree = BKTree()
+        self.lru: 'OrderedDict[int, None]' = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._loaded = False
+
+    def _ensure_loaded(self):
+        """从数据库加载已有缓存条目"""
+        if self._loaded:
+            return
+        for entry in db.get_recognition_cache_entries():
+            value = int(entry['phash'], 16)
+            self.tree.add(value)
+            self.lru[value] = None
+        self._loaded = True
+
+    def lookup(self, image_hash: int) -> Optional[Dict]:
+        """查找相似图片的缓存结果"""
+        if not self.enabled:
+            return None
+
+        with self.lock:
+            self._ensure_loaded()
+            match = self.tree.find_nearest(image_hash, self.threshold)
+            if match is None:
+                self.misses += 1
+                return None
+            self.lru.move_to_end(match[0])
+
+        books = db.get_recognition_cache(f"{match[0]:016x}")
+        if books is None:
+            with self.lock:
+                self.misses += 1
+            return None
+
+        with self.lock:
+            self.hits += 1
+        return {'books': books, 'distance': match[1]}
+
+    def store(self, image_hash: int, books: List[Dict], model_used: str):
+        """保存识别结果，超出容量时淘汰最久未命中的条目"""
+        if not self.enabled:
+            return
+
+        db.save_recognition_cache(f"{image_hash:016x}", books, model_used)
+
+        with self.lock:
+            self._ensure_loaded()
+            self.tree.add(image_hash)
+            self.lru[image_hash] = None
+            self.lru.move_to_end(image_hash)
+
+            evicted = []
+            while len(self.lru) > self.max_entries:
+                value, _ = self.lru.popitem(last=False)
+                self.tree.remove(value)
+                evicted.append(f"{value:016x}")
+            self.evictions += len(evicted)
+
+        if evicted:
+            db.delete_recognition_cache(evicted)
+
+    def get_stats(self) -> Dict:
+        """获取缓存统计信息"""
+        with self.lock:
+            return {
+                'enabled': self.enabled,
+                'entries': len(self.lru),
+                'max_entries': self.max_entries,
+                'threshold': self.threshold,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+
+# 全局识别缓存实例
+recognition_cache = RecognitionCache()
@@ -0,0 +1,142 @@
+import binascii
+import io
+import json
+import uuid
+from typing import Dict, List, Optional
+
+# 每次编码的原始字节数（3的倍数，保证分段编码结果可以直接拼接）
+ENCODE_CHUNK_SIZE = 3 * 16 * 1024
+
+DATA_URI_PREFIX = b'data:image/jpeg;base64,'
+
+
+def base64_length(size: int) -> int:
+    """size字节数据Base64编码后的长度"""
+    return (size + 2) // 3 * 4
+
+
+def encode_base64_into(buffer: bytearray, offset: int, data: bytes) -> int:
+    """把data分段Base64编码后原地写入buffer[offset:]，返回写入结束的位置
+
+    每段只产生一个ENCODE_CHUNK_SIZE大小的临时对象，不会生成整张图片的Base64副本。
+    """
+    view = memoryview(data)
+    try:
+        for start in range(0, len(view), ENCODE_CHUNK_SIZE):
+            encoded = binascii.b2a_base64(view[start:start + ENCODE_CHUNK_SIZE], newline=False)
+            buffer[offset:offset + len(encoded)] = encoded
+            offset += len(encoded)
+    finally:
+        view.release()
+    return offset
+
+
+class BodyReader(io.RawIOBase):
+    """只读的请求体流 - 按块读取缓冲区，供requests/urllib3分块写入socket"""
+
+    def __init__(self, buffer: bytearray):
+        self.view = memoryview(buffer)
+        self.position = 0
+
+    def __len__(self) -> int:
+        return len(self.view)
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> bytes:
+        end = len(self.view) if size is None or size < 0 else min(self.position + size, len(self.view))
+        chunk = self.view[self.position:end].tobytes()
+        self.position = end
+        return chunk
+
+    def readinto(self, target) -> int:
+        size = min(len(target), len(self.view) - self.position)
+        target[:size] = self.view[self.position:self.position + size]
+        self.position += size
+        return size
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += len(self.view)
+        self.position = min(max(offset, 0), len(self.view))
+        return self.position
+
+    def tell(self) -> int:
+        return self.position
+
+
+class ImageRequestBody:
+    """多模态JSON请求体 - 图片直接Base64编码进一次性预分配的缓冲区
+
+    payload中的图片位置由占位符表示，只有不含图片的JSON骨架会被序列化为字符串；
+    不再产生Base64字符串、data URI和完整JSON文本等中间副本。
+    """
+
+    def __init__(self, payload: Dict, images: List[bytes], placeholders: List[str]):
+        self.payload = payload
+        self.images = images
+        self.placeholders = placeholders
+        self._buffer: Optional[bytearray] = None
+
+    @classmethod
+    def build(cls, payload_factory, images: List[bytes]) -> 'ImageRequestBody':
+        """payload_factory(placeholders)返回以占位符代替图片data URI的请求体字典"""
+        token = uuid.uuid4().hex
+        placeholders = [f'@@image-{token}-{index}@@' for index in range(len(images))]
+        return cls(payload_factory(placeholders), images, placeholders)
+
+    def with_parameters(self, **parameters) -> 'ImageRequestBody':
+        """返回追加了请求参数（如incremental_output）的新请求体，图片不重复拷贝"""
+        payload = {**self.payload, 'parameters': {**self.payload.get('parameters', {}), **parameters}}
+        return ImageRequestBody(payload, self.images, self.placeholders)
+
+    @property
+    def buffer(self) -> bytearray:
+        """完整的UTF-8 JSON请求体（首次访问时编码）"""
+        if self._buffer is None:
+            self._buffer = self._encode()
+        return self._buffer
+
+    def __len__(self) -> int:
+        return len(self.buffer)
+
+    def reader(self) -> BodyReader:
+        """以流的形式读取请求体"""
+        return BodyReader(self.buffer)
+
+    def _encode(self) -> bytearray:
+        skeleton = json.dumps(self.payload, ensure_ascii=False).encode('utf-8')
+
+        # 按占位符切分骨架，计算总长度后一次性分配
+        segments = []
+        rest = skeleton
+        for placeholder in self.placeholders:
+            before, separator, rest = rest.partition(json.dumps(placeholder).encode('utf-8'))
+            if not separator:
+                raise ValueError("请求体中缺少图片占位符")
+            segments.append(before)
+        segments.append(rest)
+
+        total = sum(len(segment) for segment in segments) + sum(
+            len(DATA_URI_PREFIX) + base64_length(len(image)) + 2 for image in self.images
+        )
+        buffer = bytearray(total)
+
+        offset = 0
+        for segment, image in zip(segments, self.images):
+            buffer[offset:offset + len(segment)] = segment
+            offset += len(segment)
+            buffer[offset] = ord('"')
+            buffer[offset + 1:offset + 1 + len(DATA_URI_PREFIX)] = DATA_URI_PREFIX
+            offset = encode_base64_into(buffer, offset + 1 + len(DATA_URI_PREFIX), image)
+            buffer[offset] = ord('"')
+            offset += 1
+        buffer[offset:offset + len(segments[-1])] = segments[-1]
+
+        return buffer
@@ -0,0 +1,429 @@
+import asyncio
+import os
+import random
+import threading
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, Deque, Dict, Optional, Tuple, Type
+
+from .log_config import get_logger
+
+logger = get_logger(__name__)
+
+
+class RetryableError(Exception):
+    """可重试的错误（如429限流、5xx），可携带服务端建议的等待时间"""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(Exception):
+    """熔断器打开，请求被快速拒绝"""
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """解析Retry-After响应头（秒数或HTTP日期）"""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class CircuitBreaker:
+    """熔断器 - 连续失败达到阈值后打开，冷却后放行一个探测请求"""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int = 5, recovery_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+        self.lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """当前是否允许发出请求"""
+        with self.lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.recovery_timeout:
+                self.state = self.HALF_OPEN
+                self.probe_in_flight = False
+            if self.state == self.HALF_OPEN and not self.probe_in_flight:
+                self.probe_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.state = self.CLOSED
+            self.consecutive_failures = 0
+            self.probe_in_flight = False
+
+    def release(self):
+        """请求以非上游故障结束（如参数错误），不影响熔断状态"""
+        with self.lock:
+            self.probe_in_flight = False
+
+    def record_failure(self):
+        with self.lock:
+            self.consecutive_failures += 1
+            self.probe_in_flight = False
+            if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+    def get_state(self) -> Dict:
+        with self.lock:
+            retry_in = 0.0
+            if self.state == self.OPEN:
+                retry_in = max(self.recovery_timeout - (time.monotonic() - self.opened_at), 0.0)
+            return {
+                'state': self.state,
+                'consecutive_failures': self.consecutive_failures,
+                'retry_in': round(retry_in, 2)
+            }
+
+
+class ProviderHealth:
+    """搜索源健康状态 - 最近若干次请求的错误率或中位延迟超过阈值时暂时跳过该搜索源
+
+    跳过和恢复复用CircuitBreaker的状态机：变为不健康时打开，冷却后放行一个探测请求，
+    探测成功且不慢则恢复，否则继续跳过。
+    """
+
+    def __init__(self, name: str, window: int = 20, min_samples: int = 5, max_error_rate: float = 0.5,
+                 max_latency_ms: float = 5000, cooldown: float = 30.0):
+        self.name = name
+        self.samples: Deque[Tuple[float, bool]] = deque(maxlen=window)
+        self.min_samples = min_samples
+        self.max_error_rate = max_error_rate
+        self.max_latency_ms = max_latency_ms
+        self.breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=cooldown)
+        self.skipped = 0
+        self.lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """当前是否请求该搜索源（不健康时返回False，冷却后放行一个探测请求）"""
+        allowed = self.breaker.allow()
+        if not allowed:
+            with self.lock:
+                self.skipped += 1
+        return allowed
+
+    def release(self):
+        """请求被取消、没有结果时调用：如果它是冷却后的探测请求，放行下一个探测请求"""
+        self.breaker.release()
+
+    def record(self, latency_ms: float, error: bool):
+        """记录一次请求的耗时和是否出错"""
+        with self.lock:
+            if self.breaker.state == CircuitBreaker.OPEN:
+                # 跳过期间仍在进行的请求陆续结束，不再重复判定
+                return
+            if self.breaker.state == CircuitBreaker.HALF_OPEN:
+                probe_failed = error or latency_ms >= self.max_latency_ms
+                if not probe_failed:
+                    self.samples.clear()
+            else:
+                self.samples.append((latency_ms, error))
+                probe_failed = None
+            unhealthy = probe_failed is None and self._unhealthy()
+            if unhealthy:
+                self.samples.clear()
+
+        if probe_failed is False:
+            self.breaker.record_success()
+            logger.info("搜索源 %s 已恢复", self.name)
+        elif probe_failed or unhealthy:
+            self.breaker.record_failure()
+            logger.warning("搜索源 %s 不健康，%.0f秒内跳过", self.name, self.breaker.recovery_timeout)
+
+    def _unhealthy(self) -> bool:
+        """窗口内错误率或中位延迟超过阈值（需持有锁）"""
+        if len(self.samples) < self.min_samples:
+            return False
+        errors = sum(1 for _, error in self.samples if error)
+        latencies = sorted(latency for latency, _ in self.samples)
+        return errors / len(self.samples) >= self.max_error_rate or \
+            latencies[len(latencies) // 2] >= self.max_latency_ms
+
+    def get_state(self) -> Dict:
+        with self.lock:
+            samples = list(self.samples)
+            skipped = self.skipped
+        return {
+            **self.breaker.get_state(),
+            'samples': len(samples),
+            'error_rate': round(sum(1 for _, error in samples if error) / max(len(samples), 1) * 100, 2),
+            'skipped': skipped
+        }
+
+
+def provider_health_from_env(name: str) -> ProviderHealth:
+    """按ENRICH_HEALTH_*环境变量创建搜索源健康状态"""
+    return ProviderHealth(
+        name,
+        window=int(os.getenv('ENRICH_HEALTH_WINDOW', 20)),
+        min_samples=int(os.getenv('ENRICH_HEALTH_MIN_SAMPLES', 5)),
+        max_error_rate=float(os.getenv('ENRICH_HEALTH_MAX_ERROR_RATE', 0.5)),
+        max_latency_ms=float(os.getenv('ENRICH_HEALTH_MAX_LATENCY_MS', 5000)),
+        cooldown=float(os.getenv('ENRICH_HEALTH_COOLDOWN', 30))
+    )
+
+
+class TokenBucket:
+    """令牌桶限流器 - 按配额QPS平滑发出请求"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1.0)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, timeout: Optional[float] = None) -> bool:
+        """获取一个令牌，令牌不足时等待；超时返回False"""
+        if self.rate <= 0:
+            return True
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait = (1 - self.tokens) / self.rate
+
+            if deadline is not None:
+                if time.monotonic() + wait > deadline:
+                    return False
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        """协程版本的acquire，等待时不阻塞事件循环"""
+        while not self.try_acquire():
+            await asyncio.sleep(1 / self.rate)
+
+    def try_acquire(self) -> bool:
+        """尝试立即获取一个令牌"""
+        if self.rate <= 0:
+            return True
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+    def get_state(self) -> Dict:
+        with self.lock:
+            return {
+                'rate': self.rate,
+                'capacity': self.capacity,
+                'tokens': round(self.tokens, 2)
+            }
+
+
+class ResilientEndpoint:
+    """带重试、熔断和限流的上游接口"""
+
+    def __init__(self, name: str, max_retries: int = 3, base_delay: float = 1.0, max_delay: float = 30.0,
+                 breaker: Optional[CircuitBreaker] = None, limiter: Optional[TokenBucket] = None,
+                 retry_on: Tuple[Type[BaseException], ...] = (RetryableError,),
+                 fail_on: Tuple[Type[BaseException], ...] = ()):
+        self.name = name
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breaker = breaker or CircuitBreaker()
+        self.limiter = limiter or TokenBucket(0)
+        self.retry_on = retry_on
+        # 计入熔断但不重试的上游错误（如非幂等请求的读超时：上游可能已在处理并计费）
+        self.fail_on = fail_on
+        self.lock = threading.Lock()
+        self.counters = {
+            'calls': 0,
+            'successes': 0,
+            'failures': 0,
+            'retries': 0,
+            'short_circuited': 0
+        }
+
+    def _count(self, key: str):
+        with self.lock:
+            self.counters[key] += 1
+
+    def backoff_delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """计算第attempt次重试前的等待时间（指数退避 + 全抖动，优先遵守Retry-After）"""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_delay))
+        return delay
+
+    def _retry_delay(self, attempt: int, error: BaseException, deadline: Optional[float]) -> Optional[float]:
+        """第attempt次失败后的重试等待时间，重试次数用完或重试会超过截止时间时返回None"""
+        if attempt >= self.max_retries:
+            return None
+        delay = self.backoff_delay(attempt, getattr(error, 'retry_after', None))
+        if deadline is not None and time.monotonic() + delay >= deadline:
+            return None
+        return delay
+
+    def call(self, func: Callable, deadline: Optional[float] = None):
+        """执行请求，可重试的错误按退避策略重试，熔断打开时快速失败
+
+        deadline: 可选的截止时间（time.monotonic()），重试等待会超过它时不再重试
+        """
+        self._count('calls')
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                self._count('short_circuited')
+                raise CircuitOpenError(f"{self.name} 熔断中，请稍后重试")
+
+            try:
+                self.limiter.acquire()
+                result = func()
+            except self.retry_on as e:
+                self.breaker.record_failure()
+                delay = self._retry_delay(attempt, e, deadline)
+                if delay is None:
+                    self._count('failures')
+                    raise
+                attempt += 1
+                self._count('retries')
+                logger.warning("%s 请求失败，%.1f秒后第%d次重试: %s", self.name, delay, attempt, e)
+                time.sleep(delay)
+                continue
+            except self.fail_on:
+                self.breaker.record_failure()
+                self._count('failures')
+                raise
+            except Exception:
+                self.breaker.release()
+                self._count('failures')
+                raise
+            except BaseException:
+                # 取消（asyncio.CancelledError）和中断没有结果，释放探测名额，否则熔断器一直停在半开状态
+                self.breaker.release()
+                raise
+
+            self.breaker.record_success()
+            self._count('successes')
+            return result
+
+    async def call_async(self, coro_func: Callable[[], Awaitable],
+                         retry_on: Optional[Tuple[Type[BaseException], ...]] = None,
+                         fail_on: Optional[Tuple[Type[BaseException], ...]] = None,
+                         deadline: Optional[float] = None):
+        """协程版本的call，retry_on和fail_on可覆盖可重试和计入熔断的异常类型（如异步客户端的超时）"""
+        retry_on = retry_on or self.retry_on
+        fail_on = fail_on or self.fail_on
+        self._count('calls')
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                self._count('short_circuited')
+                raise CircuitOpenError(f"{self.name} 熔断中，请稍后重试")
+
+            try:
+                await self.limiter.acquire_async()
+                result = await coro_func()
+            except retry_on as e:
+                self.breaker.record_failure()
+                delay = self._retry_delay(attempt, e, deadline)
+                if delay is None:
+                    self._count('failures')
+                    raise
+                attempt += 1
+                self._count('retries')
+                logger.warning("%s 请求失败，%.1f秒后第%d次重试: %s", self.name, delay, attempt, e)
+                await asyncio.sleep(delay)
+                continue
+            except fail_on:
+                self.breaker.record_failure()
+                self._count('failures')
+                raise
+            except Exception:
+                self.breaker.release()
+                self._count('failures')
+                raise
+            except BaseException:
+                # 取消（asyncio.CancelledError）和中断没有结果，释放探测名额，否则熔断器一直停在半开状态
+                self.breaker.release()
+                raise
+
+            self.breaker.record_success()
+            self._count('successes')
+            return result
+
+    def get_stats(self) -> Dict:
+        with self.lock:
+            counters = dict(self.counters)
+        return {
+            'name': self.name,
+            'max_retries': self.max_retries,
+            'breaker': self.breaker.get_state(),
+            'limiter': self.limiter.get_state(),
+            **counters
+        }
+
+
+class ResilienceRegistry:
+    """上游接口注册表"""
+
+    def __init__(self):
+        self.endpoints: Dict[str, ResilientEndpoint] = {}
+        self.lock = threading.Lock()
+
+    def register(self, endpoint: ResilientEndpoint) -> ResilientEndpoint:
+        with self.lock:
+            self.endpoints[endpoint.name] = endpoint
+        return endpoint
+
+    def get_stats(self) -> Dict:
+        with self.lock:
+            endpoints = list(self.endpoints.values())
+        return {endpoint.name: endpoint.get_stats() for endpoint in endpoints}
+
+
+def endpoint_from_env(name: str, prefix: str, retry_on: Tuple[Type[BaseException], ...] = (RetryableError,),
+                      fail_on: Tuple[Type[BaseException], ...] = ()) -> ResilientEndpoint:
+    """按环境变量（如QWEN_MAX_RETRIES、QWEN_QPS）创建并注册上游接口"""
+    qps = float(os.getenv(f'{prefix}_QPS', 0))
+    return resilience_registry.register(ResilientEndpoint(
+        name,
+        max_retries=int(os.getenv(f'{prefix}_MAX_RETRIES', 3)),
+        base_delay=float(os.getenv(f'{prefix}_RETRY_BASE_DELAY', 1.0)),
+        max_delay=float(os.getenv(f'{prefix}_RETRY_MAX_DELAY', 30.0)),
+        breaker=CircuitBreaker(
+            failure_threshold=int(os.getenv(f'{prefix}_BREAKER_THRESHOLD', 5)),
+            recovery_timeout=float(os.getenv(f'{prefix}_BREAKER_TIMEOUT', 30.0))
+        ),
+        limiter=TokenBucket(qps, float(os.getenv(f'{prefix}_QPS_BURST', 0)) or None),
+        retry_on=retry_on,
+        fail_on=fail_on
+    ))
+
+
+# 全局上游接口注册表
+resilience_registry = ResilienceRegistry()
@@ -1,10 +1,203 @@
 import requests
 import json
+import math
 import os
-import time
-from typing import List, Dict, Optional
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import sqlite3
 import threading
+import time
+from collections import deque
+from typing import Callable, Iterable, Iterator, List, Dict, Optional, Tuple
+from concurrent.futures import FIRST_COMPLETED, Future, as_completed, wait
+from functools import partial
+
+from .book_catalog import book_catalog
+from .enrichment_cache import enrichment_cache
+from .enrichment_pool import enrichment_pool
+from .enrichment_providers import INFO_FIELDS, PROVIDERS, ProviderChain, ProviderSpec, ProviderStats
+from .isbn import normalize_isbn
+from .log_config import get_logger
+from .resilience import provider_health_from_env
+from .single_flight import enrichment_flight
+from .text_match import cached_title_index, normalize_text, similarity
+from ..models.database import db
+
+logger = get_logger(__name__)
+
+
+def is_overload_status(status: int) -> bool:
+    """限流或服务端错误，说明搜索源过载"""
+    return status == 429 or status >= 500
+
+
+class LatencyWindow:
+    """滑动窗口延迟统计 - 记录最近的请求耗时，用于计算p95"""
+    
+    def __init__(self, size: int = 200, min_samples: int = 20):
+        self.samples = deque(maxlen=size)
+        self.min_samples = min_samples
+        self.lock = threading.Lock()
+    
+    def record(self, latency_ms: float):
+        with self.lock:
+            self.samples.append(latency_ms)
+    
+    def percentile(self, p: float) -> Optional[float]:
+        """返回第p百分位的耗时（毫秒），样本不足时返回None"""
+        with self.lock:
+            if len(self.samples) < self.min_samples:
+                return None
+            ordered = sorted(self.samples)
+        return ordered[min(math.ceil(len(ordered) * p / 100) - 1, len(ordered) - 1)]
+    
+    def get_stats(self) -> Dict:
+        with self.lock:
+            count = len(self.samples)
+        return {'samples': count, 'p50_ms': self.percentile(50), 'p95_ms': self.percentile(95)}
+
+
+class ProviderSchedule:
+    """一本书按搜索源链查询时的调度决策，线程池和协程两种驱动共用
+
+    驱动只负责发出请求和等待：step()发出现在该发出的请求（按顺序到期的搜索源和对冲请求），
+    返回查询是否已结束；未结束时最多等待wait_timeout()，把结束的请求交给completed()；
+    结束后用finish()取得合并结果和是否有搜索源失败。
+    刷新缓存中已过期的字段时传入cached（EnrichmentCache.get_entry的结果）：未过期的字段直接参与合并，
+    只需补上已过期的字段。
+    搜索源按_next_provider的顺序发起，合并结果已包含任务需要的字段时立即结束，
+    不再请求后面的源，也不等待较慢的源；某个源超过其p95仍未返回时再发出一次对冲请求，取先返回的结果。
+    """
+    
+    def __init__(self, service: 'SearchService', title: str, local: Optional[Dict], chain: ProviderChain,
+                 start: Callable[[str], object], now: float, cached: Optional[Dict] = None):
+        """start(搜索源)发出一次请求，返回可取消的请求句柄（Future或asyncio.Task）；now与驱动使用同一时钟"""
+        self.service = service
+        self.title = title
+        self.chain = chain
+        self.cached = cached
+        stale = tuple(cached['stale_fields']) if cached else ()
+        self.required_fields = tuple(dict.fromkeys(chain.required_fields + stale))
+        self.start = start
+        self.launch = chain.launch_order(name for name in chain.order if service._provider_available(name))
+        # 有搜索源被跳过、出错或超时，或者没有可用的搜索源时，空结果只写入短TTL的负缓存
+        self.failed = not self.launch
+        self.order, self.final_order = service._catalog_order(service._is_exact_local(local), chain)
+        self.deadline = now + service.book_deadline
+        # 请求句柄 -> (搜索源, 发出时间, 是否为对冲请求)
+        self.pending: Dict[object, Tuple[str, float, bool]] = {}
+        self.started = set()
+        self.hedged = set()
+        self.results: Dict[str, Optional[Dict]] = {'catalog': local}
+        if cached:
+            self.results['cache'] = cached['data']
+            self.order, self.final_order = ['cache'] + self.order, ['cache'] + self.final_order
+        self.due_at = math.inf
+    
+    def step(self, now: float) -> bool:
+        """发出现在该发出的请求，返回查询是否已结束（字段已足够、没有进行中的请求或超过截止时间）"""
+        service = self.service
+        search_results = service._merge_by_priority(self.results, self.order)
+        if service._is_sufficient(search_results, self.required_fields):
+            if self.pending:
+                service._count('early_completions')
+            return True
+        
+        spec, self.due_at = self._next_provider(search_results)
+        while spec is not None and self.due_at <= now:
+            self.started.add(spec.name)
+            if service.health[spec.name].allow():
+                self._send(spec.name, False, now)
+            else:
+                self.failed = True
+            spec, self.due_at = self._next_provider(search_results)
+        if not self.pending:
+            return True
+        
+        if now >= self.deadline:
+            service._count('deadline_exceeded')
+            logger.info("搜索书籍信息超时 %s，未返回的搜索源: %s", self.title,
+                        sorted({name for name, _, _ in self.pending.values()}))
+            self.failed = True
+            return True
+        
+        # 对超过p95仍未返回的搜索源发出对冲请求
+        for name, sent_at, _ in list(self.pending.values()):
+            p95 = service.latency[name].percentile(95) if service.hedge_enabled and name not in self.hedged else None
+            if p95 is not None and now - sent_at >= p95 / 1000:
+                self.hedged.add(name)
+                service._count('hedged')
+                self._send(name, True, now)
+        return False
+    
+    def wait_timeout(self, now: float) -> float:
+        """最多等待多久（秒）：截止时间、最早的对冲时间或下一个搜索源的发起时间"""
+        wake = min(self.deadline, self.due_at)
+        if self.service.hedge_enabled:
+            for name, sent_at, _ in self.pending.values():
+                p95 = self.service.latency[name].percentile(95) if name not in self.hedged else None
+                if p95 is not None:
+                    wake = min(wake, sent_at + p95 / 1000)
+        return max(wake - now, 0)
+    
+    def completed(self, handle):
+        """记录一个已结束的请求的结果，同一搜索源的另一个请求（对冲请求或原请求）不再需要"""
+        name, _, is_hedge = self.pending.pop(handle)
+        if name in self.results:
+            return
+        try:
+            self.results[name] = handle.result()
+        except Exception as e:
+            logger.warning("%s搜索失败 %s: %s", name, self.title, e)
+            self.results[name] = None
+            self.failed = True
+        if is_hedge:
+            self.service._count('hedge_wins')
+        for other in [other for other, (other_name, _, _) in self.pending.items() if other_name == name]:
+            self._drop(other)
+    
+    def cancel(self):
+        """取消所有进行中的请求"""
+        for handle in list(self.pending):
+            self._drop(handle)
+    
+    def _drop(self, handle):
+        """取消一个不再需要的请求。取消成功的请求不会记录结果，如果它是探测请求则需释放，
+        否则该搜索源一直停在半开状态被跳过；已在执行、无法取消的同步请求结束时照常记录结果"""
+        name, _, _ = self.pending.pop(handle)
+        if handle.cancel():
+            self.service.health[name].release()
+    
+    def finish(self, provider_stats: ProviderStats) -> Tuple[Dict, bool, Dict[str, float]]:
+        """记录各字段的来源，返回(按最终优先级合并的结果, 是否有搜索源被跳过、出错或超时,
+        沿用缓存的字段原来的过期时间)"""
+        sources = self.service._field_sources(self.results, self.final_order)
+        provider_stats.record_contribution({field: name for field, name in sources.items() if name != 'cache'})
+        kept = {
+            field: expires_at for field, expires_at in (self.cached or {}).get('field_expires', {}).items()
+            if sources.get(field) == 'cache'
+        }
+        return self.service._merge_by_priority(self.results, self.final_order), self.failed, kept
+    
+    def _send(self, name: str, is_hedge: bool, now: float):
+        self.pending[self.start(name)] = (name, now, is_hedge)
+    
+    def _next_provider(self, search_results: Dict) -> Tuple[Optional[ProviderSpec], float]:
+        """下一个要请求的搜索源及其发起时间，没有时返回(None, inf)
+        
+        跳过已请求过的和声明的字段补不上缺失字段的搜索源。没有进行中的请求时立即发起；
+        否则免费的搜索源在最近发出的请求超过其预期延迟后提前发起，消耗配额的搜索源等进行中的请求都结束后再决定。
+        """
+        missing = {field for field in self.required_fields if not search_results.get(field)}
+        for spec in self.launch:
+            if spec.name in self.started or not missing.intersection(spec.fields):
+                continue
+            if not self.pending:
+                return spec, 0.0
+            if spec.cost > 0:
+                return spec, math.inf
+            name, sent_at, _ = max(self.pending.values(), key=lambda request: request[1])
+            return spec, sent_at + self.service._expected_latency(name) / 1000
+        return None, math.inf
+
 
 class SearchService:
     """搜索服务 - 丰富书籍信息"""
@@ -13,229 +206,613 @@ class SearchService:
         self.google_api_key = os.getenv('GOOGLE_API_KEY')
         self.google_search_engine_id = os.getenv('GOOGLE_SEARCH_ENGINE_ID')
         self.douban_api_url = os.getenv('DOUBAN_API_URL', 'https://api.douban.com/v2/book/search')
-        self.cache = {}  # 简单的内存缓存
-        self.cache_lock = threading.Lock()
-        self.max_workers = 3
+        self.cache = enrichment_cache  # 内存LRU + SQLite两级缓存，进程内共享
+        self.flight = enrichment_flight  # 合并并发的相同查询
+        self.title_index = cached_title_index  # 已缓存书名的三元组索引，用于近似命中
+        self.fuzzy_threshold = float(os.getenv('ENRICH_FUZZY_THRESHOLD', 0.7))
+        self.pool = enrichment_pool  # 共享线程池，各搜索源有全局并发上限
+        
+        # 按搜索源链依次查询：每本书有总体截止时间，超过该源p95仍未返回时发出对冲请求；
+        # 任务需要的字段默认为ENRICH_SUFFICIENT_FIELDS，可由configs表的enrich_required_fields覆盖
+        self.book_deadline = float(os.getenv('ENRICH_BOOK_DEADLINE', 8))
+        self.hedge_enabled = os.getenv('ENRICH_HEDGE', 'true').lower() == 'true'
+        self.sufficient_fields = tuple(
+            field.strip() for field in os.getenv('ENRICH_SUFFICIENT_FIELDS', 'summary,cover_url').split(',') if field.strip()
+        )
+        self.catalog = book_catalog  # 本地离线书目库，命中且字段足够时不请求网络
+        self.isbn_batch_size = int(os.getenv('ENRICH_ISBN_BATCH_SIZE', 50))
+        # ISBN查到的书名与识别出的书名相似度低于该值时，ISBN结果只作为低优先级的补充（模型可能编出校验位正确的ISBN）
+        self.isbn_min_similarity = float(os.getenv('ENRICH_ISBN_MIN_SIMILARITY', 0.5))
+        self.latency = {name: LatencyWindow() for name in ('catalog', *PROVIDERS)}
+        # 网络搜索源的健康状态，错误率或延迟过高时暂时跳过
+        self.health = {name: provider_health_from_env(name) for name in PROVIDERS}
+        # 未查到结果时的负缓存TTL（秒）；因搜索源出错、超时或被跳过而没有结果时使用更短的TTL
+        self.negative_ttl = int(os.getenv('ENRICH_NEGATIVE_TTL', 6 * 3600))
+        self.negative_error_ttl = int(os.getenv('ENRICH_NEGATIVE_ERROR_TTL', 600))
+        self.stats_lock = threading.Lock()
+        self.search_counters = {
+            'lookups': 0,
+            'hedged': 0,
+            'hedge_wins': 0,
+            'early_completions': 0,
+            'deadline_exceeded': 0,
+            'local_hits': 0,
+            'isbn_hits': 0,
+            'isbn_mismatches': 0,
+            'isbn_requests': 0,
+            'fuzzy_hits': 0,
+            'negative_cached': 0,
+            'negative_hits': 0
+        }
     
     def enrich_books(self, books: List[Dict]) -> List[Dict]:
-        """丰富书籍信息"""
-        if not books:
-            return []
-        
-        enriched_books = []
-        
-        # 使用线程池并行处理
-        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-            # 提交所有搜索任务
-            future_to_book = {
-                executor.submit(self._enrich_single_book, book): book 
-                for book in books
-            }
-            
-            # 收集结果
-            for future in as_completed(future_to_book):
+        """丰富书籍信息，保持原有顺序"""
+        enriched_books = list(books)
+        for index, book in self.iter_enriched(books):
+            enriched_books[index] = book
+        return enriched_books
+    
+    def iter_enriched(self, books: List[Dict], futures: Optional[List[Future]] = None,
+                      provider_stats: Optional[ProviderStats] = None) -> Iterator[Tuple[int, Dict]]:
+        """按完成顺序逐本产出(原始位置, 丰富后的书籍)
+        
+        futures为已提交的_enrich_single_book任务（如流式识别阶段提交的），与books一一对应；
+        未传入时按provider_stats的搜索源链提交到共享线程池。生成器提前关闭时取消尚未开始的搜索。
+        """
+        if futures is None:
+            provider_stats = provider_stats or self.new_provider_stats()
+            self.prefetch_isbns(books)
+            futures = [self.pool.submit_book(self._enrich_single_book, book, provider_stats) for book in books]
+        index_of = {future: index for index, future in enumerate(futures)}
+        
+        try:
+            for future in as_completed(index_of):
+                index = index_of[future]
                 try:
-                    enriched_book = future.result()
-                    enriched_books.append(enriched_book)
+                    yield index, future.result()
                 except Exception as e:
-                    original_book = future_to_book[future]
-                    print(f"搜索书籍信息失败 {original_book.get('title', 'Unknown')}: {e}")
+                    logger.warning("搜索书籍信息失败 %s: %s", books[index].get('title', 'Unknown'), e)
                     # 如果搜索失败，返回原始信息
-                    enriched_books.append(original_book)
-        
-        return enriched_books
+                    yield index, books[index]
+        finally:
+            for future in futures:
+                future.cancel()
+    
+    def new_provider_stats(self) -> ProviderStats:
+        """按configs表中当前的搜索源链创建一次扫描的搜索源统计"""
+        return ProviderStats(ProviderChain.load(self.sufficient_fields))
     
-    def _enrich_single_book(self, book: Dict) -> Dict:
-        """丰富单本书的信息"""
+    def _enrich_single_book(self, book: Dict, provider_stats: Optional[ProviderStats] = None) -> Dict:
+        """丰富单本书的信息：有有效ISBN时先按ISBN精确查询，字段不足时再按书名/作者搜索"""
+        provider_stats = provider_stats or self.new_provider_stats()
         title = book.get('title', '')
-        author = book.get('author', '')
+        author = book.get('author') or ''
+        
+        isbn_info = None
+        isbn_trusted = False
+        isbn = normalize_isbn(book.get('isbn'))
+        if isbn:
+            isbn_info = self._lookup_isbn(isbn)
+            isbn_trusted = self._isbn_matches_title(isbn_info, title)
+            if isbn_trusted and self._is_sufficient(isbn_info, provider_stats.chain.required_fields):
+                self._count('isbn_hits')
+                provider_stats.record_source('isbn')
+                return {**book, **self._isbn_fields(isbn_info)}
         
         if not title:
-            return book
+            return {**book, **self._isbn_fields(isbn_info)} if isbn_info else book
         
-        # 检查缓存
-        cache_key = f"{title}_{author}".lower()
-        with self.cache_lock:
-            if cache_key in self.cache:
-                cached_info = self.cache[cache_key]
-                return {**book, **cached_info}
+        # 检查缓存：有字段已过期时只重新查询这些字段
+        cached = self._get_cached(title, author)
+        info = cached['data'] if cached is not None and not cached['stale_fields'] else None
+        looked_up = False
+        if info is None:
+            def lookup():
+                nonlocal looked_up
+                looked_up = True
+                return self._lookup_book_info(title, author, provider_stats, cached)
+            
+            # 并发任务中相同的书只查询一次，其余调用方等待同一个结果
+            info = self.flight.do(self._cache_key(title, author), lookup)
+        provider_stats.record_source('lookup' if looked_up else 'cache')
+        return {**book, **self._merge_isbn_info(isbn_info, info, isbn_trusted)}
+    
+    def prefetch_isbns(self, books: List[Dict]) -> int:
+        """批量查询整个书架的ISBN（每个请求最多isbn_batch_size个），结果写入缓存，返回查询的ISBN数"""
+        missing = self._missing_isbns(books)
+        if missing:
+            self._fetch_isbns(missing)
+        return len(missing)
+    
+    def _missing_isbns(self, books: List[Dict]) -> List[str]:
+        """缓存和本地书目库中都没有的有效ISBN（去重，保持顺序）"""
+        missing = []
+        for book in books:
+            isbn = normalize_isbn(book.get('isbn'))
+            if isbn and isbn not in missing and self.cache.get(self._isbn_cache_key(isbn)) is None \
+                    and not self._lookup_local_isbn(isbn):
+                missing.append(isbn)
+        return missing
+    
+    def _lookup_isbn(self, isbn: str) -> Optional[Dict]:
+        """按ISBN-13查询：缓存、本地书目库、Open Library依次尝试"""
+        known = self._known_isbn(isbn)
+        if known is not None:
+            return known
         
-        # 并行搜索多个源
-        search_results = {}
+        return self.flight.do(self._isbn_cache_key(isbn), lambda: self._fetch_isbns([isbn]).get(isbn))
+    
+    def _known_isbn(self, isbn: str) -> Optional[Dict]:
+        """缓存或本地书目库中的ISBN查询结果，都没有时返回None"""
+        cached = self.cache.get(self._isbn_cache_key(isbn))
+        if cached is not None:
+            return cached
+        return self._lookup_local_isbn(isbn) or None
+    
+    def _lookup_local_isbn(self, isbn: str) -> Optional[Dict]:
+        """按ISBN查询本地书目库"""
+        if not self.catalog.available:
+            return None
+        try:
+            local = self.catalog.lookup_isbn(isbn)
+        except sqlite3.Error as e:
+            logger.warning("本地书目库ISBN查询失败 %s: %s", isbn, e)
+            return None
+        return {**self._info(local), 'title': local.get('title', '')} if local else None
+    
+    def _fetch_isbns(self, isbns: List[str]) -> Dict[str, Dict]:
+        """通过Open Library bibkeys接口批量查询ISBN，结果写入缓存"""
+        results = {}
+        not_found = []
+        for chunk in self._isbn_chunks(isbns):
+            if not self.health['openlibrary'].allow():
+                break
+            self._count('isbn_requests')
+            try:
+                found = self.pool.call_provider('openlibrary', self._timed_search, 'openlibrary', self._search_isbns, chunk)
+            except Exception as e:
+                logger.warning("Open Library ISBN查询失败 %s: %s", chunk, e)
+                continue
+            results.update(found)
+            not_found.extend(isbn for isbn in chunk if isbn not in found)
+        self._store_isbn_results(results, not_found)
+        return results
+    
+    def _isbn_chunks(self, isbns: List[str]) -> List[List[str]]:
+        return [isbns[i:i + self.isbn_batch_size] for i in range(0, len(isbns), self.isbn_batch_size)]
+    
+    def _isbn_cache_key(self, isbn: str) -> str:
+        return f'isbn:{isbn}'
+    
+    def _store_isbn_results(self, results: Dict[str, Dict], not_found: Iterable[str] = ()):
+        """写入ISBN查询结果，查询成功但不存在的ISBN写入负缓存"""
+        for isbn, info in results.items():
+            self.cache.set(self._isbn_cache_key(isbn), info)
+        for isbn in not_found:
+            self.cache.set(self._isbn_cache_key(isbn), self._info({}), ttl=self.negative_ttl)
+            self._count('negative_cached')
+    
+    def _merge_isbn_info(self, isbn_info: Optional[Dict], info: Dict, trusted: bool = True) -> Dict:
+        """合并ISBN查询和书名搜索的结果：ISBN书名核对通过时ISBN结果优先，否则只补充书名搜索缺失的字段"""
+        if not isbn_info:
+            return info
+        order = ['isbn', 'text'] if trusted else ['text', 'isbn']
+        return self._info(self._merge_by_priority({'isbn': isbn_info, 'text': info}, order))
+    
+    def _isbn_matches_title(self, isbn_info: Optional[Dict], title: str) -> bool:
+        """ISBN查到的书名与识别出的书名是否相符（互相包含或相似度不低于isbn_min_similarity）
+        
+        没有识别出书名时无法核对，沿用ISBN结果；ISBN结果没有书名（旧缓存）时视为不相符。
+        """
+        if not isbn_info:
+            return False
+        if not title:
+            return True
+        recognized, found = normalize_text(title), normalize_text(isbn_info.get('title'))
+        if found and (recognized in found or found in recognized or
+                      similarity(recognized, found) >= self.isbn_min_similarity):
+            return True
+        self._count('isbn_mismatches')
+        return False
+    
+    def _isbn_fields(self, isbn_info: Dict) -> Dict:
+        """ISBN结果中用于丰富书籍的字段（书名只用于核对，不覆盖识别结果）"""
+        return {field: value for field, value in isbn_info.items() if field != 'title'}
+    
+    def _lookup_book_info(self, title: str, author: str, provider_stats: Optional[ProviderStats] = None,
+                          cached: Optional[Dict] = None) -> Dict:
+        """按搜索源链查询并写入缓存，返回缓存格式的书籍信息（调度策略见ProviderSchedule）
+
+        cached为有字段已过期的缓存条目时，未过期的字段沿用缓存的值和过期时间，只重新查询已过期的字段。
+        """
+        provider_stats = provider_stats or self.new_provider_stats()
+        self._count('lookups')
+        local = self._lookup_local(title, author)
+        if self._local_answer(local, provider_stats):
+            return self._info(local)
+        
+        def start(name: str) -> Future:
+            search = partial(self._timed_search, name, self._provider_search(name), provider_stats=provider_stats)
+            return self.pool.submit_provider(name, search, title, author)
         
+        schedule = ProviderSchedule(self, title, local, provider_stats.chain, start, time.monotonic(), cached)
         try:
-            # 搜索豆瓣
-            douban_info = self._search_douban(title, author)
-            if douban_info:
-                search_results.update(douban_info)
-            
-            # 搜索Google（如果配置了）
-            if self.google_api_key and self.google_search_engine_id:
-                google_info = self._search_google(title, author)
-                if google_info:
-                    search_results.update(google_info)
-            
-        except Exception as e:
-            print(f"搜索书籍信息时出错 {title}: {e}")
-        
-        # 合并结果
-        enriched_book = {**book}
-        
-        # 添加搜索到的信息
-        if 'summary' in search_results:
-            enriched_book['summary'] = search_results['summary']
-        if 'cover_url' in search_results:
-            enriched_book['cover_url'] = search_results['cover_url']
-        if 'pages' in search_results:
-            enriched_book['pages'] = search_results['pages']
-        if 'rating' in search_results:
-            enriched_book['rating'] = search_results['rating']
-        if 'pubdate' in search_results:
-            enriched_book['pubdate'] = search_results['pubdate']
-        if 'price' in search_results:
-            enriched_book['price'] = search_results['price']
-        
-        # 缓存结果
-        with self.cache_lock:
-            self.cache[cache_key] = {
-                'summary': enriched_book.get('summary', ''),
-                'cover_url': enriched_book.get('cover_url', ''),
-                'pages': enriched_book.get('pages', ''),
-                'rating': enriched_book.get('rating', ''),
-                'pubdate': enriched_book.get('pubdate', ''),
-                'price': enriched_book.get('price', '')
-            }
+            while not schedule.step(time.monotonic()):
+                done, _ = wait(schedule.pending, timeout=schedule.wait_timeout(time.monotonic()),
+                               return_when=FIRST_COMPLETED)
+                for future in done:
+                    schedule.completed(future)
+        finally:
+            schedule.cancel()
+        return self._store_search_results(title, author, *schedule.finish(provider_stats))
+    
+    def _local_answer(self, local: Optional[Dict], provider_stats: ProviderStats) -> bool:
+        """本地书目库按书名精确命中且已包含任务需要的字段时直接作为结果，不请求网络"""
+        if not self._is_exact_local(local) or not self._is_sufficient(local, provider_stats.chain.required_fields):
+            return False
+        self._count('local_hits')
+        provider_stats.record_contribution(self._field_sources({'catalog': local}, ['catalog']))
+        return True
+    
+    def _is_exact_local(self, local: Optional[Dict]) -> bool:
+        """本地书目库是否按书名精确命中（书名相近的候选不能直接作为结果）"""
+        return bool(local) and local.get('match') == 'exact'
+    
+    def _catalog_order(self, exact: bool, chain: ProviderChain) -> Tuple[List[str], List[str]]:
+        """返回(判断字段是否足够时的合并顺序, 最终合并顺序)
         
-        return enriched_book
+        精确命中的本地书目优先级最高；书名相近的候选不参与是否足够的判断，只在最后补充缺失的字段。
+        """
+        if exact:
+            order = ['catalog'] + chain.order
+            return order, order
+        return chain.order, chain.order + ['catalog']
     
-    def _search_douban(self, title: str, author: str = '') -> Optional[Dict]:
-        """使用豆瓣API搜索书籍信息"""
+    def _lookup_local(self, title: str, author: str) -> Optional[Dict]:
+        """查询本地书目库（优先级最高的搜索源，同步执行，通常在1毫秒以内）"""
+        if not self.catalog.available:
+            return None
+        start = time.perf_counter()
         try:
-            search_query = f'{title} {author}'.strip()
-            params = {
-                'q': search_query,
-                'count': 1
+            return self.catalog.lookup(title, author)
+        except sqlite3.Error as e:
+            logger.warning("本地书目库查询失败 %s: %s", title, e)
+            return None
+        finally:
+            self.latency['catalog'].record((time.perf_counter() - start) * 1000)
+    
+    def _provider_available(self, name: str) -> bool:
+        """搜索源是否已配置（Google需要API Key）"""
+        return name != 'google' or self.google_enabled
+    
+    def _provider_search(self, name: str) -> Callable:
+        """搜索源对应的同步搜索方法"""
+        return getattr(self, f'_search_{name}')
+    
+    def _expected_latency(self, name: str) -> float:
+        """搜索源的预期延迟（毫秒）：实测中位数，样本不足时使用声明值"""
+        p50 = self.latency[name].percentile(50)
+        return p50 if p50 is not None else PROVIDERS[name].expected_latency_ms
+    
+    def _timed_search(self, name: str, search: Callable, *args, provider_stats: Optional[ProviderStats] = None):
+        """执行搜索，记录耗时和是否出错"""
+        start = time.perf_counter()
+        error = False
+        try:
+            return search(*args)
+        except Exception:
+            error = True
+            raise
+        finally:
+            self._record_outcome(name, (time.perf_counter() - start) * 1000, error, provider_stats)
+    
+    def _record_outcome(self, name: str, latency_ms: float, error: bool,
+                        provider_stats: Optional[ProviderStats] = None):
+        """更新搜索源的延迟统计和健康状态，以及本次扫描的搜索源统计"""
+        self.latency[name].record(latency_ms)
+        self.health[name].record(latency_ms, error)
+        if provider_stats is not None:
+            provider_stats.record_call(name, latency_ms, error)
+    
+    def _merge_by_priority(self, results: Dict[str, Optional[Dict]], order: List[str]) -> Dict:
+        """按搜索源优先级合并结果：每个字段取优先级最高的非空值"""
+        merged = {}
+        for name in order:
+            for field, value in (results.get(name) or {}).items():
+                if value and not merged.get(field):
+                    merged[field] = value
+        return merged
+    
+    def _field_sources(self, results: Dict[str, Optional[Dict]], order: List[str]) -> Dict[str, str]:
+        """按优先级合并时每个书籍信息字段取自哪个搜索源"""
+        sources = {}
+        for name in order:
+            for field in INFO_FIELDS:
+                if field not in sources and (results.get(name) or {}).get(field):
+                    sources[field] = name
+        return sources
+    
+    def _is_sufficient(self, search_results: Dict, fields: Optional[Iterable[str]] = None) -> bool:
+        """合并结果是否已包含需要的字段（默认为sufficient_fields）"""
+        return all(search_results.get(field) for field in (self.sufficient_fields if fields is None else fields))
+    
+    def _count(self, key: str):
+        with self.stats_lock:
+            self.search_counters[key] += 1
+    
+    def get_search_stats(self) -> Dict:
+        """获取多源搜索的延迟和对冲统计"""
+        with self.stats_lock:
+            counters = dict(self.search_counters)
+        return {
+            'book_deadline': self.book_deadline,
+            'hedge_enabled': self.hedge_enabled,
+            'latency': {name: window.get_stats() for name, window in self.latency.items()},
+            'catalog': self.catalog.get_stats(),
+            'fuzzy_threshold': self.fuzzy_threshold,
+            'indexed_titles': len(self.title_index),
+            'negative_ttl': self.negative_ttl,
+            'health': {name: health.get_state() for name, health in self.health.items()},
+            'providers': [spec.to_dict() for spec in PROVIDERS.values()],
+            **counters
+        }
+    
+    @property
+    def google_enabled(self) -> bool:
+        """是否配置了Google搜索"""
+        return bool(self.google_api_key and self.google_search_engine_id)
+    
+    def _cache_key(self, title: str, author: str) -> str:
+        """生成缓存键（书名和作者规范化后拼接，全半角、标点、繁简差异不影响命中）"""
+        return f"{normalize_text(title)}_{normalize_text(author)}"
+    
+    def _get_cached(self, title: str, author: str) -> Optional[Dict]:
+        """读取缓存条目（格式见EnrichmentCache.get_entry），精确键未命中时使用书名相似度超过阈值的条目"""
+        cached = self.cache.get_entry(self._cache_key(title, author))
+        if cached is not None:
+            if not any(cached['data'].values()) and not cached['stale_fields']:
+                self._count('negative_hits')
+            return cached
+        if self.fuzzy_threshold <= 0:
+            return None
+        
+        self.title_index.ensure_loaded(self._load_cached_titles)
+        match = self.title_index.best_match(normalize_text(title), normalize_text(author), self.fuzzy_threshold)
+        if match is None:
+            return None
+        cached = self.cache.get_entry(match)
+        if cached is None or not any(cached['data'].values()):
+            # 条目已过期、被淘汰，或是其他书名的负缓存
+            self.title_index.remove(match)
+            return None
+        self._count('fuzzy_hits')
+        return cached
+    
+    def _load_cached_titles(self) -> List[Tuple[str, str, str]]:
+        """从缓存表的键还原(键, 书名, 作者)，跳过ISBN键和旧格式的键"""
+        entries = []
+        for key in db.get_enrichment_cache_keys(time.time()):
+            title, separator, author = key.partition('_')
+            if separator and title and normalize_text(title) == title and normalize_text(author) == author:
+                entries.append((key, title, author))
+        return entries
+    
+    def _store_search_results(self, title: str, author: str, search_results: Dict, failed: bool = False,
+                              field_expires: Optional[Dict[str, float]] = None) -> Dict:
+        """提取搜索结果中的书籍信息字段并写入缓存（field_expires中沿用缓存的字段保留原来的过期时间）
+
+        没有任何结果时写入负缓存：各搜索源都正常返回时使用negative_ttl，
+        有搜索源出错、超时或被跳过时使用更短的negative_error_ttl。
+        """
+        info = self._info(search_results)
+        key = self._cache_key(title, author)
+        if any(info.values()):
+            self.cache.set(key, info, field_expires=field_expires)
+            self.title_index.add(key, normalize_text(title), normalize_text(author))
+        else:
+            self.cache.set(key, info, ttl=self.negative_error_ttl if failed else self.negative_ttl)
+            self._count('negative_cached')
+        return info
+    
+    def _info(self, search_results: Dict) -> Dict:
+        """提取搜索结果中的书籍信息字段"""
+        return {field: search_results.get(field, '') for field in INFO_FIELDS}
+    
+    def _douban_request(self, title: str, author: str = '') -> Tuple[str, Dict]:
+        """构造豆瓣搜索请求，返回(url, params)"""
+        search_query = f'{title} {author}'.strip()
+        return self.douban_api_url, {
+            'q': search_query,
+            'count': 1
+        }
+    
+    def _parse_douban(self, data: Dict) -> Optional[Dict]:
+        """解析豆瓣搜索结果"""
+        if data.get('books'):
+            book = data['books'][0]
+            return {
+                'summary': book.get('summary', ''),
+                'cover_url': book.get('image', ''),
+                'pages': book.get('pages', ''),
+                'rating': book.get('rating', {}).get('average', ''),
+                'pubdate': book.get('pubdate', ''),
+                'price': book.get('price', ''),
+                'publisher': book.get('publisher', ''),
+                'author': book.get('author', [])
             }
-            
-            response = requests.get(
-                self.douban_api_url,
-                params=params,
-                timeout=10
-            )
-            
-            if response.status_code == 200:
-                data = response.json()
-                
-                if data.get('books'):
-                    book = data['books'][0]
-                    return {
-                        'summary': book.get('summary', ''),
-                        'cover_url': book.get('image', ''),
-                        'pages': book.get('pages', ''),
-                        'rating': book.get('rating', {}).get('average', ''),
-                        'pubdate': book.get('pubdate', ''),
-                        'price': book.get('price', ''),
-                        'publisher': book.get('publisher', ''),
-                        'author': book.get('author', [])
-                    }
-            
-        except Exception as e:
-            print(f"豆瓣搜索失败 {title}: {e}")
+        return None
+    
+    def _search_douban(self, title: str, author: str = '') -> Optional[Dict]:
+        """使用豆瓣API搜索书籍信息（网络错误、限流和5xx向上抛出，由并发限制器计为错误）"""
+        url, params = self._douban_request(title, author)
+        
+        response = requests.get(
+            url,
+            params=params,
+            timeout=10
+        )
+        
+        if response.status_code == 200:
+            return self._parse_douban(response.json())
+        if is_overload_status(response.status_code):
+            response.raise_for_status()
         
         return None
     
-    def _search_google(self, title: str, author: str = '') -> Optional[Dict]:
-        """使用Google Custom Search API搜索书籍信息"""
-        try:
-            search_query = f'"{title}" {author} 书籍 简介 摘要'
-            
-            url = "https://www.googleapis.com/customsearch/v1"
-            params = {
-                'key': self.google_api_key,
-                'cx': self.google_search_engine_id,
-                'q': search_query,
-                'num': 3
+    def _google_request(self, title: str, author: str = '') -> Tuple[str, Dict]:
+        """构造Google Custom Search请求，返回(url, params)"""
+        search_query = f'"{title}" {author} 书籍 简介 摘要'
+        
+        url = "https://www.googleapis.com/customsearch/v1"
+        return url, {
+            'key': self.google_api_key,
+            'cx': self.google_search_engine_id,
+            'q': search_query,
+            'num': 3
+        }
+    
+    def _parse_google(self, data: Dict) -> Optional[Dict]:
+        """解析Google搜索结果"""
+        if 'items' in data and data['items']:
+            # 提取第一个结果的摘要
+            first_item = data['items'][0]
+            return {
+                'summary': first_item.get('snippet', ''),
+                'cover_url': '',  # Google搜索通常不提供封面
+                'pages': '',
+                'rating': '',
+                'pubdate': '',
+                'price': ''
             }
-            
-            response = requests.get(url, params=params, timeout=10)
-            
-            if response.status_code == 200:
-                data = response.json()
-                
-                if 'items' in data and data['items']:
-                    # 提取第一个结果的摘要
-                    first_item = data['items'][0]
-                    return {
-                        'summary': first_item.get('snippet', ''),
-                        'cover_url': '',  # Google搜索通常不提供封面
-                        'pages': '',
-                        'rating': '',
-                        'pubdate': '',
-                        'price': ''
-                    }
-            
-        except Exception as e:
-            print(f"Google搜索失败 {title}: {e}")
+        return None
+    
+    def _search_google(self, title: str, author: str = '') -> Optional[Dict]:
+        """使用Google Custom Search API搜索书籍信息（网络错误、限流和5xx向上抛出）"""
+        url, params = self._google_request(title, author)
+        
+        response = requests.get(url, params=params, timeout=10)
+        
+        if response.status_code == 200:
+            return self._parse_google(response.json())
+        if is_overload_status(response.status_code):
+            response.raise_for_status()
         
         return None
     
-    def _search_openlibrary(self, title: str, author: str = '') -> Optional[Dict]:
-        """使用Open Library API搜索书籍信息（备用方案）"""
-        try:
-            search_query = f'{title} {author}'.strip()
-            
-            # 搜索API
-            search_url = "https://openlibrary.org/search.json"
-            params = {
-                'title': title,
-                'author': author,
-                'limit': 1
-            }
-            
-            response = requests.get(search_url, params=params, timeout=10)
+    def _openlibrary_isbn_request(self, isbns: List[str]) -> Tuple[str, Dict]:
+        """构造Open Library批量ISBN请求，返回(url, params)"""
+        return 'https://openlibrary.org/api/books', {
+            'bibkeys': ','.join(f'ISBN:{isbn}' for isbn in isbns),
+            'format': 'json',
+            'jscmd': 'data'
+        }
+    
+    def _parse_openlibrary_isbns(self, data: Dict) -> Dict[str, Dict]:
+        """解析bibkeys接口结果，返回 {ISBN-13: 书籍信息}（包含用于核对的书名）"""
+        results = {}
+        for bibkey, book in (data or {}).items():
+            isbn = normalize_isbn(bibkey.partition(':')[2])
+            if not isbn or not isinstance(book, dict):
+                continue
             
-            if response.status_code == 200:
-                data = response.json()
-                
-                if 'docs' in data and data['docs']:
-                    book = data['docs'][0]
-                    
-                    # 获取详细信息
-                    work_key = book.get('key')
-                    if work_key:
-                        work_url = f"https://openlibrary.org{work_key}.json"
-                        work_response = requests.get(work_url, timeout=10)
-                        
-                        if work_response.status_code == 200:
-                            work_data = work_response.json()
-                            description = work_data.get('description', '')
-                            
-                            if isinstance(description, dict):
-                                description = description.get('value', '')
-                            
-                            return {
-                                'summary': description[:500] if description else '',  # 限制长度
-                                'cover_url': f"https://covers.openlibrary.org/b/id/{book.get('cover_i', '')}-L.jpg" if book.get('cover_i') else '',
-                                'pages': book.get('number_of_pages_median', ''),
-                                'rating': '',
-                                'pubdate': book.get('first_publish_year', ''),
-                                'price': ''
-                            }
+            notes = book.get('notes', '')
+            if isinstance(notes, dict):
+                notes = notes.get('value', '')
+            excerpts = book.get('excerpts') or []
+            summary = notes
+            if not summary and excerpts and isinstance(excerpts[0], dict):
+                summary = excerpts[0].get('text', '')
+            cover = book.get('cover') or {}
             
-        except Exception as e:
-            print(f"Open Library搜索失败 {title}: {e}")
+            results[isbn] = {
+                'title': book.get('title', ''),
+                'summary': summary[:500] if summary else '',
+                'cover_url': cover.get('large') or cover.get('medium') or '',
+                'pages': book.get('number_of_pages', ''),
+                'rating': '',
+                'pubdate': book.get('publish_date', ''),
+                'price': ''
+            }
+        return results
+    
+    def _search_isbns(self, isbns: List[str]) -> Dict[str, Dict]:
+        """使用Open Library bibkeys接口一次查询多个ISBN（网络错误、限流和5xx向上抛出）"""
+        url, params = self._openlibrary_isbn_request(isbns)
+        
+        response = requests.get(url, params=params, timeout=10)
+        
+        if response.status_code == 200:
+            return self._parse_openlibrary_isbns(response.json())
+        if is_overload_status(response.status_code):
+            response.raise_for_status()
+        
+        return {}
+    
+    def _openlibrary_request(self, title: str, author: str = '') -> Tuple[str, Dict]:
+        """构造Open Library搜索请求，返回(url, params)"""
+        return 'https://openlibrary.org/search.json', {
+            'title': title,
+            'author': author,
+            'limit': 1
+        }
+    
+    def _openlibrary_work_request(self, work_key: str) -> Tuple[str, Dict]:
+        """构造Open Library作品详情请求（简介在作品详情中）"""
+        return f"https://openlibrary.org{work_key}.json", {}
+    
+    def _first_openlibrary_doc(self, data: Optional[Dict]) -> Optional[Dict]:
+        docs = (data or {}).get('docs')
+        return docs[0] if docs else None
+    
+    def _parse_openlibrary(self, book: Dict, work_data: Optional[Dict]) -> Dict:
+        """合并搜索结果和作品详情"""
+        description = (work_data or {}).get('description', '')
+        if isinstance(description, dict):
+            description = description.get('value', '')
+        
+        return {
+            'summary': description[:500] if description else '',  # 限制长度
+            'cover_url': f"https://covers.openlibrary.org/b/id/{book.get('cover_i', '')}-L.jpg" if book.get('cover_i') else '',
+            'pages': book.get('number_of_pages_median', ''),
+            'rating': '',
+            'pubdate': book.get('first_publish_year', ''),
+            'price': ''
+        }
+    
+    def _get_openlibrary_json(self, request: Tuple[str, Dict]) -> Optional[Dict]:
+        url, params = request
+        response = requests.get(url, params=params, timeout=10)
+        
+        if response.status_code == 200:
+            return response.json()
+        if is_overload_status(response.status_code):
+            response.raise_for_status()
         
         return None
     
+    def _search_openlibrary(self, title: str, author: str = '') -> Optional[Dict]:
+        """使用Open Library API搜索书籍信息（网络错误、限流和5xx向上抛出）"""
+        book = self._first_openlibrary_doc(self._get_openlibrary_json(self._openlibrary_request(title, author)))
+        if not book:
+            return None
+        
+        # 获取详细信息（作品详情获取失败时仍返回封面、页数等搜索结果中的字段）
+        work_data = None
+        if book.get('key'):
+            work_data = self._get_openlibrary_json(self._openlibrary_work_request(book['key']))
+        return self._parse_openlibrary(book, work_data)
+    
     def clear_cache(self):
         """清空缓存"""
-        with self.cache_lock:
-            self.cache.clear()
+        self.cache.clear()
+        self.title_index.clear()
     
     def get_cache_info(self) -> Dict:
-        """获取缓存信息"""
-        with self.cache_lock:
-            return {
-                'cache_size': len(self.cache),
-                'cached_books': list(self.cache.keys())
-            }
+        """获取缓存信息（含命中、未命中和淘汰统计）"""
+        stats = self.cache.get_stats()
+        return {
+            'cache_size': stats['memory_entries'],
+            'cached_books': self.cache.keys(),
+            'single_flight': self.flight.get_stats(),
+            **stats
+        }
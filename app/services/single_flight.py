@@ -0,0 +1,106 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Awaitable, Callable, Dict, Hashable
+
+
+class LeaderCancelled(Exception):
+    """执行查询的调用方被取消或中断，等待中的调用方重新选出一个执行者"""
+
+
+class SingleFlight:
+    """合并并发的相同请求 - 同一个键同时只执行一次，其余调用方等待并共享结果
+
+    线程池和异步引擎共用同一个在途表，跨任务、跨引擎的重复查询都只发出一次。
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.in_flight: Dict[Hashable, Future] = {}
+        self.counters = {
+            'calls': 0,
+            'executions': 0,
+            'deduplicated': 0,
+            'errors': 0
+        }
+
+    def _join(self, key: Hashable):
+        """返回(future, 是否由当前调用方执行)"""
+        with self.lock:
+            self.counters['calls'] += 1
+            future = self.in_flight.get(key)
+            if future is not None:
+                self.counters['deduplicated'] += 1
+                return future, False
+            future = Future()
+            self.in_flight[key] = future
+            self.counters['executions'] += 1
+            return future, True
+
+    def _finish(self, key: Hashable, future: Future, result=None, error: BaseException = None):
+        with self.lock:
+            self.in_flight.pop(key, None)
+            if error is not None:
+                self.counters['errors'] += 1
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def _fail(self, key: Hashable, future: Future, error: BaseException):
+        """执行者出错时把异常交给等待中的调用方；被取消或中断（非Exception）时只有执行者自己重新抛出，
+        等待中的调用方收到LeaderCancelled后重新执行，避免工作线程收到无法处理的CancelledError"""
+        if not isinstance(error, Exception):
+            error = LeaderCancelled(f"{key} 的执行者已取消")
+        self._finish(key, future, error=error)
+
+    def do(self, key: Hashable, func: Callable):
+        """执行func，相同键已有在途调用时等待其结果"""
+        while True:
+            future, leader = self._join(key)
+            if leader:
+                break
+            try:
+                return future.result()
+            except LeaderCancelled:
+                continue
+
+        try:
+            result = func()
+        except BaseException as e:
+            self._fail(key, future, e)
+            raise
+        self._finish(key, future, result)
+        return result
+
+    async def do_async(self, key: Hashable, coro_func: Callable[[], Awaitable]):
+        """协程版本的do"""
+        while True:
+            future, leader = self._join(key)
+            if leader:
+                break
+            try:
+                # shield: 等待方被取消时不取消共享的future（执行者和其余等待方仍需要它）
+                return await asyncio.shield(asyncio.wrap_future(future))
+            except LeaderCancelled:
+                continue
+
+        try:
+            result = await coro_func()
+        except BaseException as e:
+            self._fail(key, future, e)
+            raise
+        self._finish(key, future, result)
+        return result
+
+    def get_stats(self) -> Dict:
+        with self.lock:
+            return {
+                'in_flight': len(self.in_flight),
+                'dedup_rate': round(self.counters['deduplicated'] / max(self.counters['calls'], 1) * 100, 2),
+                **self.counters
+            }
+
+
+# 全局书籍信息查询合并器（各SearchService和异步引擎共享）
+enrichment_flight = SingleFlight()
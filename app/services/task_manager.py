@@ -1,29 +1,88 @@
+import os
 import threading
 import time
 import uuid
 from datetime import datetime
-from typing import Dict, Optional, List
-from concurrent.futures import ThreadPoolExecutor
-import traceback
+from typing import Dict, Optional, List, Tuple
 
 from .file_manager import file_manager
-from .qwen_service import QwenService
+from .log_config import get_logger
+from .qwen_service import qwen_service
 from .search_service import SearchService
+from .async_engine import async_engine
+from .enrichment_pool import enrichment_pool
+from .enrichment_providers import ProviderStats
+from .cover_cache import cover_cache
+from .task_queue import task_queue
 from ..models.database import db
 
+logger = get_logger(__name__)
+
 class TaskManager:
-    """任务管理器 - 处理异步任务"""
+    """任务管理器 - 处理异步任务
+    
+    任务先写入持久化队列（task_queue表），工作线程从队列领取后执行；
+    进程重启后未完成的任务被重新领取，内存中只保存进度等展示用的状态。
+    """
     
-    def __init__(self, max_workers: int = 3):
-        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+    def __init__(self, max_workers: Optional[int] = None):
+        self.max_workers = max_workers or int(os.getenv('TASK_MAX_WORKERS', 3))
+        # 任务执行引擎: thread（工作线程）/ async（asyncio事件循环）
+        self.engine = os.getenv('TASK_ENGINE', 'thread').lower()
         self.tasks: Dict[str, Dict] = {}  # 内存存储任务状态
         self.lock = threading.Lock()
-        self.qwen_service = QwenService()
+        self.qwen_service = qwen_service
         self.search_service = SearchService()
+        self.queue = task_queue
+        self.workers: List[threading.Thread] = []
         
         # 启动清理任务
         self._start_cleanup_task()
     
+    def start(self):
+        """启动工作线程（可重复调用）
+        
+        在首个请求时启动而不是导入时，调试模式下重载器的父进程不会领取任务。
+        """
+        if self.workers:
+            return
+        with self.lock:
+            if self.workers:
+                return
+            for index in range(self.max_workers):
+                worker = threading.Thread(target=self._worker_loop, name=f'task-worker-{index}', daemon=True)
+                worker.start()
+                self.workers.append(worker)
+        self.queue.start()
+    
+    def _worker_loop(self):
+        """工作线程：从队列领取任务并执行"""
+        while True:
+            try:
+                job = self.queue.claim(timeout=30)
+                if job is not None:
+                    self._run_job(job)
+            except Exception as e:
+                logger.error("任务工作线程出错: %s", e)
+                time.sleep(self.queue.poll_interval)
+    
+    def _run_job(self, job: Dict):
+        """执行领取到的任务；单图任务可交给异步引擎"""
+        task_id = job['task_id']
+        with self.lock:
+            if task_id not in self.tasks:
+                # 其他进程创建或重启前中断的任务
+                logger.info("恢复任务 %s（第 %d 次尝试）", task_id, job['attempts'])
+                self.tasks[task_id] = self._new_task_data(
+                    task_id, job['payload']['file_ids'], job['payload'].get('file_paths'),
+                    job['session_id'], job['created_at']
+                )
+        
+        if self.engine == 'async' and len(job['payload']['file_ids']) == 1 and async_engine.available:
+            async_engine.submit(self._process_task_async(task_id))
+        else:
+            self._process_task(task_id)
+    
     def _start_cleanup_task(self):
         """启动定期清理任务"""
         def cleanup_old_tasks():
@@ -32,13 +91,14 @@ class TaskManager:
                     time.sleep(3600)  # 每小时清理一次
                     self._cleanup_old_tasks()
                 except Exception as e:
-                    print(f"清理旧任务时出错: {e}")
+                    logger.error("清理旧任务时出错: %s", e)
         
         cleanup_thread = threading.Thread(target=cleanup_old_tasks, daemon=True)
         cleanup_thread.start()
     
     def _cleanup_old_tasks(self):
         """清理超过24小时的旧任务"""
+        self.queue.prune(24 * 3600)
         cutoff_time = datetime.now().timestamp() - 24 * 3600  # 24小时前
         
         with self.lock:
@@ -53,130 +113,299 @@ class TaskManager:
     
     def create_task(self, file_id: str, session_id: str) -> str:
         """创建新的识别任务"""
-        # 获取文件路径
-        file_path = file_manager.get_file_path(file_id)
-        if not file_path:
+        return self.create_batch_task([file_id], session_id)
+    
+    def create_batch_task(self, file_ids: List[str], session_id: str) -> str:
+        """创建多图识别任务（如同一书柜的多张照片），多张图片合并请求模型"""
+        if not file_ids:
+            raise ValueError("缺少图片")
+        
+        # 获取文件路径（随任务一起入队，重启后文件管理器中已没有这些文件ID）
+        file_paths = [file_manager.get_file_path(file_id) for file_id in file_ids]
+        if not all(file_paths):
             raise ValueError("文件不存在")
         
         task_id = str(uuid.uuid4())
+        task_data = self._new_task_data(task_id, file_ids, file_paths, session_id, datetime.now().isoformat())
+        
+        with self.lock:
+            self.tasks[task_id] = task_data
+        
+        self.start()
+        self.queue.enqueue(task_id, session_id, {'file_ids': file_ids, 'file_paths': file_paths},
+                           task_data['created_at'])
         
-        task_data = {
+        return task_id
+    
+    def _new_task_data(self, task_id: str, file_ids: List[str], file_paths: Optional[List[str]],
+                       session_id: str, created_at: str) -> Dict:
+        """内存中的任务状态"""
+        return {
             'task_id': task_id,
-            'file_id': file_id,
+            'file_id': file_ids[0],
+            'file_ids': file_ids,
+            'file_paths': file_paths or [],
             'session_id': session_id,
             'status': 'pending',
-            'created_at': datetime.now().isoformat(),
+            'created_at': created_at,
             'progress': 0,
             'current_stage': '准备开始识别...',
             'result': None,
+            'partial_books': [],  # 按书架顺序排列，丰富化完成的书籍逐本替换
+            'enriched_count': 0,
             'error': None,
             'completed_at': None
         }
-        
-        with self.lock:
-            self.tasks[task_id] = task_data
-        
-        # 提交任务到线程池
-        future = self.executor.submit(self._process_task, task_id)
-        
-        return task_id
     
     def _process_task(self, task_id: str):
         """处理任务的核心逻辑"""
         try:
-            with self.lock:
-                if task_id not in self.tasks:
-                    return
-                self.tasks[task_id]['status'] = 'processing'
-                self.tasks[task_id]['progress'] = 10
-                self.tasks[task_id]['current_stage'] = '初始化识别服务...'
+            task_data, file_paths = self._start_task(task_id)
+            if task_data is None:
+                return
             
-            task_data = self.tasks[task_id]
-            file_path = file_manager.get_file_path(task_data['file_id'])
+            # 第一阶段：图片识别（流式识别出的书籍立即开始搜索详细信息）
+            self._update_task(task_id, progress=30, current_stage='识别图片中的书籍...')
             
-            if not file_path:
-                raise ValueError("文件不存在")
+            enrich_futures = []
+            streamed_books = []
+            provider_stats = self.search_service.new_provider_stats()
             
-            # 第一阶段：图片识别
-            with self.lock:
-                self.tasks[task_id]['progress'] = 30
-                self.tasks[task_id]['current_stage'] = '识别图片中的书籍...'
+            def on_book(book: Dict):
+                streamed_books.append(book)
+                enrich_futures.append(enrichment_pool.submit_book(self.search_service._enrich_single_book, book, provider_stats))
+                with self.lock:
+                    task = self.tasks[task_id]
+                    task['partial_books'].append(book)
+                    task['progress'] = min(30 + len(enrich_futures), 55)
+                    task['current_stage'] = f'已识别 {len(enrich_futures)} 本书...'
             
-            print(f"开始识别任务 {task_id}, 文件: {file_path}")
-            books = self.qwen_service.recognize_books(file_path)
-            print(f"识别完成，找到 {len(books)} 本书")
+            try:
+                logger.info("开始识别任务 %s, 文件: %s", task_id, file_paths)
+                recognition_stats = {}
+                if len(file_paths) > 1:
+                    books = self._recognize_batch(task_data['file_ids'], file_paths, recognition_stats)
+                else:
+                    books = self.qwen_service.recognize_books(file_paths[0], stats=recognition_stats, on_book=on_book)
+                self._check_books(books, recognition_stats)
+                
+                # 第二阶段：信息丰富化（级联升级到强模型后最终结果可能与流式阶段不同，此时重新搜索）
+                self._begin_enrichment(task_id, books)
+                futures = enrich_futures if streamed_books == books else None
+                enriched_books = list(books)
+                for index, book in self.search_service.iter_enriched(books, futures, provider_stats):
+                    enriched_books[index] = book
+                    self._on_book_enriched(task_id, index, book)
+            finally:
+                # 取消共享线程池中尚未开始的搜索
+                for future in enrich_futures:
+                    future.cancel()
             
-            if not books:
-                raise ValueError("未能识别出任何书籍，请尝试更清晰的图片")
+            # 第三阶段：保存结果
+            self._complete_task(task_id, task_data, enriched_books, recognition_stats, provider_stats)
+                
+        except Exception as e:
+            self._fail_task(task_id, e)
+    
+    async def _process_task_async(self, task_id: str):
+        """处理任务的核心逻辑（异步引擎版本，在事件循环线程上执行）"""
+        try:
+            task_data, file_paths = self._start_task(task_id)
+            if task_data is None:
+                return
             
-            # 第二阶段：信息丰富化
-            with self.lock:
-                self.tasks[task_id]['progress'] = 60
-                self.tasks[task_id]['current_stage'] = f'搜索 {len(books)} 本书的详细信息...'
+            # 第一阶段：图片识别
+            self._update_task(task_id, progress=30, current_stage='识别图片中的书籍...')
             
-            enriched_books = self.search_service.enrich_books(books)
+            logger.info("开始识别任务 %s, 文件: %s", task_id, file_paths[0])
+            recognition_stats = {}
+            books = await async_engine.recognize_books(file_paths[0], recognition_stats)
+            self._check_books(books, recognition_stats)
             
-            # 第三阶段：保存结果
-            with self.lock:
-                self.tasks[task_id]['progress'] = 90
-                self.tasks[task_id]['current_stage'] = '保存识别结果...'
+            # 第二阶段：信息丰富化
+            self._begin_enrichment(task_id, books)
+            provider_stats = await async_engine.run_blocking(self.search_service.new_provider_stats)
+            enriched_books = list(books)
+            async for index, book in async_engine.iter_enriched(self.search_service, books, provider_stats):
+                enriched_books[index] = book
+                self._on_book_enriched(task_id, index, book)
             
-            # 计算处理时间
-            start_time = datetime.fromisoformat(task_data['created_at'])
-            processing_time = (datetime.now() - start_time).total_seconds()
+            # 第三阶段：保存结果
+            await async_engine.run_blocking(self._complete_task, task_id, task_data, enriched_books,
+                                            recognition_stats, provider_stats)
             
-            # 保存到数据库
-            scan_data = {
-                'id': task_id,
-                'session_id': task_data['session_id'],
-                'created_at': task_data['created_at'],
-                'model_used': 'qwen-vl-plus',
-                'books_count': len(enriched_books),
+        except Exception as e:
+            self._fail_task(task_id, e)
+    
+    def _update_task(self, task_id: str, **fields):
+        """更新任务状态字段"""
+        with self.lock:
+            if task_id in self.tasks:
+                self.tasks[task_id].update(fields)
+    
+    def _start_task(self, task_id: str) -> Tuple[Optional[Dict], List[str]]:
+        """将任务标记为处理中，返回任务数据和图片路径；任务不存在时返回(None, [])"""
+        with self.lock:
+            if task_id not in self.tasks:
+                return None, []
+            self.tasks[task_id]['status'] = 'processing'
+            self.tasks[task_id]['progress'] = 10
+            self.tasks[task_id]['current_stage'] = '初始化识别服务...'
+            task_data = self.tasks[task_id]
+        
+        saved_paths = task_data['file_paths'] or [None] * len(task_data['file_ids'])
+        file_paths = [
+            file_manager.get_file_path(file_id) or (path if path and os.path.exists(path) else None)
+            for file_id, path in zip(task_data['file_ids'], saved_paths)
+        ]
+        
+        if not all(file_paths):
+            raise ValueError("文件不存在")
+        
+        return task_data, file_paths
+    
+    def _check_books(self, books: List[Dict], recognition_stats: Dict):
+        """检查识别结果"""
+        logger.info("识别完成，找到 %d 本书%s", len(books), "（命中识别缓存）" if recognition_stats.get('cache_hit') else "")
+        
+        if not books:
+            raise ValueError("未能识别出任何书籍，请尝试更清晰的图片")
+    
+    def _complete_task(self, task_id: str, task_data: Dict, enriched_books: List[Dict], recognition_stats: Dict,
+                       provider_stats: ProviderStats):
+        """保存识别结果并将任务标记为完成"""
+        self._update_task(task_id, progress=90, current_stage='保存识别结果...')
+        
+        # 计算处理时间
+        start_time = datetime.fromisoformat(task_data['created_at'])
+        processing_time = (datetime.now() - start_time).total_seconds()
+        
+        # 保存到数据库
+        scan_data = {
+            'id': task_id,
+            'session_id': task_data['session_id'],
+            'created_at': task_data['created_at'],
+            'model_used': recognition_stats.get('model_used', self.qwen_service.model),
+            'books_count': len(enriched_books),
+            'processing_time': processing_time,
+            'status': 'completed',
+            'result': {
+                'books': enriched_books,
+                'total_books': len(enriched_books),
                 'processing_time': processing_time,
-                'status': 'completed',
-                'result': {
-                    'books': enriched_books,
-                    'total_books': len(enriched_books),
-                    'processing_time': processing_time
-                }
+                'cache_hit': recognition_stats.get('cache_hit', False),
+                'preprocess': recognition_stats.get('preprocess'),
+                'tiling': recognition_stats.get('tiling'),
+                'tiles': recognition_stats.get('tiles'),
+                'first_book_ms': recognition_stats.get('first_book_ms'),
+                'batches': recognition_stats.get('batches'),
+                'cascade': recognition_stats.get('cascade'),
+                'enrichment': provider_stats.to_dict()
             }
-            
-            db.save_scan_result(scan_data)
-            
-            # 完成任务
-            with self.lock:
-                self.tasks[task_id]['status'] = 'completed'
-                self.tasks[task_id]['progress'] = 100
-                self.tasks[task_id]['current_stage'] = '处理完成'
-                self.tasks[task_id]['result'] = scan_data['result']
-                self.tasks[task_id]['completed_at'] = datetime.now().isoformat()
-                
-        except Exception as e:
-            error_msg = str(e)
-            error_traceback = traceback.format_exc()
-            
-            with self.lock:
-                if task_id in self.tasks:
-                    self.tasks[task_id]['status'] = 'failed'
-                    self.tasks[task_id]['error'] = error_msg
-                    self.tasks[task_id]['completed_at'] = datetime.now().isoformat()
-            
-            print(f"任务 {task_id} 处理失败: {error_msg}")
-            print(f"错误详情: {error_traceback}")
+        }
+        
+        db.save_scan_result(scan_data)
+        # 后台把封面下载到本地，历史记录和导出不再请求豆瓣/Open Library
+        cover_cache.schedule(book.get('cover_url') for book in enriched_books)
+        
+        # 完成任务
+        self._update_task(
+            task_id,
+            status='completed',
+            progress=100,
+            current_stage='处理完成',
+            result=scan_data['result'],
+            completed_at=datetime.now().isoformat()
+        )
+        self.queue.complete(task_id)
+    
+    def _fail_task(self, task_id: str, error: Exception):
+        """将任务标记为失败"""
+        error_msg = str(error)
+        
+        self._update_task(
+            task_id,
+            status='failed',
+            error=error_msg,
+            completed_at=datetime.now().isoformat()
+        )
+        # 处理中抛出的异常（如图片无法识别）重试也不会成功，直接标记失败；
+        # 尝试次数只用于进程在处理中崩溃的情况
+        self.queue.complete(task_id, 'failed', error_msg)
+        
+        logger.error("任务 %s 处理失败: %s", task_id, error_msg, exc_info=error)
+    
+    def _recognize_batch(self, file_ids: List[str], file_paths: List[str], stats: Dict) -> List[Dict]:
+        """批量识别多张图片，书籍按图片顺序展开并标记来源图片"""
+        results = self.qwen_service.recognize_books_batch(file_paths, stats=stats)
+        
+        books = []
+        for image_index, (file_id, image_books) in enumerate(zip(file_ids, results)):
+            for book in image_books:
+                books.append({**book, 'image_index': image_index, 'file_id': file_id})
+        return books
+    
+    def _begin_enrichment(self, task_id: str, books: List[Dict]):
+        """进入丰富化阶段：部分结果重置为识别出的书籍（书架顺序）"""
+        self._update_task(
+            task_id,
+            progress=60,
+            current_stage=f'搜索 {len(books)} 本书的详细信息...',
+            partial_books=list(books),
+            enriched_count=0
+        )
+    
+    def _on_book_enriched(self, task_id: str, index: int, book: Dict):
+        """单本书丰富化完成：替换部分结果中对应位置的书籍，进度从60%逐本推进到90%"""
+        with self.lock:
+            task = self.tasks.get(task_id)
+            if task is None:
+                return
+            task['partial_books'][index] = book
+            task['enriched_count'] += 1
+            total = len(task['partial_books'])
+            task['progress'] = 60 + task['enriched_count'] * 30 // total
+            task['current_stage'] = f'已获取 {task["enriched_count"]}/{total} 本书的详细信息...'
     
     def get_task_status(self, task_id: str) -> Optional[Dict]:
-        """获取任务状态"""
+        """获取任务状态；内存中没有时（重启后或由其他进程处理）从任务队列读取"""
         with self.lock:
-            return self.tasks.get(task_id)
+            task = self.tasks.get(task_id)
+        if task is not None:
+            return task
+        return self._load_task_status(task_id)
+    
+    def _load_task_status(self, task_id: str) -> Optional[Dict]:
+        """由任务队列中的记录构造任务状态，已完成的任务从扫描记录读取结果"""
+        job = self.queue.get(task_id)
+        if job is None:
+            return None
+        
+        task = self._new_task_data(task_id, job['payload']['file_ids'], job['payload'].get('file_paths'),
+                                   job['session_id'], job['created_at'])
+        task['status'] = job['status']
+        task['error'] = job['error']
+        if job['status'] in ('pending', 'processing'):
+            task['current_stage'] = '等待处理...'
+            return task
+        
+        task['completed_at'] = datetime.fromtimestamp(job['updated_at']).isoformat()
+        if job['status'] == 'completed':
+            scan = db.get_scan_detail(task_id)
+            task['result'] = scan.get('result') if scan else None
+            task['progress'] = 100
+            task['current_stage'] = '处理完成'
+        return task
     
     def cancel_task(self, task_id: str) -> bool:
         """取消任务"""
+        cancelled = False
         with self.lock:
             if task_id in self.tasks and self.tasks[task_id]['status'] in ['pending', 'processing']:
                 self.tasks[task_id]['status'] = 'cancelled'
                 self.tasks[task_id]['completed_at'] = datetime.now().isoformat()
-                return True
-            return False
+                cancelled = True
+        return self.queue.cancel(task_id) or cancelled
     
     def get_active_tasks(self) -> List[Dict]:
         """获取活跃任务列表"""
@@ -208,7 +437,8 @@ class TaskManager:
                 'processing_tasks': processing_tasks,
                 'completed_tasks': completed_tasks,
                 'failed_tasks': failed_tasks,
-                'success_rate': round(completed_tasks / max(total_tasks, 1) * 100, 2)
+                'success_rate': round(completed_tasks / max(total_tasks, 1) * 100, 2),
+                'queue': self.queue.get_stats()
             }
     
     def cleanup_task(self, task_id: str) -> bool:
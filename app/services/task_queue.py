@@ -0,0 +1,181 @@
+import os
+import socket
+import threading
+import time
+import uuid
+from typing import Dict, Optional, Set
+
+from .log_config import get_logger
+from ..models.database import db
+
+logger = get_logger(__name__)
+
+
+def _pid_alive(pid: int) -> bool:
+    """同一台机器上的进程是否还在运行（Windows上os.kill会结束进程，无法探测，一律视为存活）"""
+    if os.name == 'nt':
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class TaskQueue:
+    """持久化任务队列 - 任务保存在SQLite的task_queue表中，工作线程按租约领取
+
+    领取在BEGIN IMMEDIATE事务中完成，多个线程和进程共用同一个队列也不会重复领取；
+    心跳线程为处理中的任务续租，进程崩溃或重启后租约过期，任务被重新领取，
+    尝试次数超过上限的任务标记为失败。
+    """
+
+    def __init__(self, lease_seconds: Optional[float] = None, max_attempts: Optional[int] = None,
+                 poll_interval: Optional[float] = None):
+        self.lease_seconds = lease_seconds or float(os.getenv('TASK_LEASE_SECONDS', 60))
+        self.max_attempts = max_attempts or int(os.getenv('TASK_MAX_ATTEMPTS', 3))
+        self.poll_interval = poll_interval or float(os.getenv('TASK_QUEUE_POLL_INTERVAL', 1))
+        self.hostname = socket.gethostname()
+        self.owner = self._new_owner()
+
+        self.lock = threading.Lock()
+        # 本进程入队时唤醒等待中的工作线程，其他进程入队的任务靠轮询发现
+        self.signals = threading.Semaphore(0)
+        self.held: Set[str] = set()
+        self.heartbeat: Optional[threading.Thread] = None
+        self.counters = {
+            'enqueued': 0,
+            'claimed': 0,
+            'retried': 0,
+            'recovered': 0,
+            'completed': 0,
+            'failed': 0,
+            'lost_leases': 0
+        }
+
+    def _new_owner(self) -> str:
+        """租约持有者标识：主机名:进程号:随机串"""
+        return f'{self.hostname}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+
+    def _count(self, key: str, amount: int = 1):
+        with self.lock:
+            self.counters[key] += amount
+
+    def start(self) -> int:
+        """启动心跳线程并恢复本机已退出进程留下的任务，返回恢复的任务数"""
+        with self.lock:
+            if self.heartbeat is not None:
+                return 0
+            # 多进程服务器fork出的工作进程需要自己的持有者标识
+            self.owner = self._new_owner()
+            self.heartbeat = threading.Thread(target=self._heartbeat_loop, name='task-queue-heartbeat', daemon=True)
+            self.heartbeat.start()
+        return self.recover_abandoned()
+
+    def recover_abandoned(self) -> int:
+        """让本机已退出进程持有的租约立即过期，不必等到租约自然到期"""
+        recovered = 0
+        for task in db.get_leased_tasks():
+            hostname, _, rest = (task['lease_owner'] or '').partition(':')
+            pid = rest.partition(':')[0]
+            if hostname != self.hostname or not pid.isdigit() or int(pid) == os.getpid() or _pid_alive(int(pid)):
+                continue
+            if db.expire_task_lease(task['task_id'], task['lease_owner']):
+                recovered += 1
+        if recovered:
+            self._count('recovered', recovered)
+            logger.info("恢复 %d 个中断的任务", recovered)
+            for _ in range(recovered):
+                self.signals.release()
+        return recovered
+
+    def enqueue(self, task_id: str, session_id: str, payload: Dict, created_at: str):
+        """任务入队"""
+        db.enqueue_task(task_id, session_id, payload, created_at, self.max_attempts, time.time())
+        self._count('enqueued')
+        self.signals.release()
+
+    def claim(self, timeout: float) -> Optional[Dict]:
+        """领取一个任务，最多等待timeout秒，没有任务时返回None"""
+        deadline = time.monotonic() + timeout
+        while True:
+            task = db.claim_task(self.owner, self.lease_seconds, time.time())
+            if task is not None:
+                with self.lock:
+                    self.held.add(task['task_id'])
+                    self.counters['claimed'] += 1
+                    self.counters['retried'] += int(task['attempts'] > 1)
+                return task
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            self.signals.acquire(timeout=min(remaining, self.poll_interval))
+
+    def complete(self, task_id: str, status: str = 'completed', error: Optional[str] = None) -> bool:
+        """结束持有的任务；已被取消或租约已丢失时返回False"""
+        with self.lock:
+            self.held.discard(task_id)
+        finished = db.finish_task(task_id, self.owner, status, error, time.time())
+        if finished:
+            self._count('completed' if status == 'completed' else 'failed')
+        return finished
+
+    def cancel(self, task_id: str) -> bool:
+        """取消等待中或处理中的任务"""
+        return db.cancel_queued_task(task_id, time.time())
+
+    def get(self, task_id: str) -> Optional[Dict]:
+        return db.get_queued_task(task_id)
+
+    def renew(self) -> int:
+        """为持有的任务续租，返回续租的任务数；续租失败的任务（已取消或被重新领取）不再持有"""
+        with self.lock:
+            held = list(self.held)
+        if not held:
+            return 0
+
+        renewed = set(db.renew_task_leases(held, self.owner, self.lease_seconds, time.time()))
+        lost = [task_id for task_id in held if task_id not in renewed]
+        if lost:
+            with self.lock:
+                self.held.difference_update(lost)
+                self.counters['lost_leases'] += len(lost)
+            logger.warning("任务租约已失效: %s", ', '.join(lost))
+        return len(renewed)
+
+    def _heartbeat_loop(self):
+        while True:
+            time.sleep(self.lease_seconds / 3)
+            try:
+                self.renew()
+            except Exception as e:
+                logger.error("任务续租失败: %s", e)
+
+    def prune(self, max_age: float) -> int:
+        """删除结束超过max_age秒的任务"""
+        return db.prune_task_queue(time.time() - max_age)
+
+    def get_stats(self) -> Dict:
+        with self.lock:
+            counters = dict(self.counters)
+            held = len(self.held)
+        try:
+            stored = db.get_task_queue_stats()
+        except Exception as e:
+            logger.warning("获取任务队列统计失败: %s", e)
+            stored = {}
+        return {
+            'owner': self.owner,
+            'lease_seconds': self.lease_seconds,
+            'max_attempts': self.max_attempts,
+            'held': held,
+            'queued': stored,
+            **counters
+        }
+
+
+# 全局任务队列实例
+task_queue = TaskQueue()
@@ -0,0 +1,179 @@
+import re
+import threading
+import unicodedata
+from collections import defaultdict
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+try:
+    from opencc import OpenCC
+    _t2s = OpenCC('t2s').convert
+except Exception:  # 未安装opencc时使用内置的常用字对照表
+    _t2s = None
+
+# 书名中常见的繁体字 -> 简体字（未安装opencc时的兜底）
+_TRADITIONAL = (
+    '書學習經濟歷國語說讀寫體時間簡單編輯設計開發實踐從門戶與為這個們來對於會後過還現點問題錄統數據庫'
+    '網絡機軟電腦應詞論藝術師傳記遊戲聽見關係愛風雲難夢紅樓憶夠樂萬雜誌線條變換選擇權導專業養長壽環華'
+    '爾種觀話圖館'
+)
+_SIMPLIFIED = (
+    '书学习经济历国语说读写体时间简单编辑设计开发实践从门户与为这个们来对于会后过还现点问题录统数据库'
+    '网络机软电脑应词论艺术师传记游戏听见关系爱风云难梦红楼忆够乐万杂志线条变换选择权导专业养长寿环华'
+    '尔种观话图馆'
+)
+_FALLBACK_T2S = str.maketrans(_TRADITIONAL, _SIMPLIFIED)
+
+
+def to_simplified(text: str) -> str:
+    """繁体转简体（有opencc时完整转换，否则只转换常用字）"""
+    return _t2s(text) if _t2s else text.translate(_FALLBACK_T2S)
+
+
+def normalize_text(text: str) -> str:
+    """书名/作者的规范形式：NFKC（全角转半角）、小写、繁体转简体，去除标点、符号和空白"""
+    if not text:
+        return ''
+    text = to_simplified(unicodedata.normalize('NFKC', str(text)).lower())
+    return ''.join(char for char in text if unicodedata.category(char)[0] in 'LN')
+
+
+_CHINESE_DIGITS = {'零': 0, '一': 1, '二': 2, '两': 2, '三': 3, '四': 4, '五': 5, '六': 6, '七': 7, '八': 8, '九': 9}
+_ORDINALS = {'first': 1, 'second': 2, 'third': 3, 'fourth': 4, 'fifth': 5,
+             'sixth': 6, 'seventh': 7, 'eighth': 8, 'ninth': 9, 'tenth': 10}
+_ROMAN = {'i': 1, 'ii': 2, 'iii': 3, 'iv': 4, 'v': 5, 'vi': 6, 'vii': 7, 'viii': 8, 'ix': 9, 'x': 10}
+_DIGIT_RUN = re.compile(r'\d+')
+_CHINESE_ORDINAL = re.compile(r'第([零一二两三四五六七八九十]+)[版卷册部辑集篇季]')
+_VOLUME_PART = re.compile(r'([上中下])[册卷部篇]')
+_ORDINAL_EDITION = re.compile(r'(' + '|'.join(_ORDINALS) + r')(?:edition|ed)')
+_ROMAN_VOLUME = re.compile(r'(?:vol|volume|part|book|(?<![a-z]))([ivx]+)$')
+_REVISION = re.compile(r'修订|增订|新版|revised|updated')
+
+
+def _chinese_number(text: str) -> int:
+    """十以内及几十几的中文数字"""
+    if '十' not in text:
+        return int(''.join(str(_CHINESE_DIGITS[char]) for char in text))
+    tens, _, ones = text.partition('十')
+    return _CHINESE_DIGITS.get(tens, 1) * 10 + _CHINESE_DIGITS.get(ones, 0)
+
+
+def edition_tokens(text: str) -> Tuple[str, ...]:
+    """规范化书名中区分版本/卷册的标记：数字（第三版、third edition、Vol. II统一为阿拉伯数字）、
+    上/中/下册和修订版等字样。书名相似但这些标记不同的通常是同一本书的不同版本。
+    """
+    numbers = [int(run) for run in _DIGIT_RUN.findall(text)]
+    numbers += [_chinese_number(match) for match in _CHINESE_ORDINAL.findall(text)]
+    numbers += [_ORDINALS[match] for match in _ORDINAL_EDITION.findall(text)]
+    numbers += [_ROMAN[match] for match in _ROMAN_VOLUME.findall(text) if match in _ROMAN]
+    markers = _VOLUME_PART.findall(text) + [
+        '修订' if match in ('修订', '增订', 'revised', 'updated') else match for match in _REVISION.findall(text)
+    ]
+    return tuple(sorted(str(number) for number in numbers)) + tuple(sorted(markers))
+
+
+def trigrams(text: str) -> Set[str]:
+    """规范化文本的三元组（首尾加边界符，短书名也能产生至少一个三元组）"""
+    padded = f'^{text}$'
+    return {padded[i:i + 3] for i in range(max(len(padded) - 2, 1))}
+
+
+def similarity(a: str, b: str) -> float:
+    """两个规范化文本三元组集合的Jaccard相似度"""
+    if a == b:
+        return 1.0
+    grams_a, grams_b = trigrams(a), trigrams(b)
+    return len(grams_a & grams_b) / len(grams_a | grams_b)
+
+
+class TrigramIndex:
+    """书名三元组倒排索引 - 在已缓存的书名中查找相似度超过阈值的条目"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.load_lock = threading.Lock()
+        self.loaded = False
+        self.postings: Dict[str, Set[str]] = defaultdict(set)
+        # key -> (规范化书名, 规范化作者, 三元组, 版本标记)
+        self.entries: Dict[str, Tuple[str, str, Set[str], Tuple[str, ...]]] = {}
+
+    def ensure_loaded(self, loader: Callable[[], Iterable[Tuple[str, str, str]]]):
+        """首次使用时加载已有条目，loader返回 [(key, 规范化书名, 规范化作者)]"""
+        with self.load_lock:
+            if self.loaded:
+                return
+            self.loaded = True
+            for key, title, author in loader():
+                self.add(key, title, author)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def add(self, key: str, title: str, author: str = ''):
+        """加入索引（title和author应已规范化）"""
+        grams = trigrams(title)
+        with self.lock:
+            self._remove(key)
+            self.entries[key] = (title, author, grams, edition_tokens(title))
+            for gram in grams:
+                self.postings[gram].add(key)
+
+    def clear(self):
+        with self.lock:
+            self.postings.clear()
+            self.entries.clear()
+
+    def remove(self, key: str):
+        with self.lock:
+            self._remove(key)
+
+    def _remove(self, key: str):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        for gram in entry[2]:
+            keys = self.postings.get(gram)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.postings[gram]
+
+    def search(self, title: str, author: str = '', threshold: float = 0.7,
+               limit: int = 5) -> List[Tuple[str, float]]:
+        """返回书名相似度不低于threshold的条目 [(key, 相似度)]，按相似度降序
+
+        双方都有作者时作者也需相似（相似度不低于threshold或互相包含）；
+        书名中的数字和版本、卷册标记必须完全相同，同一本书的不同版本不互相匹配。
+        """
+        grams = trigrams(title)
+        tokens = edition_tokens(title)
+        with self.lock:
+            shared: Dict[str, int] = defaultdict(int)
+            for gram in grams:
+                for key in self.postings.get(gram, ()):
+                    shared[key] += 1
+
+            matches = []
+            for key, count in shared.items():
+                entry_title, entry_author, entry_grams, entry_tokens = self.entries[key]
+                if entry_tokens != tokens:
+                    continue
+                score = count / (len(grams) + len(entry_grams) - count)
+                if score >= threshold and self._author_matches(author, entry_author, threshold):
+                    matches.append((key, round(score, 4)))
+
+        matches.sort(key=lambda match: match[1], reverse=True)
+        return matches[:limit]
+
+    def best_match(self, title: str, author: str = '', threshold: float = 0.7) -> Optional[str]:
+        matches = self.search(title, author, threshold, limit=1)
+        return matches[0][0] if matches else None
+
+    @staticmethod
+    def _author_matches(author: str, entry_author: str, threshold: float) -> bool:
+        if not author or not entry_author:
+            return True
+        return author in entry_author or entry_author in author or similarity(author, entry_author) >= threshold
+
+
+# 全局已缓存书名索引（各SearchService共享）
+cached_title_index = TrigramIndex()
@@ -237,7 +237,7 @@ class RecognitionManager {
                 <td>
                     <div class="book-cover-container">
                         ${coverUrl ? 
-                            `<img src="${coverUrl}" class="book-cover" alt="${title}" onerror="this.style.display='none'; this.nextElementSibling.style.display='flex';">
+                            `<img src="${coverSrc(coverUrl)}" class="book-cover" alt="${title}" onerror="this.style.display='none'; this.nextElementSibling.style.display='flex';">
                              <div class="book-cover-placeholder" style="display: none;">
                                  <i class="fas fa-book"></i>
                              </div>` :
@@ -337,6 +337,11 @@ function resetAll() {
     recognitionManager.resetAll();
 }
 
+// 封面地址：经服务端封面缓存，已缓存时使用本地缩略图
+function coverSrc(coverUrl) {
+    return `/api/cover?url=${encodeURIComponent(coverUrl)}`;
+}
+
 // 查看书籍详情
 function viewBookDetail(index) {
     const book = currentBooks[index];
@@ -346,7 +351,7 @@ function viewBookDetail(index) {
         <div class="row">
             <div class="col-md-4">
                 ${book.cover_url ? 
-                    `<img src="${book.cover_url}" class="img-fluid rounded" alt="${book.title}">` :
+                    `<img src="${coverSrc(book.cover_url)}" class="img-fluid rounded" alt="${book.title}">` :
                     `<div class="bg-light rounded d-flex align-items-center justify-content-center" style="height: 200px;">
                          <i class="fas fa-book fa-3x text-muted"></i>
                      </div>`
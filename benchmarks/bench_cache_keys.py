@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+书籍信息缓存键基准测试
+按顺序回放识别出的书名/作者，对比三种缓存键策略的命中率：
+旧的 f"{title}_{author}".lower()、规范化精确键、规范化键 + 三元组近似匹配。
+语料每行标注了真实的book_id，用于统计近似匹配命中了错误条目的次数。
+edition变体（第N版、修订版等）与原书标注为同一book_id，但近似匹配要求版本和卷册标记一致，
+这些变体按不同版本重新查询（封面、页数、出版日期不同），不会命中。
+
+用法: python benchmarks/bench_cache_keys.py [语料文件] [相似度阈值]
+"""
+
+import json
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.services.text_match import TrigramIndex, normalize_text
+
+DEFAULT_CORPUS = Path(__file__).resolve().parent / 'data' / 'title_replay.jsonl'
+
+
+def legacy_key(title: str, author: str) -> str:
+    return f"{title}_{author}".lower()
+
+
+def normalized_key(title: str, author: str) -> str:
+    return f"{normalize_text(title)}_{normalize_text(author)}"
+
+
+def replay(records, key_func, threshold: float = 0.0):
+    """回放语料，返回 (按变体统计的命中数, 错误命中数, 耗时秒)"""
+    cache = {}
+    index = TrigramIndex()
+    hits = Counter()
+    wrong = 0
+    start = time.perf_counter()
+
+    for record in records:
+        key = key_func(record['title'], record['author'])
+        cached = cache.get(key)
+        if cached is None and threshold > 0:
+            match = index.best_match(normalize_text(record['title']), normalize_text(record['author']), threshold)
+            cached = cache.get(match) if match else None
+
+        if cached is not None:
+            hits[record['variant']] += 1
+            wrong += cached != record['book_id']
+        else:
+            # 未命中：相当于请求网络搜索源后写入缓存
+            cache[key] = record['book_id']
+            index.add(key, normalize_text(record['title']), normalize_text(record['author']))
+
+    return hits, wrong, time.perf_counter() - start
+
+
+def main():
+    corpus = Path(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_CORPUS
+    threshold = float(sys.argv[2]) if len(sys.argv) > 2 else 0.7
+
+    with open(corpus, encoding='utf-8') as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    variants = Counter(record['variant'] for record in records)
+    distinct = len({record['book_id'] for record in records})
+    # 每本书第一次出现必然未命中
+    best_rate = (len(records) - distinct) / len(records) * 100
+
+    print("=" * 60)
+    print(f"🔑 缓存键基准测试: {len(records)} 次查询, {distinct} 本不同的书, 理论最高命中率 {best_rate:.1f}%")
+    print("=" * 60)
+
+    for label, key_func, fuzzy in (
+        ('旧键', legacy_key, 0.0),
+        ('规范化', normalized_key, 0.0),
+        (f'规范化+三元组({threshold})', normalized_key, threshold)
+    ):
+        hits, wrong, elapsed = replay(records, key_func, fuzzy)
+        total = sum(hits.values())
+        print(f"   {label:<18} 命中 {total}/{len(records)} ({total / len(records) * 100:5.1f}%)  "
+              f"错误命中 {wrong}  {elapsed * 1e6 / len(records):6.1f}μs/次")
+        print("      " + "  ".join(f"{variant} {hits[variant]}/{variants[variant]}" for variant in sorted(variants)))
+
+    print("=" * 60)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本地书目库基准测试
+生成Open Library格式的合成转储（gzip），测量流式导入的速度和峰值内存，以及书名/ISBN查询延迟
+
+用法: python benchmarks/bench_catalog.py [记录数] [查询次数]
+"""
+
+import gzip
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.services.book_catalog import BookCatalog
+from app.services.isbn import isbn13_check_digit
+
+WORDS = ['时间', '简史', '人类', '三体', '活着', '百年', '孤独', 'the', 'art', 'of', 'computer',
+         'programming', 'history', 'design', 'patterns', 'clean', 'code', 'data', 'river', 'night']
+
+
+def write_dump(path: str, count: int):
+    """写入count条edition记录，每10条附带一条work记录"""
+    rng = random.Random(42)
+    with gzip.open(path, 'wt', encoding='utf-8') as dump:
+        for i in range(count):
+            title = ' '.join(rng.sample(WORDS, 3)) + f' {i}'
+            record = {
+                'type': {'key': '/type/edition'}, 'key': f'/books/OL{i}M', 'title': title,
+                'by_statement': f'作者{i % 5000}', 'isbn_13': [make_isbn(i)],
+                'number_of_pages': 100 + i % 500, 'publish_date': str(1950 + i % 70),
+                'works': [{'key': f'/works/OL{i // 10}W'}]
+            }
+            dump.write(f"/type/edition\t{record['key']}\t1\t2024-01-01\t{json.dumps(record, ensure_ascii=False)}\n")
+            if i % 10 == 0:
+                work = {'type': {'key': '/type/work'}, 'key': f'/works/OL{i // 10}W', 'title': title,
+                        'description': '简介' * 50, 'covers': [i + 1]}
+                dump.write(f"/type/work\t{work['key']}\t1\t2024-01-01\t{json.dumps(work, ensure_ascii=False)}\n")
+
+
+def make_isbn(i: int) -> str:
+    body = f'978{i:09d}'
+    return body + isbn13_check_digit(body)
+
+
+def percentile(samples, p):
+    return sorted(samples)[min(int(len(samples) * p / 100), len(samples) - 1)]
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    queries = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        dump_path = os.path.join(temp_dir, 'ol_dump_editions.txt.gz')
+        write_dump(dump_path, count)
+        dump_mb = os.path.getsize(dump_path) / 1024 / 1024
+
+        print("=" * 60)
+        print(f"🗂️ 书目库基准测试: {count} 条记录, 转储 {dump_mb:.1f}MB（gzip）")
+        print("=" * 60)
+
+        catalog = BookCatalog(os.path.join(temp_dir, 'catalog.db'))
+        stats = catalog.import_dump(dump_path)
+        db_mb = os.path.getsize(catalog.db_path) / 1024 / 1024
+        print(f"   导入 {stats['imported']} 条  {stats['seconds']:.2f}s  "
+              f"{stats['imported'] / max(stats['seconds'], 0.001):.0f}条/s  数据库 {db_mb:.1f}MB")
+
+        # 再导入一次（全部走更新路径），在tracemalloc下测量峰值内存
+        tracemalloc.start()
+        catalog.import_dump(dump_path)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"   重复导入Python峰值内存 {peak / 1024 / 1024:.2f}MB（与转储大小无关）")
+
+        rng = random.Random(7)
+        conn = catalog._connection()
+        titles = [row[0] for row in conn.execute(
+            'SELECT title FROM catalog_books WHERE kind = ? ORDER BY RANDOM() LIMIT ?', ('edition', queries))]
+
+        for label, lookup, keys in (
+            ('书名精确', lambda key: catalog.lookup(key), titles),
+            ('书名分词', lambda key: catalog.lookup(' '.join(reversed(key.split()))), titles),
+            ('ISBN', catalog.lookup_isbn, [make_isbn(rng.randrange(count)) for _ in range(queries)]),
+            ('未命中', lambda key: catalog.lookup(key), [f'不存在的书 {i}' for i in range(queries)])
+        ):
+            samples = []
+            for key in keys:
+                start = time.perf_counter()
+                lookup(key)
+                samples.append((time.perf_counter() - start) * 1000)
+            print(f"   {label:<6} p50 {statistics.median(samples):.3f}ms  p95 {percentile(samples, 95):.3f}ms")
+        catalog.close()
+
+    print("=" * 60)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+模型输出JSON提取基准测试
+在记录的模型响应语料上对比旧的非贪婪正则提取与单次线性扫描提取的成功率和耗时
+
+用法: python benchmarks/bench_json_extract.py [语料文件] [重复次数]
+"""
+
+import json
+import re
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.services.json_stream import extract_json_array
+
+DEFAULT_CORPUS = Path(__file__).resolve().parent / 'data' / 'model_responses.jsonl'
+
+
+def regex_extract(text: str):
+    """旧实现：非贪婪匹配第一个方括号片段"""
+    json_pattern = r'\[[\s\S]*?\]'
+    matches = re.findall(json_pattern, text)
+
+    for match in matches:
+        try:
+            return json.loads(match)
+        except json.JSONDecodeError:
+            continue
+
+    raise ValueError("无法从响应中提取有效的JSON")
+
+
+def is_valid(result) -> bool:
+    """提取结果必须是书籍对象数组"""
+    return isinstance(result, list) and bool(result) and all(
+        isinstance(item, dict) and 'title' in item for item in result
+    )
+
+
+def run(extract, responses, repeat: int):
+    """返回 (耗时秒, 按类型统计的成功数)"""
+    successes = Counter()
+    start = time.perf_counter()
+    for i in range(repeat):
+        for response in responses:
+            try:
+                result = extract(response['content'])
+            except ValueError:
+                continue
+            if i == 0 and is_valid(result):
+                successes[response['kind']] += 1
+    return time.perf_counter() - start, successes
+
+
+def main():
+    corpus = Path(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_CORPUS
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    with open(corpus, encoding='utf-8') as f:
+        responses = [json.loads(line) for line in f if line.strip()]
+    kinds = Counter(response['kind'] for response in responses)
+    total_chars = sum(len(response['content']) for response in responses)
+
+    print("=" * 60)
+    print(f"🧩 JSON提取基准测试: {len(responses)} 条响应, {total_chars} 字符, 重复 {repeat} 次")
+    print("=" * 60)
+
+    for label, extract in (('正则(旧)', regex_extract), ('线性扫描', extract_json_array)):
+        elapsed, successes = run(extract, responses, repeat)
+        per_response = elapsed / (len(responses) * repeat) * 1e6
+        print(f"   {label:<8} 成功 {sum(successes.values())}/{len(responses)}  "
+              f"{elapsed:6.3f}s  {per_response:7.1f}μs/条")
+        for kind in sorted(kinds):
+            print(f"      {kind:<14} {successes[kind]}/{kinds[kind]}")
+
+    print("=" * 60)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Qwen请求体内存基准测试
+用tracemalloc对比旧的json=payload构造方式与预分配缓冲区方式在单次请求中的峰值内存分配
+
+用法: python benchmarks/bench_payload_memory.py [图片KB] [图片张数]
+"""
+
+import base64
+import os
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import requests
+
+from app.services.qwen_service import qwen_service, RECOGNITION_PROMPT
+
+URL = 'https://dashscope.aliyuncs.com/api/v1/services/aigc/multimodal-generation/generation'
+SOCKET_BLOCK_SIZE = 16384
+
+
+def legacy_request(images):
+    """旧实现：Base64字符串 -> data URI -> 字典 -> 调试打印 -> requests序列化JSON"""
+    base64_images = [base64.b64encode(image).decode('utf-8') for image in images]
+    content = [{"image": f"data:image/jpeg;base64,{base64_image}"} for base64_image in base64_images]
+    content.append({"text": RECOGNITION_PROMPT})
+    payload = {
+        "model": qwen_service.model,
+        "input": {"messages": [{"role": "user", "content": content}]},
+        "parameters": {"temperature": 0.1, "max_tokens": 2000}
+    }
+    len(str(payload))  # 旧的调试日志会把整个请求体转为字符串
+    prepared = requests.Request('POST', URL, json=payload).prepare()
+    send(prepared.body)
+    return len(prepared.body)
+
+
+def buffered_request(images):
+    """新实现：图片直接编码进预分配缓冲区，请求体以流的形式分块读取"""
+    payload = qwen_service._build_messages_payload(images, RECOGNITION_PROMPT, max_tokens=2000)
+    prepared = requests.Request('POST', URL, data=payload.reader(),
+                                headers={'Content-Type': 'application/json'}).prepare()
+    send(prepared.body)
+    return len(payload)
+
+
+def send(body):
+    """模拟urllib3按块把请求体写入socket"""
+    if isinstance(body, bytes):
+        for start in range(0, len(body), SOCKET_BLOCK_SIZE):
+            memoryview(body)[start:start + SOCKET_BLOCK_SIZE].tobytes()
+        return
+    while body.read(SOCKET_BLOCK_SIZE):
+        pass
+
+
+def measure(build, images):
+    """返回 (峰值分配字节, 耗时毫秒, 请求体大小)"""
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    baseline, _ = tracemalloc.get_traced_memory()
+    start = time.perf_counter()
+    size = build(images)
+    elapsed = (time.perf_counter() - start) * 1000
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak - baseline, elapsed, size
+
+
+def main():
+    image_kb = int(sys.argv[1]) if len(sys.argv) > 1 else 2048
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+    images = [os.urandom(image_kb * 1024) for _ in range(count)]
+    image_bytes = image_kb * 1024 * count
+
+    print("=" * 60)
+    print(f"💾 请求体内存基准测试: {count} 张 {image_kb}KB 图片")
+    print("=" * 60)
+
+    for label, build in (('json=payload(旧)', legacy_request), ('预分配缓冲区', buffered_request)):
+        peak, elapsed, size = measure(build, images)
+        print(f"   {label:<16} 峰值分配 {peak / 1024 / 1024:7.2f}MB "
+              f"(图片的 {peak / image_bytes:4.1f} 倍)  {elapsed:7.1f}ms  请求体 {size}")
+
+    print("=" * 60)
+
+
+if __name__ == '__main__':
+    main()
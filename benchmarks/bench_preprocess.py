@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+图片预处理吞吐量基准测试
+对一批大尺寸图片分别使用不同的进程数预处理，观察吞吐量随核数的变化
+
+用法: python benchmarks/bench_preprocess.py [图片数量] [宽] [高]
+"""
+
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from PIL import Image
+
+from app.services.image_pipeline import ImagePreprocessor, preprocess_image
+
+
+def make_images(directory: Path, count: int, width: int, height: int):
+    """生成测试用的大尺寸JPEG图片"""
+    paths = []
+    for i in range(count):
+        noise = Image.effect_noise((width, height), 64 + i).convert('RGB')
+        path = directory / f"shelf_{i}.jpg"
+        noise.save(path, format='JPEG', quality=92)
+        paths.append(str(path))
+    return paths
+
+
+def run_batch(preprocessor: ImagePreprocessor, paths, io_threads: int) -> float:
+    """模拟TaskManager的I/O线程并发提交预处理任务，返回耗时（秒）"""
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=io_threads) as executor:
+        list(executor.map(preprocessor.process, paths))
+    return time.perf_counter() - start
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 12
+    width = int(sys.argv[2]) if len(sys.argv) > 2 else 4000
+    height = int(sys.argv[3]) if len(sys.argv) > 3 else 3000
+    cpu_count = os.cpu_count() or 1
+
+    print("=" * 60)
+    print(f"🖼️ 图片预处理基准测试: {count} 张 {width}x{height}, CPU核数 {cpu_count}")
+    print("=" * 60)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = make_images(Path(tmp), count, width, height)
+
+        # 单张图片的解码耗时与内存峰值，用于调整token预算
+        _, stats = preprocess_image(paths[0])
+        print(f"   单张: {stats['original_size']} -> 解码 {stats['decoded_size']} -> 输出 {stats['output_size']}")
+        print(f"   解码 {stats['decode_ms']}ms, 总计 {stats['total_ms']}ms, 进程内存峰值 {stats['process_peak_rss_kb']}KB")
+
+        worker_counts = sorted({0, 1, 2, 4, cpu_count})
+        baseline = None
+        for workers in worker_counts:
+            preprocessor = ImagePreprocessor(max_workers=workers)
+            if workers > 0:
+                # 预先启动进程池，避免把进程启动时间计入吞吐量
+                run_batch(preprocessor, paths[:workers], workers)
+
+            elapsed = run_batch(preprocessor, paths, io_threads=max(workers, 3))
+            preprocessor.shutdown()
+
+            throughput = count / elapsed
+            baseline = baseline or throughput
+            label = '线程内(GIL)' if workers == 0 else f'{workers} 进程'
+            print(f"   {label:<12} {elapsed:7.2f}s  {throughput:6.2f} 张/秒  x{throughput / baseline:.2f}")
+
+    print("=" * 60)
+
+
+if __name__ == '__main__':
+    main()
@@ -80,7 +80,8 @@ def check_dependencies():
         ('pandas', 'pandas'),
         ('openpyxl', 'openpyxl'),
         ('cryptography', 'cryptography'),
-        ('python-dotenv', 'dotenv')
+        ('python-dotenv', 'dotenv'),
+        ('aiohttp', 'aiohttp')
     ]
     
     missing_packages = []
@@ -154,6 +154,1303 @@ def test_export_service():
         print(f"   ❌ 导出服务测试失败: {e}")
         return False
 
+def test_recognition_cache():
+    """测试识别缓存"""
+    print("🖼️ 测试识别缓存...")
+    
+    try:
+        import io
+        from PIL import Image, ImageDraw
+        from app.services.recognition_cache import dhash, hamming_distance, BKTree
+        
+        # 构造测试图片及其轻微变化版本
+        img = Image.new('RGB', (640, 480), 'white')
+        draw = ImageDraw.Draw(img)
+        for i in range(8):
+            draw.rectangle([i * 80, 0, i * 80 + 40, 480], fill=(i * 30, 60, 120))
+        
+        buffers = []
+        for quality in (95, 70):
+            buffer = io.BytesIO()
+            img.save(buffer, format='JPEG', quality=quality)
+            buffers.append(buffer.getvalue())
+        
+        other = io.BytesIO()
+        img.rotate(90).save(other, format='JPEG')
+        
+        h1, h2, h3 = dhash(buffers[0]), dhash(buffers[1]), dhash(other.getvalue())
+        assert hamming_distance(h1, h2) <= 5
+        assert hamming_distance(h1, h3) > 5
+        print("   ✓ 感知哈希")
+        
+        tree = BKTree()
+        for value in (h1, h3, 0x0F0F, 0xFFFF):
+            tree.add(value)
+        assert tree.find_nearest(h2, 5)[0] == h1
+        assert tree.find_nearest(0x0F0E, 2) == (0x0F0F, 1)
+        tree.remove(0x0F0F)
+        assert tree.find_nearest(0x0F0E, 2) is None
+        print("   ✓ BK树检索")
+        
+        return True
+        
+    except Exception as e:
+        print(f"   ❌ 识别缓存测试失败: {e}")
+        return False
+
+def test_enrichment_cache():
+    """测试书籍信息缓存"""
+    print("📚 测试书籍信息缓存...")
+    
+    try:
+        import tempfile
+        import time
+        from app.models.database import SimpleDB
+        from app.services.enrichment_cache import EnrichmentCache
+        from app.services.enrichment_providers import PROVIDERS, ProviderChain, ProviderStats
+        from app.services.search_service import SearchService
+        
+        temp_dir = tempfile.mkdtemp()
+        database = SimpleDB(f'{temp_dir}/cache.db')
+        cache = EnrichmentCache(memory_entries=2, field_ttls={'rating': 3600}, database=database)
+        now = time.time()
+        expiries = cache.field_expiries({'summary': '简介', 'rating': 8.5, 'price': ''}, now)
+        assert expiries == {'summary': now + cache.field_ttls['summary'], 'rating': now + 3600}
+        assert cache.expires_at(expiries, now) == now + cache.field_ttls['summary']
+        # 评分过期后其余字段仍然有效，只列出需要重新查询的评分
+        cache.set('book', {'summary': '简介', 'rating': 8.5}, field_expires={'rating': now - 1})
+        entry = cache.get_entry('book')
+        assert entry['data'] == {'summary': '简介', 'rating': ''} and entry['stale_fields'] == ['rating']
+        assert EnrichmentCache(database=database).get_entry('book')['stale_fields'] == ['rating']
+        print("   ✓ 按字段TTL过期")
+        
+        keys = [f"test_enrichment_{i}" for i in range(3)]
+        for key in keys:
+            cache.set(key, {'summary': key})
+        assert cache.keys() == keys[1:]
+        # 被内存淘汰的条目仍可从数据库读取，重启后的新实例同样可以命中
+        assert cache.get(keys[0]) == {'summary': keys[0]}
+        assert EnrichmentCache(database=database).get(keys[2]) == {'summary': keys[2]}
+        stats = cache.get_stats()
+        assert stats['disk_hits'] == 1 and stats['memory_evictions'] >= 1
+        print("   ✓ 两级缓存")
+        
+        service = SearchService()
+        service.cache = EnrichmentCache(database=database)
+        service.fuzzy_threshold = 0
+        service.google_api_key = ''
+        service._lookup_local = lambda title, author: None
+        calls = []
+        service._search_douban = lambda title, author: calls.append('douban') or {'summary': '新简介', 'rating': 9.1}
+        service._search_openlibrary = lambda title, author: calls.append('openlibrary') or {'pages': '302'}
+        key = service._cache_key('三体', '刘慈欣')
+        service.cache.set(key, {'summary': '简介', 'cover_url': 'http://cover', 'rating': 8.5},
+                          field_expires={'rating': now - 1})
+        summary_expires = service.cache.get_entry(key)['field_expires']['summary']
+        provider_stats = ProviderStats(ProviderChain([PROVIDERS['openlibrary'], PROVIDERS['douban']],
+                                                     ('summary', 'cover_url')))
+        book = service._enrich_single_book({'title': '三体', 'author': '刘慈欣'}, provider_stats)
+        # 只请求能提供评分的豆瓣；未过期的简介沿用缓存的值和过期时间
+        assert calls == ['douban'] and book['rating'] == 9.1 and book['summary'] == '简介'
+        entry = service.cache.get_entry(key)
+        assert not entry['stale_fields'] and entry['field_expires']['summary'] == summary_expires
+        assert entry['field_expires']['rating'] > now
+        print("   ✓ 只重新查询已过期的字段")
+        
+        return True
+        
+    except Exception as e:
+        print(f"   ❌ 书籍信息缓存测试失败: {e}")
+        return False
+
+def test_single_flight():
+    """测试并发查询合并"""
+    print("🛬 测试并发查询合并...")
+    
+    try:
+        import threading
+        import time
+        from concurrent.futures import ThreadPoolExecutor
+        from app.services.single_flight import SingleFlight
+        
+        flight = SingleFlight()
+        calls = []
+        started = threading.Event()
+        
+        def lookup():
+            calls.append(1)
+            started.set()
+            time.sleep(0.2)
+            return {'summary': '简介'}
+        
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            leader = executor.submit(flight.do, 'key', lookup)
+            started.wait()
+            followers = [executor.submit(flight.do, 'key', lookup) for _ in range(3)]
+            results = [leader.result()] + [future.result() for future in followers]
+        
+        assert len(calls) == 1 and all(result == {'summary': '简介'} for result in results)
+        stats = flight.get_stats()
+        assert stats['executions'] == 1 and stats['deduplicated'] == 3 and stats['in_flight'] == 0
+        print("   ✓ 相同键只执行一次")
+
+        # 异步执行者被取消时，同步等待方重新执行而不是收到CancelledError
+        import asyncio
+        leader_started = threading.Event()
+
+        async def slow_lookup():
+            leader_started.set()
+            await asyncio.sleep(5)
+
+        async def cancel_leader():
+            task = asyncio.ensure_future(flight.do_async('cancelled', slow_lookup))
+            await asyncio.get_running_loop().run_in_executor(None, leader_started.wait)
+            while flight.get_stats()['deduplicated'] < 4:  # 等待同步调用方加入
+                await asyncio.sleep(0.01)
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                return True
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            thread = threading.Thread(target=lambda: asyncio.run(cancel_leader()))
+            thread.start()
+            leader_started.wait()
+            follower = executor.submit(flight.do, 'cancelled', lambda: {'summary': '重新执行'})
+            thread.join()
+            assert follower.result(timeout=5) == {'summary': '重新执行'}
+        print("   ✓ 执行者被取消时等待方重新执行")
+
+        return True
+        
+    except Exception as e:
+        print(f"   ❌ 并发查询合并测试失败: {e}")
+        return False
+
+def test_provider_search():
+    """测试多源搜索的延迟统计和优先级合并"""
+    print("🔀 测试多源并发搜索...")
+    
+    try:
+        from app.services.search_service import SearchService, LatencyWindow
+        
+        window = LatencyWindow(size=50, min_samples=10)
+        assert window.percentile(95) is None
+        for ms in range(1, 101):
+            window.record(ms)
+        assert window.percentile(95) >= 95 and window.get_stats()['samples'] == 50
+        print("   ✓ 延迟窗口和分位数正常")
+        
+        service = SearchService()
+        merged = service._merge_by_priority({
+            'douban': {'summary': '豆瓣简介', 'cover_url': 'http://cover'},
+            'google': {'summary': 'Google简介', 'cover_url': '', 'pages': '320'}
+        }, ['douban', 'google'])
+        assert merged == {'summary': '豆瓣简介', 'cover_url': 'http://cover', 'pages': '320'}
+        assert service._is_sufficient(merged)
+        print("   ✓ 按优先级合并非空字段")
+
+        # 调度策略与驱动无关：手动完成Future，检查发起顺序、提前发起和提前结束
+        from concurrent.futures import Future
+        from app.services.enrichment_providers import PROVIDERS, ProviderChain, ProviderStats
+        from app.services.search_service import ProviderSchedule
+        chain = ProviderChain([PROVIDERS['douban'], PROVIDERS['openlibrary']], ('summary', 'cover_url'))
+        service.book_deadline = 5
+        sent = []
+
+        def start(name):
+            sent.append((name, Future()))
+            return sent[-1][1]
+
+        schedule = ProviderSchedule(service, '测试书', None, chain, start, now=0.0)
+        assert not schedule.step(0.0) and [name for name, _ in sent] == ['douban']
+        assert schedule.wait_timeout(0.0) == PROVIDERS['douban'].expected_latency_ms / 1000
+        assert not schedule.step(1.0) and [name for name, _ in sent] == ['douban', 'openlibrary']
+        sent[0][1].set_result({'summary': '简介', 'cover_url': 'http://cover'})
+        schedule.completed(sent[0][1])
+        assert schedule.step(1.1) and list(schedule.pending) == [sent[1][1]]
+        schedule.cancel()
+        assert sent[1][1].cancelled()
+        merged, failed, _ = schedule.finish(ProviderStats(chain))
+        assert merged['summary'] == '简介' and not failed
+
+        sent.clear()
+        schedule = ProviderSchedule(service, '测试书', None, chain, start, now=0.0)
+        schedule.step(0.0)
+        sent[0][1].set_exception(RuntimeError('boom'))
+        schedule.completed(sent[0][1])
+        assert not schedule.step(0.1) and [name for name, _ in sent] == ['douban', 'openlibrary']
+        assert schedule.step(6.0) and schedule.failed  # 超过截止时间
+        schedule.cancel()
+        print("   ✓ 同步和异步驱动共用的调度策略正常")
+
+        return True
+        
+    except Exception as e:
+        print(f"   ❌ 多源并发搜索测试失败: {e}")
+        return False
+
+def test_enrichment_pool():
+    """测试共享丰富化线程池的自适应并发上限"""
+    print("🚦 测试搜索源并发上限...")
+    
+    try:
+        import threading
+        import time
+        from app.services.enrichment_pool import AdaptiveLimit, EnrichmentPool
+        
+        limit = AdaptiveLimit('test', max_limit=4, target_latency_ms=100, cooldown=0)
+        limit.acquire()
+        limit.release(500)
+        assert limit.get_stats()['limit'] == 2
+        limit.acquire()
+        limit.release(10, error=True)
+        assert limit.get_stats()['limit'] == 1
+        for _ in range(10):
+            limit.acquire()
+            limit.release(10)
+        assert limit.get_stats()['limit'] == 4
+        print("   ✓ 出错/慢请求减半，成功请求逐步恢复")
+        
+        pool = EnrichmentPool()
+        pool.provider_limits['test'] = 2
+        peak = [0]
+        active = [0]
+        lock = threading.Lock()
+        
+        def search():
+            with lock:
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+            time.sleep(0.05)
+            with lock:
+                active[0] -= 1
+            return True
+        
+        futures = [pool.submit_book(pool.call_provider, 'test', search) for _ in range(6)]
+        assert all(future.result() for future in futures)
+        stats = pool.get_stats()
+        assert peak[0] <= 2 and stats['providers']['test']['completed'] == 6
+        assert stats['books']['queued'] == 0 and stats['books']['completed'] == 6
+        print("   ✓ 多个任务共享同一个并发上限")
+        
+        return True
+        
+    except Exception as e:
+        print(f"   ❌ 并发上限测试失败: {e}")
+        return False
+
+def test_ordered_enrichment():
+    """测试逐本产出的丰富化结果保持书架顺序"""
+    print("📚 测试按书架顺序丰富化...")
+    
+    try:
+        import time
+        from app.services.search_service import SearchService
+        
+        service = SearchService()
+        
+        def enrich(book, provider_stats=None):
+            # 靠前的书更慢，完成顺序与书架顺序相反
+            time.sleep(0.02 * (3 - book['index']))
+            return {**book, 'summary': f"简介{book['index']}"}
+        
+        service._enrich_single_book = enrich
+        books = [{'title': f'书{i}', 'index': i} for i in range(4)]
+        
+        yielded = list(service.iter_enriched(books))
+        assert sorted(index for index, _ in yielded) == [0, 1, 2, 3]
+        assert all(book['index'] == index for index, book in yielded)
+        print("   ✓ 每本书附带原始位置")
+        
+        enriched = service.enrich_books(books)
+        assert [book['summary'] for book in enriched] == ['简介0', '简介1', '简介2', '简介3']
+        print("   ✓ 合并结果保持书架顺序")
+        
+        return True
+        
+    except Exception as e:
+        print(f"   ❌ 按书架顺序丰富化测试失败: {e}")
+        return False
+
+def test_async_engine():
+    """测试异步引擎的丰富化流程（替换_fetch_json，不发出网络请求）"""
+    print("⚡ 测试异步引擎...")
+
+    try:
+        import tempfile
+        import threading
+        from app.models.database import SimpleDB
+        from app.services.async_engine import AsyncEngine
+        from app.services.enrichment_cache import EnrichmentCache
+        from app.services.enrichment_providers import PROVIDERS, ProviderChain, ProviderStats
+        from app.services.search_service import SearchService
+
+        service = SearchService()
+        service.cache = EnrichmentCache(database=SimpleDB(f'{tempfile.mkdtemp()}/cache.db'))
+        service.fuzzy_threshold = 0
+        service.google_api_key = ''
+        service._lookup_local = lambda title, author: None
+        cache_threads = []
+        get_cached = service._get_cached
+
+        def record_thread(title, author):
+            cache_threads.append(threading.current_thread().name)
+            return get_cached(title, author)
+
+        service._get_cached = record_thread
+
+        engine = AsyncEngine()
+        requests_sent = []
+
+        async def fetch_json(upstream, request):
+            url, params = request
+            requests_sent.append(upstream)
+            return {'books': [{'summary': f"{params['q']}简介", 'image': 'http://cover'}]}
+
+        engine._fetch_json = fetch_json
+        books = [{'title': f'异步测试书{i}', 'author': '作者'} for i in range(3)]
+        provider_stats = ProviderStats(ProviderChain([PROVIDERS['douban']], ('summary', 'cover_url')))
+
+        async def collect():
+            return [item async for item in engine.iter_enriched(service, books, provider_stats)]
+
+        yielded = engine.submit(collect()).result(timeout=30)
+        assert sorted(index for index, _ in yielded) == [0, 1, 2]
+        assert all(book['summary'] == f"{books[index]['title']} 作者简介" for index, book in yielded)
+        assert requests_sent == ['douban'] * 3
+        print("   ✓ 按完成顺序产出丰富后的书籍")
+
+        # 缓存读取（SQLite）在阻塞线程池中执行，不占用事件循环线程
+        assert len(cache_threads) == 3 and 'async-engine' not in cache_threads
+        yielded = engine.submit(collect()).result(timeout=30)
+        assert requests_sent == ['douban'] * 3 and all(book['cover_url'] == 'http://cover' for _, book in yielded)
+        assert engine.get_stats()['in_flight'] == {'qwen': 0}
+        print("   ✓ 阻塞操作不在事件循环线程上执行，第二次命中缓存")
+
+        return True
+
+    except Exception as e:
+        print(f"   ❌ 异步引擎测试失败: {e}")
+        return False
+
+def test_book_catalog():
+    """测试本地离线书目库"""
+    print("🗂️ 测试本地书目库...")
+    
+    try:
+        import gzip
+        import json
+        import os
+        import tempfile
+        from app.services.book_catalog import BookCatalog
+        from app.services.enrichment_providers import PROVIDERS, ProviderChain, ProviderStats
+        from app.services.search_service import SearchService
+        
+        with tempfile.TemporaryDirectory() as temp_dir:
+            dump_path = os.path.join(temp_dir, 'ol_dump.txt.gz')
+            records = [
+                {'type': {'key': '/type/work'}, 'key': '/works/OL1W', 'title': '三体',
+                 'description': {'type': '/type/text', 'value': '文化大革命如火如荼进行的同时……'}, 'covers': [123]},
+                {'type': {'key': '/type/edition'}, 'key': '/books/OL1M', 'title': '三体',
+                 'works': [{'key': '/works/OL1W'}], 'by_statement': '刘慈欣',
+                 'isbn_13': ['978-7-5366-9293-0'], 'number_of_pages': 302, 'publish_date': '2008'},
+                {'type': {'key': '/type/edition'}, 'key': '/books/OL2M', 'title': 'The Pragmatic Programmer',
+                 'authors': [{'name': 'Andrew Hunt'}], 'covers': [456]},
+                {'type': {'key': '/type/edition'}, 'key': '/books/OL3M', 'title': 'Python Cookbook',
+                 'authors': [{'name': 'David Beazley'}], 'covers': [789], 'description': 'Recipes for Python 3'}
+            ]
+            with gzip.open(dump_path, 'wt', encoding='utf-8') as dump:
+                for record in records:
+                    dump.write(f"{record['type']['key']}\t{record['key']}\t1\t2024-01-01\t{json.dumps(record, ensure_ascii=False)}\n")
+                dump.write('不是JSON的行\n')
+            
+            catalog = BookCatalog(os.path.join(temp_dir, 'catalog.db'))
+            stats = catalog.import_dump(dump_path, batch_size=2)
+            assert stats['imported'] == 4 and stats['skipped'] == 1 and stats['isbns'] == 1
+            print("   ✓ 流式导入gzip转储")
+            
+            info = catalog.lookup('三体', '刘慈欣')
+            assert info['match'] == 'exact' and info['pages'] == 302 and info['summary'].startswith('文化大革命')
+            assert info['cover_url'].endswith('/123-L.jpg')
+            assert catalog.lookup_isbn('9787536692930')['pubdate'] == '2008'
+            similar = catalog.lookup('pragmatic programmer')
+            assert similar['match'] == 'similar' and similar['cover_url'].endswith('/456-L.jpg')
+            assert catalog.lookup('不存在的书') is None
+            print("   ✓ 书名、ISBN和全文索引查询")
+            
+            # 全文索引候选需书名足够相似且作者一致，书名相同但作者冲突的也不算命中
+            assert catalog.lookup('Python', 'Mark Lutz') is None
+            assert catalog.lookup('Python', '') is None
+            assert catalog.lookup('Python Cookbook', 'Mark Lutz') is None
+            assert catalog.lookup('python cookbook', 'David Beazley')['match'] == 'exact'
+            
+            # 书名相近的候选不会让网络搜索源被跳过，只补充缺失的字段
+            service = SearchService()
+            service.catalog = catalog
+            calls = []
+            service._search_douban = lambda title, author: calls.append('douban') or {'summary': '豆瓣简介'}
+            service._store_search_results = lambda title, author, results, *args: service._info(results)
+            info = service._lookup_book_info('pragmatic programmer', '',
+                                             ProviderStats(ProviderChain([PROVIDERS['douban']], ('cover_url',))))
+            assert calls == ['douban'] and info['summary'] == '豆瓣简介' and info['cover_url'].endswith('/456-L.jpg')
+            print("   ✓ 只有书名精确命中才直接作为结果")
+            catalog.close()
+        
+        return True
+        
+    except Exception as e:
+        print(f"   ❌ 本地书目库测试失败: {e}")
+        return False
+
+def test_isbn_lookup():
+    """测试ISBN规范化和批量ISBN查询"""
+    print("🔢 测试ISBN优先查询...")
+    
+    try:
+        import time
+        from app.services.isbn import isbn13_check_digit, normalize_isbn
+        from app.services.search_service import SearchService
+        
+        assert normalize_isbn('0-306-40615-2') == '9780306406157'
+        assert normalize_isbn('ISBN 978-0-306-40615-7') == '9780306406157'
+        assert normalize_isbn('080442957X') == '9780804429573'
+        assert normalize_isbn('0-306-40615-3') is None
+        assert normalize_isbn('9780306406158') is None
+        assert normalize_isbn('未知') is None
+        print("   ✓ ISBN-10转ISBN-13并校验")
+        
+        service = SearchService()
+        service.catalog.enabled = False
+        requests_made = []
+        
+        def search_isbns(isbns):
+            requests_made.append(list(isbns))
+            return service._parse_openlibrary_isbns({
+                f'ISBN:{isbn}': {'title': titles.get(isbn, '书一'), 'notes': f'简介{isbn}',
+                                 'cover': {'large': f'http://cover/{isbn}'}, 'number_of_pages': 100}
+                for isbn in isbns
+            })
+        
+        service._search_isbns = search_isbns
+        # 每次运行使用新的ISBN，避免命中之前写入数据库的缓存
+        bodies = [f"978{(int(time.time() * 1000) + i) % 10 ** 9:09d}" for i in range(2)]
+        isbns = [body + isbn13_check_digit(body) for body in bodies]
+        titles = {isbns[1]: '书二：副标题'}
+        books = [
+            {'title': '书一', 'isbn': isbns[0]},
+            {'title': '书二', 'isbn': f'{isbns[1][:3]}-{isbns[1][3:]}'},
+            {'title': '书一（重复）', 'isbn': isbns[0]}
+        ]
+        enriched = service.enrich_books(books)
+        assert requests_made == [isbns]
+        assert enriched[1]['cover_url'] == f'http://cover/{isbns[1]}'
+        assert enriched[2]['summary'] == f'简介{isbns[0]}'
+        print("   ✓ 整个书架的ISBN一次请求完成")
+        
+        # ISBN对应的书名与识别出的书名对不上时（模型编出的ISBN），按书名搜索的结果优先
+        body = f"978{(int(time.time() * 1000) + 7) % 10 ** 9:09d}"
+        wrong_isbn = body + isbn13_check_digit(body)
+        titles[wrong_isbn] = 'A Completely Different Book'
+        text_title = f'按书名查询{body}'
+        service._lookup_book_info = lambda title, author, provider_stats=None, cached=None: \
+            {**service._info({}), 'summary': '书名搜索的简介'}
+        book = service.enrich_books([{'title': text_title, 'isbn': wrong_isbn}])[0]
+        assert book['title'] == text_title and book['summary'] == '书名搜索的简介'
+        assert book['cover_url'] == f'http://cover/{wrong_isbn}'  # 只补充缺失的字段
+        assert service.get_search_stats()['isbn_mismatches'] >= 1
+        assert service._isbn_matches_title({'title': 'Effective Java'}, 'effective java')
+        print("   ✓ ISBN书名核对不通过时只作为补充")
+        
+        return True
+        
+    except Exception as e:
+        print(f"   ❌ ISBN优先查询测试失败: {e}")
+        return False
+
+def test_fuzzy_cache_keys():
+    """测试缓存键规范化和相似书名匹配"""
+    print("🔤 测试缓存键规范化...")
+    
+    try:
+        from app.services.search_service import SearchService
+        from app.services.text_match import TrigramIndex, normalize_text
+        
+        service = SearchService()
+        key = service._cache_key('Python编程：从入门到实践', '埃里克·马瑟斯')
+        assert service._cache_key('Python编程从入门到实践', '埃里克•马瑟斯') == key
+        assert service._cache_key('《Ｐｙｔｈｏｎ編程 從入門到實踐》', '埃里克 马瑟斯') == key
+        print("   ✓ 全半角、标点、空白和繁简差异得到相同的键")
+        
+        index = TrigramIndex()
+        for title, author in (('设计模式：可复用面向对象软件的基础', 'Erich Gamma'),
+                              ('JavaScript高级程序设计', ''), ('三体', '刘慈欣')):
+            index.add(f'{title}_{author}', normalize_text(title), normalize_text(author))
+        assert index.best_match(normalize_text('设计模式 可复用面向对象软件基础'), normalize_text('Gamma')) \
+            == '设计模式：可复用面向对象软件的基础_Erich Gamma'
+        assert index.best_match(normalize_text('三体2'), normalize_text('刘慈欣')) is None
+        assert index.best_match(normalize_text('设计模式可复用面向对象软件的基础'), normalize_text('余华')) is None
+        print("   ✓ 三元组相似度匹配并校验作者")
+        
+        # 同一作者同一本书的不同版本不互相匹配（封面、页数、出版日期都不同）
+        for cached, query, author in (
+            ('JavaScript高级程序设计（第3版）', 'JavaScript高级程序设计（第4版）', 'Nicholas C. Zakas'),
+            ('Effective Java 2nd Edition', 'Effective Java 3rd Edition', 'Joshua Bloch'),
+            ('JavaScript高级程序设计', 'JavaScript高级程序设计（第4版）', 'Nicholas C. Zakas'),
+            ('红楼梦 上册', '红楼梦 下册', '曹雪芹')
+        ):
+            index = TrigramIndex()
+            index.add('cached', normalize_text(cached), normalize_text(author))
+            assert index.best_match(normalize_text(query), normalize_text(author)) is None, query
+        index = TrigramIndex()
+        index.add('cached', normalize_text('JavaScript高级程序设计（第3版）'), '')
+        assert index.best_match(normalize_text('JavaScript高级程序设计 第三版'), '') == 'cached'
+        print("   ✓ 书名中的数字和版本、卷册标记必须一致")
+        
+        return True
+        
+    except Exception as e:
+        print(f"   ❌ 缓存键规范化测试失败: {e}")
+        return False
+
+def test_negative_cache_and_health():
+    """测试负缓存和搜索源健康检查"""
+    print("🩺 测试负缓存和搜索源健康检查...")
+    
+    try:
+        import time
+        import uuid
+        from app.services.enrichment_providers import PROVIDERS, ProviderChain, ProviderStats
+        from app.services.resilience import ProviderHealth
+        from app.services.search_service import SearchService
+        
+        health = ProviderHealth('test', window=10, min_samples=3, cooldown=0.1)
+        for _ in range(3):
+            assert health.allow()
+            health.record(100, error=True)
+        assert not health.allow() and health.get_state()['skipped'] == 1
+        time.sleep(0.15)
+        assert health.allow()  # 冷却后放行探测请求
+        health.record(100, error=False)
+        assert health.allow() and health.get_state()['state'] == 'closed'
+        print("   ✓ 错误率过高时跳过，探测成功后恢复")
+        
+        def failing_search(title, author):
+            raise ConnectionError('boom')
+        
+        service = SearchService()
+        service.google_api_key = ''
+        service._search_douban = failing_search
+        service.health['douban'] = ProviderHealth('douban', min_samples=2, cooldown=60)
+        service.negative_error_ttl = 0.2
+        prefix = uuid.uuid4().hex[:8]
+        titles = [f'不存在的书{prefix}{i}' for i in range(3)]
+        provider_stats = ProviderStats(ProviderChain([PROVIDERS['douban']], ('summary',)))
+        for title in titles:
+            assert not any(service._lookup_book_info(title, '', provider_stats).values())
+        assert service.health['douban'].get_state()['skipped'] == 1
+        print("   ✓ 连续失败后不再请求该搜索源")
+        
+        negative_before = service.get_search_stats()['negative_hits']
+        assert service._get_cached(titles[0], '') is not None
+        assert service.get_search_stats()['negative_hits'] == negative_before + 1
+        time.sleep(0.3)
+        assert service._get_cached(titles[0], '') is None
+        print("   ✓ 出错时的空结果只短暂缓存")
+
+        # 探测请求因截止时间被取消（没有结果）后，该搜索源不能一直停在半开状态
+        import asyncio
+        from concurrent.futures import Future
+        from app.services.async_engine import AsyncEngine
+        from app.services.search_service import ProviderSchedule
+
+        def open_health():
+            health = ProviderHealth('douban', min_samples=1, cooldown=0.05)
+            health.allow()
+            health.record(100, error=True)
+            time.sleep(0.1)
+            return health
+
+        service.health['douban'] = open_health()
+        service.book_deadline = 1
+        chain = ProviderChain([PROVIDERS['douban']], ('summary',))
+        schedule = ProviderSchedule(service, titles[0], None, chain, lambda name: Future(), now=0.0)
+        assert not schedule.step(0.0) and schedule.step(2.0)
+        schedule.cancel()
+        assert service.health['douban'].allow()
+
+        service.health['douban'] = open_health()
+        service._lookup_local = lambda title, author: None
+        service.book_deadline = 0.2
+        engine = AsyncEngine()
+
+        async def slow_fetch(upstream, request):
+            await asyncio.sleep(5)
+
+        engine._fetch_json = slow_fetch
+        engine.submit(engine._lookup_book_info(service, f'慢书{prefix}', '', provider_stats)).result(timeout=10)
+        assert [service.health['douban'].allow() for _ in range(2)] == [True, False]
+        print("   ✓ 被取消的探测请求释放探测名额")
+
+        return True
+        
+    except Exception as e:
+        print(f"   ❌ 负缓存和健康检查测试失败: {e}")
+        return False
+
+def test_provider_chain():
+    """测试搜索源链的发起顺序、提前结束和每次扫描的统计"""
+    print("⛓️ 测试搜索源链...")
+    
+    try:
+        import uuid
+        from app.models.database import db
+        from app.services.enrichment_providers import PROVIDERS, ProviderChain, ProviderStats, validate_provider_config
+        from app.services.search_service import SearchService
+        
+        previous = os.environ.get('ENRICH_PROVIDERS')
+        os.environ['ENRICH_PROVIDERS'] = 'google, douban,unknown,douban'
+        try:
+            chain = ProviderChain.load(['summary'])
+        finally:
+            if previous is None:
+                del os.environ['ENRICH_PROVIDERS']
+            else:
+                os.environ['ENRICH_PROVIDERS'] = previous
+        if not db.get_config('enrich_providers'):
+            assert chain.order == ['google', 'douban']
+        
+        chain = ProviderChain([PROVIDERS['douban'], PROVIDERS['google'], PROVIDERS['openlibrary']], ('summary', 'cover_url'))
+        assert [spec.name for spec in chain.launch_order(['douban', 'google', 'openlibrary'])] == ['douban', 'openlibrary', 'google']
+        print("   ✓ 按配置启用，免费搜索源先请求")
+        
+        calls = []
+        replies = {}
+        service = SearchService()
+        service.google_api_key = service.google_search_engine_id = 'test'
+        for name in PROVIDERS:
+            def search(title, author, name=name):
+                calls.append(name)
+                return replies.get(name)
+            setattr(service, f'_search_{name}', search)
+        
+        replies.update(douban={'summary': '豆瓣简介'}, openlibrary={'cover_url': 'http://cover', 'summary': 'OL简介'})
+        provider_stats = ProviderStats(chain)
+        info = service._lookup_book_info(f'链测试{uuid.uuid4().hex[:8]}', '', provider_stats)
+        assert calls == ['douban', 'openlibrary']
+        assert info['summary'] == '豆瓣简介' and info['cover_url'] == 'http://cover'
+        stats = {provider['name']: provider for provider in provider_stats.to_dict()['providers']}
+        assert stats['douban']['fields'] == 1 and stats['openlibrary']['fields'] == 1
+        assert provider_stats.to_dict()['total_cost'] == 0
+        print("   ✓ 需要的字段补齐后不再请求消耗配额的搜索源")
+        
+        calls.clear()
+        replies.clear()
+        replies['google'] = {'summary': 'Google简介'}
+        chain = ProviderChain([PROVIDERS['douban'], PROVIDERS['google']], ('summary',))
+        provider_stats = ProviderStats(chain)
+        assert service._lookup_book_info(f'链测试{uuid.uuid4().hex[:8]}', '', provider_stats)['summary'] == 'Google简介'
+        assert calls == ['douban', 'google'] and provider_stats.to_dict()['total_cost'] == 1
+        print("   ✓ 免费搜索源缺字段时再请求Google并计入配额")
+        
+        # 没有可用的搜索源时，空结果按失败处理（只写入短TTL的负缓存）
+        stored = []
+        store = service._store_search_results
+        service._store_search_results = lambda *args: stored.append(args[3]) or store(*args)
+        service._lookup_book_info(f'链测试{uuid.uuid4().hex[:8]}', '', ProviderStats(ProviderChain([], ('summary',))))
+        assert stored == [True]
+        
+        assert validate_provider_config('enrich_providers', ['douban', ' openlibrary', 'douban']) == 'douban,openlibrary'
+        assert validate_provider_config('enrich_required_fields', 'summary,cover_url') == 'summary,cover_url'
+        for key, value in (('enrich_providers', 'doubna'), ('enrich_required_fields', ['summary', 'covers'])):
+            try:
+                validate_provider_config(key, value)
+                raise AssertionError(f"{key}={value!r} 应被拒绝")
+            except ValueError:
+                pass
+        from app import create_app
+        response = create_app().test_client().post('/api/config', json={'enrich_providers': 'doubna,google'})
+        assert response.status_code == 400 and 'doubna' in response.get_json()['error']
+        print("   ✓ 保存时拒绝未知的搜索源和字段，没有可用搜索源时按失败缓存")
+        
+        return True
+        
+    except Exception as e:
+        print(f"   ❌ 搜索源链测试失败: {e}")
+        return False
+
+def test_cover_cache():
+    """测试封面缓存的内容寻址、缩略图和字节预算"""
+    print("🖼️ 测试封面缓存...")
+    
+    try:
+        import io
+        import tempfile
+        import time
+        import uuid
+        from PIL import Image
+        from app.models.database import SimpleDB
+        from app.services.cover_cache import CoverCache
+        
+        def image_bytes(color, size=(400, 600)):
+            output = io.BytesIO()
+            Image.new('RGB', size, color).save(output, format='JPEG')
+            return output.getvalue()
+        
+        with tempfile.TemporaryDirectory() as temp_dir:
+            cache = CoverCache(store_dir=temp_dir, max_bytes=10 * 1024 * 1024, thumb_size=(80, 120),
+                               database=SimpleDB(f'{temp_dir}/covers.db'))
+            images = {}
+            downloads = []
+            
+            def download(url):
+                downloads.append(url)
+                return images[url]
+            
+            cache._download = download
+            prefix = f'https://img1.doubanio.com/{uuid.uuid4().hex}'
+            images[f'{prefix}/a.jpg'] = images[f'{prefix}/a-copy.jpg'] = image_bytes('red')
+            images[f'{prefix}/b.jpg'] = image_bytes('blue', (300, 300))
+            
+            digest = cache.fetch(f'{prefix}/a.jpg')
+            assert cache.fetch(f'{prefix}/a-copy.jpg') == digest
+            assert cache.fetch(f'{prefix}/a.jpg') == digest and len(downloads) == 2
+            assert cache.counters['downloaded'] == 1 and cache.counters['deduplicated'] == 1
+            with Image.open(cache.thumbnail_path(digest)) as thumbnail:
+                assert thumbnail.format == 'WEBP' and thumbnail.size == (80, 120)
+            assert cache.local_url(f'{prefix}/a-copy.jpg') == f'/covers/{digest}.webp'
+            assert cache.data_uri(f'{prefix}/a.jpg').startswith('data:image/webp;base64,')
+            print("   ✓ 相同内容只存一份，生成固定尺寸WebP缩略图")
+            
+            assert not cache.allowed('http://127.0.0.1/cover.jpg') and not cache.allowed('file:///etc/passwd')
+            assert cache.fetch(f'{prefix}/missing.jpg') is None
+            assert cache.fetch(f'{prefix}/missing.jpg') is None and downloads.count(f'{prefix}/missing.jpg') == 1
+            print("   ✓ 只下载允许的域名，失败的链接不立即重试")
+
+            # 重定向的每一跳都检查域名：允许的主机不能把服务器重定向到内网地址
+            from app.services import cover_cache as cover_module
+
+            class FakeResponse:
+                def __init__(self, location=None, body=b''):
+                    self.is_redirect = location is not None
+                    self.headers = {'Location': location}
+                    self.body = body
+
+                def __enter__(self):
+                    return self
+
+                def __exit__(self, *exc):
+                    return False
+
+                def raise_for_status(self):
+                    pass
+
+                def iter_content(self, size):
+                    yield self.body
+
+            redirects = {
+                'https://covers.openlibrary.org/b/id/1-M.jpg': '//archive.org/download/1/1-M.jpg',
+                'https://img1.doubanio.com/evil.jpg': 'http://169.254.169.254/latest/meta-data/',
+                'https://img1.doubanio.com/loop.jpg': '/loop.jpg',
+            }
+            requested = []
+
+            class FakeClient:
+                def get(self, url, allow_redirects=True, **kwargs):
+                    assert not allow_redirects
+                    requested.append(url)
+                    return FakeResponse(redirects.get(url), body=b'cover')
+
+            uncached = CoverCache(store_dir=temp_dir, database=SimpleDB(f'{temp_dir}/covers.db'))
+            real_client = cover_module.http_client
+            cover_module.http_client = FakeClient()
+            try:
+                assert uncached._download('https://covers.openlibrary.org/b/id/1-M.jpg') == b'cover'
+                assert requested[-1] == 'https://archive.org/download/1/1-M.jpg'
+                for url in ('https://img1.doubanio.com/evil.jpg', 'https://img1.doubanio.com/loop.jpg'):
+                    try:
+                        uncached._download(url)
+                        raise AssertionError(f"{url} 应被拒绝")
+                    except ValueError:
+                        pass
+                assert not any('169.254' in url for url in requested)
+            finally:
+                cover_module.http_client = real_client
+            print("   ✓ 重定向目标也需在允许的域名内")
+            
+            time.sleep(0.01)
+            other = cache.fetch(f'{prefix}/b.jpg')
+            cache.max_bytes = cache._path(other).stat().st_size
+            evicted = cache.prune()
+            assert digest in evicted and other not in evicted
+            assert cache.thumbnail_path(digest) is None and cache.lookup(f'{prefix}/a.jpg') is None
+            assert cache.thumbnail_path(other) is not None
+            print("   ✓ 超出字节预算时淘汰最久未访问的封面")
+        
+        from app import create_app
+        client = create_app().test_client()
+        assert client.get('/covers/' + '0' * 64 + '.webp').status_code == 404
+        assert client.get('/api/cover?url=javascript:alert(1)').status_code == 400
+        assert client.get('/api/cover?url=https://evil.example.com/phish').status_code == 400
+        assert client.get('/api/cover?url=https://doubanio.com.evil.example.com/a.jpg').status_code == 400
+        print("   ✓ 封面路由")
+        
+        return True
+        
+    except Exception as e:
+        print(f"   ❌ 封面缓存测试失败: {e}")
+        return False
+
+def test_task_queue():
+    """测试持久化任务队列的原子领取、租约过期和重启恢复"""
+    print("📬 测试持久化任务队列...")
+    
+    try:
+        import subprocess
+        import tempfile
+        import time
+        import uuid
+        from concurrent.futures import ThreadPoolExecutor
+        from app.models.database import SimpleDB
+        from app.services import task_queue as task_queue_module
+        from app.services.task_manager import TaskManager
+        from app.services.task_queue import TaskQueue
+        
+        original_db = task_queue_module.db
+        with tempfile.TemporaryDirectory() as temp_dir:
+            task_queue_module.db = SimpleDB(f'{temp_dir}/queue.db')
+            try:
+                queue = TaskQueue(lease_seconds=60, max_attempts=2, poll_interval=0.05)
+                task_ids = [str(uuid.uuid4()) for _ in range(20)]
+                for index, task_id in enumerate(task_ids):
+                    queue.enqueue(task_id, 'session', {'file_ids': [f'file-{index}']}, f'2024-01-01T00:00:{index:02d}')
+                
+                with ThreadPoolExecutor(max_workers=4) as executor:
+                    claimed = list(executor.map(lambda _: queue.claim(timeout=0), range(24)))
+                claimed_ids = [task['task_id'] for task in claimed if task]
+                assert sorted(claimed_ids) == sorted(task_ids) and claimed.count(None) == 4
+                assert queue.claim(timeout=0.1) is None
+                print("   ✓ 并发领取时每个任务只被领取一次")
+                
+                assert queue.complete(task_ids[0]) and not queue.complete(task_ids[0])
+                assert queue.cancel(task_ids[1]) and not queue.complete(task_ids[1])
+                assert queue.get(task_ids[1])['status'] == 'cancelled'
+                assert queue.renew() == 18
+                print("   ✓ 完成、取消和续租")
+                
+                # 模拟处理中崩溃的进程：租约属于本机已退出的进程
+                dead = subprocess.Popen([sys.executable, '-c', 'pass'])
+                dead.wait()
+                crashed = TaskQueue(lease_seconds=60, max_attempts=2, poll_interval=0.05)
+                crashed.owner = f'{crashed.hostname}:{dead.pid}:crashed'
+                lost_id = str(uuid.uuid4())
+                crashed.enqueue(lost_id, 'session', {'file_ids': ['lost']}, '2000-01-01T00:00:00')
+                assert crashed.claim(timeout=0)['task_id'] == lost_id
+                
+                restarted = TaskQueue(lease_seconds=60, max_attempts=2, poll_interval=0.05)
+                assert restarted.recover_abandoned() == 1
+                resumed = restarted.claim(timeout=0)
+                assert resumed['task_id'] == lost_id and resumed['attempts'] == 2
+                print("   ✓ 重启后立即恢复已退出进程的任务，并记录尝试次数")
+                
+                # 租约过期且尝试次数用完的任务标记为失败
+                restarted.lease_seconds = 0.05
+                assert restarted.renew() == 1
+                time.sleep(0.1)
+                assert restarted.claim(timeout=0) is None
+                job = queue.get(lost_id)
+                assert job['status'] == 'failed' and job['attempts'] == 2
+                print("   ✓ 超过最大尝试次数的任务标记为失败")
+                
+                # 任务管理器：工作线程恢复内存中没有的任务，状态可从队列读取
+                manager = TaskManager(max_workers=1)
+                manager.queue = TaskQueue(lease_seconds=60, max_attempts=2, poll_interval=0.05)
+                manager._process_task = lambda task_id: manager._fail_task(task_id, ValueError('图片无法识别'))
+                orphan_id = str(uuid.uuid4())
+                manager.queue.enqueue(orphan_id, 'session', {'file_ids': ['orphan'], 'file_paths': []}, '1999-01-01T00:00:00')
+                assert manager.get_task_status(orphan_id)['status'] == 'pending'
+                manager._run_job(manager.queue.claim(timeout=0))
+                assert manager.queue.get(orphan_id)['status'] == 'failed'
+                assert manager.tasks[orphan_id]['error'] == '图片无法识别'
+                manager.tasks.clear()
+                status = manager.get_task_status(orphan_id)
+                assert status['status'] == 'failed' and status['error'] == '图片无法识别' and status['completed_at']
+                assert manager.get_task_status(str(uuid.uuid4())) is None
+                print("   ✓ 工作线程执行队列中的任务，内存中没有时从队列读取状态")
+            finally:
+                task_queue_module.db = original_db
+        
+        return True
+        
+    except Exception as e:
+        print(f"   ❌ 持久化任务队列测试失败: {e}")
+        return False
+
+def test_json_stream_parser():
+    """测试增量JSON数组解析"""
+    print("🧩 测试增量JSON解析...")
+    
+    try:
+        import time
+        from app.services.json_stream import IncrementalJsonArrayParser, extract_json_array
+        
+        text = '```json\n[{"title": "A}[\\"", "tags": [1, {"x": 2}]}, {"title": "B"}]\n``` 说明 {"title": "C"}'
+        
+        # 任意切分的输入都应得到相同结果
+        for step in (1, 5, len(text)):
+            parser = IncrementalJsonArrayParser()
+            books = []
+            for i in range(0, len(text), step):
+                books.extend(parser.feed(text[i:i + step]))
+            assert [book['title'] for book in books] == ['A}["', 'B']
+        print("   ✓ 分段输入")
+        
+        parser = IncrementalJsonArrayParser()
+        assert parser.feed('[{"title": "A"}, {"title": "B"') == [{'title': 'A'}]
+        assert parser.feed('}]') == [{'title': 'B'}]
+        print("   ✓ 对象完成即产出")
+        
+        # 一次性提取：跳过说明文字中的方括号，截断时保留完整对象
+        assert extract_json_array('见[注1]：\n' + text) == [{'title': 'A}["', 'tags': [1, {'x': 2}]}, {'title': 'B'}]
+        assert extract_json_array('[{"title": "A"}, {"title": "B", "au') == [{'title': 'A'}]
+        # 说明文字中未配对的'['不影响后面代码块中的数组
+        assert extract_json_array('注意 [ 部分书脊模糊\n```json\n[{"title":"三体"}]\n```') == [{'title': '三体'}]
+        assert extract_json_array('[ 书脊 ' * 2000 + '[{"title": "A"}, {"title": "B", "au') == [{'title': 'A'}]
+        # 大量未配对的'['只扫描一遍（逐个候选重新扫描到末尾是平方复杂度）
+        started = time.perf_counter()
+        assert extract_json_array('[ ' * 50000 + '[{"title":"三体"}]') == [{'title': '三体'}]
+        assert time.perf_counter() - started < 2
+        print("   ✓ 整段提取")
+        
+        return True
+        
+    except Exception as e:
+        print(f"   ❌ 增量JSON解析测试失败: {e}")
+        return False
+
+def test_resilience():
+    """测试重试与熔断"""
+    print("🛡️ 测试重试与熔断...")
+    
+    try:
+        from app.services.resilience import (
+            CircuitBreaker, CircuitOpenError, ResilientEndpoint, RetryableError, parse_retry_after
+        )
+        
+        assert parse_retry_after('3') == 3.0
+        assert parse_retry_after(None) is None
+        print("   ✓ Retry-After解析")
+        
+        attempts = []
+        
+        def flaky():
+            attempts.append(1)
+            if len(attempts) < 3:
+                raise RetryableError('429', retry_after=0)
+            return 'ok'
+        
+        endpoint = ResilientEndpoint('test', max_retries=3, base_delay=0.001, max_delay=0.01)
+        assert endpoint.call(flaky) == 'ok'
+        assert endpoint.get_stats()['retries'] == 2
+        print("   ✓ 退避重试")
+        
+        def failing():
+            raise RetryableError('503')
+        
+        endpoint = ResilientEndpoint('test', max_retries=0, breaker=CircuitBreaker(failure_threshold=2, recovery_timeout=60))
+        for _ in range(2):
+            try:
+                endpoint.call(failing)
+            except RetryableError:
+                pass
+        try:
+            endpoint.call(failing)
+            assert False, '熔断器未打开'
+        except CircuitOpenError:
+            pass
+        assert endpoint.get_stats()['breaker']['state'] == 'open'
+        print("   ✓ 熔断快速失败")
+
+        import time
+        import requests
+        from app.services.qwen_service import qwen_endpoint
+
+        def read_timeout():
+            attempts.append(1)
+            raise requests.exceptions.ReadTimeout('read timed out')
+
+        attempts.clear()
+        endpoint = ResilientEndpoint('test', max_retries=3, base_delay=0.001, retry_on=qwen_endpoint.retry_on,
+                                     fail_on=qwen_endpoint.fail_on, breaker=CircuitBreaker(failure_threshold=1))
+        try:
+            endpoint.call(read_timeout)
+        except requests.exceptions.ReadTimeout:
+            pass
+        assert len(attempts) == 1 and endpoint.get_stats()['breaker']['state'] == 'open'
+        print("   ✓ 读超时不重试（非幂等请求），计入熔断")
+
+        def connect_timeout():
+            attempts.append(1)
+            raise requests.exceptions.ConnectTimeout('connect timed out')
+
+        attempts.clear()
+        endpoint = ResilientEndpoint('test', max_retries=2, base_delay=0.001, retry_on=qwen_endpoint.retry_on)
+        try:
+            endpoint.call(connect_timeout)
+        except requests.exceptions.ConnectTimeout:
+            pass
+        assert len(attempts) == 3
+        attempts.clear()
+        try:
+            endpoint.call(connect_timeout, deadline=time.monotonic())
+        except requests.exceptions.ConnectTimeout:
+            pass
+        assert len(attempts) == 1
+        print("   ✓ 连接失败重试，不超过总时长")
+
+        import asyncio
+        breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=0.05)
+        breaker.record_failure()
+        time.sleep(0.1)
+        endpoint = ResilientEndpoint('test', max_retries=0, breaker=breaker)
+
+        async def cancel_probe():
+            probe = asyncio.ensure_future(endpoint.call_async(lambda: asyncio.sleep(5)))
+            await asyncio.sleep(0.01)
+            probe.cancel()
+            try:
+                await probe
+            except asyncio.CancelledError:
+                pass
+
+        asyncio.run(cancel_probe())
+        assert breaker.get_state()['state'] == 'half_open' and breaker.allow()
+        print("   ✓ 被取消的探测请求释放探测名额")
+
+        return True
+        
+    except Exception as e:
+        print(f"   ❌ 重试与熔断测试失败: {e}")
+        return False
+
+def test_image_pipeline():
+    """测试图片预处理的目标分辨率"""
+    print("🖼️ 测试图片预处理...")
+    
+    try:
+        import io
+        import tempfile
+        from PIL import Image
+        from app.services.image_pipeline import PATCH_SIZE, fit_to_budget, get_max_pixels, preprocess_image
+        from app.services.qwen_service import QwenService
+        
+        # 默认与旧版本相同：只限制宽度为1920像素
+        assert fit_to_budget(4000, 3000, None) == (1920, 1440)
+        assert fit_to_budget(1200, 3000, None) == (1200, 3000)
+        # 设置token预算时按像素预算缩小并对齐到28像素
+        max_pixels = get_max_pixels(1280)
+        assert max_pixels == 1280 * PATCH_SIZE * PATCH_SIZE
+        width, height = fit_to_budget(4000, 3000, max_pixels)
+        assert width * height <= max_pixels and width % PATCH_SIZE == 0 and height % PATCH_SIZE == 0
+        print("   ✓ 目标分辨率")
+        
+        path = f'{tempfile.mkdtemp()}/shelf.jpg'
+        Image.new('RGB', (4000, 3000), 'white').save(path, format='JPEG')
+        image_bytes, stats = preprocess_image(path, max_pixels=None)
+        assert stats['output_size'] == [1920, 1440] and Image.open(io.BytesIO(image_bytes)).size == (1920, 1440)
+        assert 'process_peak_rss_kb' in stats
+        # 超出单图token上限的部分由服务端缩小，分批时按上限计算
+        assert QwenService()._plan_batches([{'output_size': [1920, 1440]}] * 4) == [[0, 1, 2, 3]]
+        print("   ✓ 预处理输出和分批")
+        
+        return True
+        
+    except Exception as e:
+        print(f"   ❌ 图片预处理测试失败: {e}")
+        return False
+
+def test_tiled_recognition():
+    """测试分块识别的切分、合并和单块失败"""
+    print("🧱 测试分块识别...")
+    
+    try:
+        from app.services.image_pipeline import plan_tiles
+        from app.services.qwen_service import QwenService, merge_tile_books
+        
+        boxes = plan_tiles(3000, 1000, 3, 0.15)
+        assert len(boxes) == 3 and boxes[0][0] == 0 and boxes[-1][2] == 3000
+        assert all(box[1] == 0 and box[3] == 1000 for box in boxes)
+        assert all(left[2] > right[0] for left, right in zip(boxes, boxes[1:]))  # 相邻图块重叠
+        assert plan_tiles(800, 2400, 2, 0.2) == [(0, 0, 800, 1333), (0, 1067, 800, 2400)]
+        print("   ✓ 沿长边切分重叠图块")
+        
+        merged = merge_tile_books([
+            [{'title': '三体', 'author': '刘慈欣', 'confidence': '80', 'isbn': '9787536692930'},
+             {'title': None, 'confidence': 50}],
+            [{'title': '三 体', 'author': '刘慈欣', 'confidence': 95},
+             {'title': '', 'confidence': 60},
+             {'title': '活着', 'author': '余华', 'confidence': 'high'}],
+            [{'title': '三体', 'author': '刘慈欣', 'confidence': 90},
+             {'title': '活着', 'author': '另一位作者', 'confidence': 70}]
+        ])
+        # 相邻图块的重复书取置信度高的并补全字段；没有书名的不合并；作者不同的不合并
+        assert [book['title'] for book in merged] == ['三 体', None, '', '活着', '活着']
+        assert merged[0]['confidence'] == 95 and merged[0]['isbn'] == '9787536692930'
+        print("   ✓ 合并相邻图块的重复识别")
+        
+        service = QwenService()
+        service._process_image = lambda image_path, stats, box=None: box
+        
+        def recognize(box, tier_stats):
+            if box[0] == 1000:
+                raise ValueError('API调用超时，请稍后重试')
+            return [{'title': f'书{box[0]}', 'confidence': 90}]
+        
+        service._recognize_cascade = recognize
+        stats = {}
+        books = service._recognize_tiles('unused.jpg', [(0, 0, 1000, 500), (1000, 0, 2000, 500), (2000, 0, 3000, 500)],
+                                         stats)
+        assert [book['title'] for book in books] == ['书0', '书2000']
+        assert stats['tiling']['failed_tiles'] == 1 and stats['tiles'][1]['error']
+        try:
+            service._recognize_tiles('unused.jpg', [(1000, 0, 2000, 500)], {})
+            assert False, "所有图块都失败时应抛出异常"
+        except ValueError:
+            pass
+        print("   ✓ 单个图块失败时保留其余图块的结果")
+        
+        return True
+        
+    except Exception as e:
+        print(f"   ❌ 分块识别测试失败: {e}")
+        return False
+
+def test_request_body():
+    """测试预分配缓冲区的请求体"""
+    print("📦 测试请求体构造...")
+    
+    try:
+        import base64
+        import json
+        from app.services.qwen_service import qwen_service
+        
+        images = [bytes(range(256)) * 3 + b'x', b'ab']
+        body = qwen_service._build_batch_request_payload(images)
+        content = json.loads(body.buffer)['input']['messages'][0]['content']
+        assert [base64.b64decode(item['image'].split(',', 1)[1]) for item in content[:2]] == images
+        print("   ✓ 图片编码")
+        
+        reader = body.reader()
+        assert len(reader) == len(body)
+        assert b''.join(iter(lambda: reader.read(100), b'')) == bytes(body.buffer)
+        stream_body = body.with_parameters(incremental_output=True)
+        assert json.loads(stream_body.buffer)['parameters']['incremental_output'] is True
+        print("   ✓ 流式读取")
+
+        from app.services.http_client import HttpClient
+        client = HttpClient()
+        assert client.pool_maxsize >= int(os.getenv('TASK_MAX_WORKERS', 3)) * int(os.getenv('QWEN_TILE_PARALLELISM', 3))
+        assert client.pool_maxsize >= int(os.getenv('COVER_FETCH_WORKERS', 2))
+        assert client.session.get_adapter('https://img1.doubanio.com')._pool_maxsize == client.pool_maxsize
+        assert HttpClient(pool_maxsize=2).get_stats()['pool_maxsize'] == 2
+        print("   ✓ 连接池大小覆盖并发")
+
+        return True
+
+    except Exception as e:
+        print(f"   ❌ 请求体测试失败: {e}")
+        return False
+
+def test_logging():
+    """测试日志格式与密钥打码"""
+    print("📝 测试日志...")
+    
+    try:
+        import logging
+        from app.services.log_config import JsonFormatter, TextFormatter, redact
+        
+        assert redact("Authorization: Bearer sk-abc123xyz") == "Authorization: Bearer ***"
+        assert redact("{'Authorization': 'Bearer abc'}") == "{'Authorization': 'Bearer ***'}"
+        print("   ✓ 密钥打码")
+        
+        record = logging.LogRecord('app.test', logging.INFO, __file__, 1, "耗时 %dms", (12,), None)
+        record.task_id = 't1'
+        assert TextFormatter().format(record).endswith("INFO app.test 耗时 12ms task_id=t1")
+        assert '"task_id": "t1"' in JsonFormatter().format(record)
+        print("   ✓ 结构化字段")
+        
+        return True
+        
+    except Exception as e:
+        print(f"   ❌ 日志测试失败: {e}")
+        return False
+
+def test_model_cascade():
+    """测试模型级联策略"""
+    print("🪜 测试模型级联...")
+    
+    try:
+        import tempfile
+        from app.models.database import SimpleDB
+        from app.services import model_cascade
+        from app.services.model_cascade import CascadePolicy, TierStats, validate_cascade_config
+        from app.services.qwen_service import normalize_book_text
+        
+        policy = CascadePolicy(True, 'qwen-vl-plus', 'qwen-vl-max', min_confidence=70, escalate_ratio=0.5)
+        assert policy.needs_escalation([])
+        assert not policy.needs_escalation([{'title': 'A', 'confidence': 40}, {'title': 'B', 'confidence': 90}, {'title': 'C', 'confidence': 80}])
+        assert policy.needs_escalation([{'title': 'A', 'confidence': 40}, {'title': 'B', 'confidence': 90}])
+        assert not CascadePolicy(False, 'qwen-vl-plus', 'qwen-vl-max', 70, 0.5).needs_escalation([])
+        print("   ✓ 升级判断")
+        
+        merged = policy.merge(
+            [{'title': 'A', 'confidence': 40}, {'title': 'B', 'confidence': 90}],
+            [{'title': 'A ', 'confidence': 95}],
+            normalize_book_text
+        )
+        assert [book['title'] for book in merged] == ['A ', 'B']
+        
+        tier_stats = TierStats(policy)
+        tier_stats.record('qwen-vl-max', 12.5, {'input_tokens': 1000, 'output_tokens': 100})
+        assert tier_stats.to_dict()['tiers'][0]['cost'] == 0.0039
+        print("   ✓ 结果合并与费用统计")
+        
+        assert validate_cascade_config('cascade_min_confidence', '65') == '65'
+        assert validate_cascade_config('cascade_enabled', True) == 'true'
+        for key, value in (('cascade_min_confidence', 'high'), ('cascade_min_confidence', 150),
+                           ('cascade_escalate_ratio', '1.5'), ('cascade_enabled', 'yes'),
+                           ('model_prices', {'qwen-vl-max': {'input': 'free'}})):
+            try:
+                validate_cascade_config(key, value)
+                raise AssertionError(f"{key}={value!r} 应被拒绝")
+            except ValueError:
+                pass
+        
+        original_db = model_cascade.db
+        with tempfile.TemporaryDirectory() as temp_dir:
+            model_cascade.db = SimpleDB(f'{temp_dir}/configs.db')
+            try:
+                model_cascade.db.save_config('cascade_min_confidence', 'high')
+                model_cascade.db.save_config('cascade_escalate_ratio', 'many')
+                loaded = CascadePolicy.load('qwen-vl-plus')
+                assert loaded.min_confidence == int(os.getenv('QWEN_CASCADE_MIN_CONFIDENCE', '70'))
+                assert loaded.escalate_ratio == float(os.getenv('QWEN_CASCADE_ESCALATE_RATIO', '0.2'))
+            finally:
+                model_cascade.db = original_db
+        
+        from app import create_app
+        client = create_app().test_client()
+        response = client.post('/api/config', json={'cascade_min_confidence': 'high'})
+        assert response.status_code == 400 and 'cascade_min_confidence' in response.get_json()['error']
+        print("   ✓ 保存时校验级联配置，已保存的无效值退回默认值")
+        
+        return True
+        
+    except Exception as e:
+        print(f"   ❌ 模型级联测试失败: {e}")
+        return False
+
 def test_flask_app():
     """测试Flask应用"""
     print("🌐 测试Flask应用...")
@@ -186,7 +1483,40 @@ def test_flask_app():
             response = client.get('/api/config')
             assert response.status_code == 200
             print("   ✓ API配置接口")
-            
+
+            # 批量识别的图片数有上限
+            from app.services.qwen_service import qwen_service
+            file_ids = [f'file-{i}' for i in range(qwen_service.batch_max_files + 1)]
+            response = client.post('/api/recognize/batch', json={'file_ids': file_ids, 'session_id': 'test'})
+            assert response.status_code == 400 and '最多' in response.get_json()['error']
+            print("   ✓ 批量识别图片数上限")
+
+        # 批量预处理的并发数取预处理进程数，不随图片数增长
+        import io
+        import threading
+        import time
+        from PIL import Image
+        from app.services.image_pipeline import image_preprocessor
+        buffer = io.BytesIO()
+        Image.new('RGB', (64, 48), 'white').save(buffer, format='JPEG')
+        threads = set()
+
+        def process(image_path):
+            threads.add(threading.current_thread().name)
+            time.sleep(0.02)
+            return buffer.getvalue(), {}
+
+        original = image_preprocessor.process, image_preprocessor.max_workers, qwen_service.api_key
+        image_preprocessor.process, image_preprocessor.max_workers, qwen_service.api_key = process, 2, None
+        try:
+            qwen_service.recognize_books_batch([f'{i}.jpg' for i in range(6)])
+        except ValueError:
+            pass  # 未配置API Key
+        finally:
+            image_preprocessor.process, image_preprocessor.max_workers, qwen_service.api_key = original
+        assert len(threads) <= 2
+        print("   ✓ 批量预处理并发数")
+
         return True
         
     except Exception as e:
@@ -204,6 +1534,27 @@ def main():
         test_database,
         test_file_manager,
         test_export_service,
+        test_recognition_cache,
+        test_enrichment_cache,
+        test_single_flight,
+        test_provider_search,
+        test_enrichment_pool,
+        test_ordered_enrichment,
+        test_async_engine,
+        test_book_catalog,
+        test_isbn_lookup,
+        test_fuzzy_cache_keys,
+        test_negative_cache_and_health,
+        test_provider_chain,
+        test_cover_cache,
+        test_task_queue,
+        test_json_stream_parser,
+        test_resilience,
+        test_image_pipeline,
+        test_tiled_recognition,
+        test_request_body,
+        test_logging,
+        test_model_cascade,
         test_flask_app
     ]
     